@@ -1,5 +1,11 @@
+import datetime
+from collections import Counter
+
 from django.contrib import admin
-from .models import Author, Genre, Book, BookInstance
+from django.db.models import Prefetch
+from .circulation import bulk_renew, bulk_return
+from .models import Author, Genre, Book, BookInstance, Hold
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 # admin.site.register(Book)
@@ -18,6 +24,8 @@ class AuthorAdmin(admin.ModelAdmin):
     # （如上面的“日期”字段中所示）。
     fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death')]
     # 還可以使用 exclude 屬性來聲明要從表單中排除的屬性列表（將顯示模型中的所有其他屬性）。
+    # BookAdmin 的 autocomplete_fields 需要
+    search_fields = ['last_name', 'first_name']
 
 # Register the admin class with the associated model
 admin.site.register(Author, AuthorAdmin)
@@ -25,6 +33,16 @@ admin.site.register(Author, AuthorAdmin)
 # Inline editing of associated records
 class BooksInstanceInline(admin.TabularInline):
     model = BookInstance
+    extra = 0
+    # 每一列的 borrower 若是下拉選單，就會列出全部讀者 (每列一次查詢)；
+    # 這裡唯讀顯示，要改借閱人請點 change link 到副本頁面
+    # 每列的標題是 BookInstance.__str__ (會讀 book.title)，book 也要一起 select_related
+    fields = ('imprint', 'status', 'due_back', 'borrower')
+    readonly_fields = ('borrower',)
+    show_change_link = True
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('book', 'borrower')
 
 # 現在我們要創造並註冊新的模型；為了達到示範的目的，我們會使用 @register 裝飾器替代先前做法來註冊模型
 # (這跟 admin.site.register() 的語法做的事情完全一樣)：
@@ -32,8 +50,16 @@ class BooksInstanceInline(admin.TabularInline):
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     # pass
-    list_display = ('title', 'author', 'display_genre')
+    list_display = ('title', 'author', 'display_genre', 'copies_available', 'copies_total')
     inlines = [BooksInstanceInline]
+    # 作者用 JOIN 取回；display_genre 的 genre.all()[:3] 由 get_queryset 的 prefetch 供應，不會每列查一次
+    list_select_related = ('author',)
+    search_fields = ['title', 'isbn']
+    autocomplete_fields = ['author']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('genre', queryset=Genre.objects.only('id', 'name')))
 
 # Register the Admin classes for BookInstance using the decorator
 @admin.register(BookInstance)
@@ -43,6 +69,35 @@ class BookInstanceAdmin(admin.ModelAdmin):
     # 當你的列表有很多個記錄時, 加入列表過濾器可以幫助你過濾想顯示的記錄。加入list_filter這個屬性就可以。
     list_filter = ('status', 'due_back')
 
+    # book / borrower 用 JOIN 一起取回；編輯頁用 autocomplete，不必把所有書與讀者塞進下拉選單
+    list_select_related = ('book', 'borrower')
+    autocomplete_fields = ['book', 'borrower']
+    # 副本資料表很大時，不篩選的列表用資料庫估計的列數分頁，不做 COUNT(*)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # 批次操作：勾選的書一次歸還 / 續借，各只用一個 UPDATE
+    actions = ['mark_returned', 'renew_three_weeks']
+
+    def has_mark_returned_permission(self, request):
+        return request.user.has_perm('catalog.can_mark_returned')
+
+    def _report(self, request, results):
+        summary = ', '.join(f'{count} {result}' for result, count in sorted(Counter(results.values()).items()))
+        self.message_user(request, f'Copies: {summary}.')
+
+    def mark_returned(self, request, queryset):
+        self._report(request, bulk_return(queryset.values_list('pk', flat=True)))
+    mark_returned.short_description = 'Mark selected copies as returned'
+    mark_returned.allowed_permissions = ('mark_returned',)
+
+    def renew_three_weeks(self, request, queryset):
+        # 三週後，符合 RenewBookForm 的規則 (不得超過四週)
+        due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        self._report(request, bulk_renew(queryset.values_list('pk', flat=True), due_back))
+    renew_three_weeks.short_description = 'Renew selected loans for three weeks'
+    renew_three_weeks.allowed_permissions = ('mark_returned',)
+
     # Sectioning the detail view
     # You can add "sections" to group related model information within the detail form, using the fieldsets attribute.
     # In the BookInstance model we have information related to what the book is (i.e. name, imprint, and id) and when it will be available (status, due_back). We can add these in different sections by adding the text in bold to our BookInstanceAdmin class.
@@ -57,6 +112,11 @@ class BookInstanceAdmin(admin.ModelAdmin):
     # Each section has its own title (or None, if you don't want a title) and an associated tuple of fields in a dictionary — the format is complicated to describe, but fairly easy to understand if you look at the code fragment immediately above.
 
 
-
-
-
+# 預約佇列：唯讀檢視為主，借出 / 歸還 / 預約請用 catalog/circulation.py 的服務，才會正確遞補下一位
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'patron', 'status', 'created_at', 'ready_at', 'book_instance')
+    list_filter = ('status',)
+    list_select_related = ('book', 'patron', 'book_instance__book')
+    autocomplete_fields = ['book', 'patron']
+    raw_id_fields = ['book_instance']
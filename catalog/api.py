@@ -0,0 +1,214 @@
+"""
+A read-only JSON API over the catalog: books, authors, genres and copy availability.
+
+Rows are read with values() for just the fields asked for (?fields=a,b,c), so
+no model instances are built. Every successful response carries an ETag
+derived from the version stamps of the models it reads (see
+catalog/caching.py); a client that sends it back in If-None-Match gets 304
+Not Modified without a single database query.
+
+Lists are ordered by id and paged with ?after=<last id>&limit=<n>.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.http import JsonResponse
+from django.views.decorators.http import condition, require_safe
+
+from . import caching
+from .availability import STATUS_FIELDS
+from .models import Author, Book, BookInstance, Genre
+
+DEFAULT_LIMIT = 100
+# 書的 genres 用一個 IN (...) 查詢取回，SQLite 最多 999 個參數
+MAX_LIMIT = 500
+# SQLite 的整數是 64 位元有號整數，超出範圍的參數會讓查詢直接拋 OverflowError
+MAX_ID = 2 ** 63 - 1
+
+# 公開欄位名稱 -> values() 的 lookup
+BOOK_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'summary': 'summary',
+    'isbn': 'isbn',
+    'isbn13': 'isbn13',
+    'author': 'author_id',
+    'author_first_name': 'author__first_name',
+    'author_last_name': 'author__last_name',
+    'genres': None,  # list of genre ids, read from the through table
+    'copies_total': 'copies_total',
+    'copies_available': 'copies_available',
+}
+BOOK_DEFAULT_FIELDS = ('id', 'title', 'author', 'isbn', 'copies_available')
+
+AUTHOR_FIELDS = {name: name for name in ('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death')}
+AUTHOR_DEFAULT_FIELDS = tuple(AUTHOR_FIELDS)
+
+GENRE_FIELDS = {'id': 'id', 'name': 'name'}
+GENRE_DEFAULT_FIELDS = tuple(GENRE_FIELDS)
+
+COPY_FIELDS = {name: name for name in ('id', 'imprint', 'status', 'due_back')}
+COPY_DEFAULT_FIELDS = tuple(COPY_FIELDS)
+
+BOOK_LABELS = (caching.BOOK, caching.AUTHOR, caching.GENRE, caching.BOOKINSTANCE)
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(status, detail):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def _selected_fields(request, fields, default):
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    selected = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in selected if name not in fields]
+    if unknown or not selected:
+        raise BadRequest(f'Unknown fields: {", ".join(unknown)}. Available: {", ".join(fields)}.')
+    return selected
+
+
+def _values(queryset, fields, selected):
+    """Read `selected` (public names) with values(), always including the id, and rename the keys."""
+    lookups = {'id': 'id'}
+    lookups.update((name, fields[name]) for name in selected if fields[name])
+    rows = []
+    for row in queryset.values(*lookups.values()):
+        rows.append({name: row[lookup] for name, lookup in lookups.items()})
+    return rows
+
+
+def _add_genres(rows):
+    through = Book.genre.through
+    genres = {row['id']: [] for row in rows}
+    pairs = through.objects.filter(book_id__in=list(genres)).order_by('genre_id').values_list('book_id', 'genre_id')
+    for book_id, genre_id in pairs:
+        genres[book_id].append(genre_id)
+    for row in rows:
+        row['genres'] = genres[row['id']]
+
+
+def _shape(rows, selected):
+    return [{name: row[name] for name in selected} for row in rows]
+
+
+def _id(value):
+    """An integer id from the query string; ValueError when no row could have it."""
+    value = int(value)
+    if abs(value) > MAX_ID:
+        raise ValueError(value)
+    return value
+
+
+def _page(request, queryset, fields, default, after_type=_id):
+    """One page of `queryset` as {'results': [...], 'next': url or None}."""
+    selected = _selected_fields(request, fields, default)
+    try:
+        limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        after = request.GET.get('after')
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after_type(after))
+    except ValueError:
+        raise BadRequest('Invalid after or limit.')
+
+    rows = _values(queryset.order_by('pk')[:limit + 1], fields, selected)
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    if 'genres' in selected:
+        _add_genres(rows)
+
+    next_url = None
+    if has_next:
+        params = request.GET.copy()
+        params['after'] = str(rows[-1]['id'])
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    return {'results': _shape(rows, selected), 'next': next_url}
+
+
+def _detail(request, queryset, fields, default, pk):
+    selected = _selected_fields(request, fields, default)
+    if pk > MAX_ID:
+        return _error(404, 'Not found.')
+    rows = _values(queryset.filter(pk=pk), fields, selected)
+    if not rows:
+        return _error(404, 'Not found.')
+    if 'genres' in selected:
+        _add_genres(rows)
+    return JsonResponse(_shape(rows, selected)[0])
+
+
+def _versioned(*labels):
+    """
+    Conditional GET keyed on the version stamps of `labels`: the ETag hashes
+    the full path with the stamps. No Last-Modified: it has whole-second
+    resolution, so two changes within one second would look like one.
+    """
+    def etag(request, *args, **kwargs):
+        stamps = ':'.join(repr(version) for version in caching.get_versions(*labels))
+        return hashlib.md5(f'{request.get_full_path()}:{stamps}'.encode()).hexdigest()
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def view(request, *args, **kwargs):
+            try:
+                return view_func(request, *args, **kwargs)
+            except BadRequest as e:
+                return _error(400, str(e))
+
+        # 不經過 read replica：ETag 是現在的版本戳記，內容也必須是主資料庫上的最新資料
+        conditional = condition(etag_func=etag)(view)
+
+        @wraps(view_func)
+        def versioned(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            # 錯誤 (400 / 404) 不帶 ETag，免得被當成可快取的結果
+            if response.status_code not in (200, 304) and response.has_header('ETag'):
+                del response['ETag']
+            return response
+        return require_safe(versioned)
+    return decorator
+
+
+@_versioned(*BOOK_LABELS)
+def book_list(request):
+    return JsonResponse(_page(request, Book.objects.all(), BOOK_FIELDS, BOOK_DEFAULT_FIELDS))
+
+
+@_versioned(*BOOK_LABELS)
+def book_detail(request, pk):
+    return _detail(request, Book.objects.all(), BOOK_FIELDS, BOOK_DEFAULT_FIELDS, pk)
+
+
+@_versioned(caching.AUTHOR)
+def author_list(request):
+    return JsonResponse(_page(request, Author.objects.all(), AUTHOR_FIELDS, AUTHOR_DEFAULT_FIELDS))
+
+
+@_versioned(caching.AUTHOR)
+def author_detail(request, pk):
+    return _detail(request, Author.objects.all(), AUTHOR_FIELDS, AUTHOR_DEFAULT_FIELDS, pk)
+
+
+@_versioned(caching.GENRE)
+def genre_list(request):
+    return JsonResponse(_page(request, Genre.objects.all(), GENRE_FIELDS, GENRE_DEFAULT_FIELDS))
+
+
+@_versioned(caching.BOOK, caching.BOOKINSTANCE)
+def book_copies(request, pk):
+    """Per-status copy counts of a book (from its counters) and its copies, paged by copy id."""
+    counts = Book.objects.filter(pk=pk).values(*STATUS_FIELDS.values()).first() if pk <= MAX_ID else None
+    if counts is None:
+        return _error(404, 'Not found.')
+    page = _page(request, BookInstance.objects.filter(book_id=pk), COPY_FIELDS, COPY_DEFAULT_FIELDS,
+                 after_type=uuid.UUID)
+    return JsonResponse({
+        'book': pk,
+        'counts': {status: counts[field] for status, field in STATUS_FIELDS.items()},
+        **page,
+    })
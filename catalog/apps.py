@@ -3,3 +3,17 @@ from django.apps import AppConfig
 
 class CatalogConfig(AppConfig):
     name = 'catalog'
+
+    def ready(self):
+        # Connect the signal handlers defined in catalog/signals.py
+        from . import signals  # noqa: F401
+        # Register the deploy checks in catalog/checks.py
+        from . import checks  # noqa: F401
+
+        from django.conf import settings
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+        from .db import close_unusable_connections, configure_sqlite
+        connection_created.connect(configure_sqlite)
+        if getattr(settings, 'CATALOG_DB_HEALTH_CHECKS', False):
+            request_started.connect(close_unusable_connections)
@@ -0,0 +1,85 @@
+"""
+Maintenance of the per-book availability counters (Book.copies_*).
+
+The counters change with F() expressions in the same transaction as the
+BookInstance change, so concurrent updates never overwrite each other.
+recount_availability() recomputes them from the BookInstance table, for
+repairing drift.
+"""
+from collections import defaultdict
+
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Book, BookInstance
+
+# BookInstance.status -> Book counter
+STATUS_FIELDS = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+    'm': 'copies_maintenance',
+    'r': 'copies_reserved',
+}
+
+COUNTER_FIELDS = Book.COUNTER_FIELDS
+
+
+def copy_deltas(book_id, status, delta):
+    """The counter deltas for adding (delta=1) or removing (delta=-1) one copy."""
+    if book_id is None:
+        return {}
+    deltas = {(book_id, 'copies_total'): delta}
+    if status in STATUS_FIELDS:
+        deltas[(book_id, STATUS_FIELDS[status])] = delta
+    return deltas
+
+
+def merge_deltas(*many):
+    merged = defaultdict(int)
+    for deltas in many:
+        for key, delta in deltas.items():
+            merged[key] += delta
+    return {key: delta for key, delta in merged.items() if delta}
+
+
+def apply_deltas(deltas, chunk_size=100):
+    """
+    Apply {(book_id, counter field): delta} with one UPDATE per `chunk_size` books.
+
+    Each counter becomes F(field) + CASE WHEN id = ... THEN delta ... END, so a
+    single statement covers many books; the chunking keeps the number of query
+    parameters within SQLite's limit.
+    """
+    per_book = defaultdict(dict)
+    for (book_id, field), delta in deltas.items():
+        if delta:
+            per_book[book_id][field] = delta
+    book_ids = list(per_book)
+    for start in range(0, len(book_ids), chunk_size):
+        chunk = book_ids[start:start + chunk_size]
+        fields = {field for book_id in chunk for field in per_book[book_id]}
+        changes = {
+            field: F(field) + Case(
+                *[When(pk=book_id, then=Value(per_book[book_id][field]))
+                  for book_id in chunk if field in per_book[book_id]],
+                default=Value(0), output_field=IntegerField())
+            for field in fields
+        }
+        Book.objects.filter(pk__in=chunk).update(**changes)
+
+
+def recount_availability(books=None):
+    """
+    Recompute the counters of `books` (a Book queryset, default all books) from
+    the BookInstance rows, in one UPDATE that only touches books whose counters
+    have drifted. Returns the number of books repaired.
+    """
+    def count(condition=Q()):
+        copies = (BookInstance.objects.filter(condition, book=OuterRef('pk')).order_by()
+                  .values('book').annotate(n=Count('pk')).values('n'))
+        return Coalesce(Subquery(copies, output_field=IntegerField()), Value(0))
+
+    actual = {'copies_total': count()}
+    actual.update((field, count(Q(status=status))) for status, field in STATUS_FIELDS.items())
+    books = Book.objects.all() if books is None else books
+    return books.exclude(**actual).update(**actual)
@@ -0,0 +1,17 @@
+"""
+SQLite backend whose transactions start with BEGIN IMMEDIATE.
+
+With a plain (deferred) BEGIN a transaction that reads and then writes, like
+every circulation service, holds only a read lock until its first write. If
+another connection committed a write in between, the upgrade fails at once
+with "database is locked" and the busy timeout never applies. Taking the
+write lock up front makes such transactions queue on the busy timeout
+instead. Selected by default in settings.py while SQLite tuning is on.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,142 @@
+"""
+Helpers shared by the benchmark management commands: a throwaway database, a
+deterministic generator for a large catalog, and latency / query recording
+for the request driver in `manage.py bench_catalog`.
+"""
+import contextlib
+import datetime
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .availability import STATUS_FIELDS
+from .isbn import isbn13_check_digit
+from .models import Author, Book, BookInstance, Genre
+
+
+@contextlib.contextmanager
+def throwaway_database(verbosity=0):
+    """Create a fresh, migrated test database for the duration of the block, then destroy it."""
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def seed_catalog(authors=1000, books=10000, genres=20, copies_per_book=3, borrowers=100,
+                 loan_ratio=0.3, seed=0, batch_size=5000):
+    """
+    Fill an empty database with a synthetic catalog and return the row counts.
+
+    Rows are generated `batch_size` books at a time. Primary keys are assigned
+    here because bulk_create() cannot return them on every backend, so this
+    must run against an empty database.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    status_choices = ['a', 'm', 'r']
+
+    with transaction.atomic():
+        Genre.objects.bulk_create([Genre(id=i, name=f'Genre {i}') for i in range(1, genres + 1)])
+        User.objects.bulk_create([User(id=i, username=f'patron{i}', password='!') for i in range(1, borrowers + 1)])
+        Author.objects.bulk_create([
+            Author(id=i, first_name=f'First{rng.randrange(authors)}', last_name=f'Last{rng.randrange(authors)}',
+                   date_of_birth=today - datetime.timedelta(days=rng.randrange(20000, 30000)))
+            for i in range(1, authors + 1)])
+
+        through = Book.genre.through
+        for start in range(1, books + 1, batch_size):
+            ids = range(start, min(start + batch_size, books + 1))
+            copies, book_objs = [], []
+            for i in ids:
+                isbn = f'978{i:09d}'
+                isbn += isbn13_check_digit(isbn)
+                book = Book(id=i, title=f'Title {rng.randrange(books)} {i}', summary=f'Summary of book {i}',
+                            isbn=isbn, isbn13=isbn, author_id=rng.randint(1, authors), copies_total=copies_per_book)
+                for _ in range(copies_per_book):
+                    if borrowers and rng.random() < loan_ratio:
+                        copy = BookInstance(
+                            book_id=i, imprint='Imprint', status='o', borrower_id=rng.randint(1, borrowers),
+                            due_back=today + datetime.timedelta(days=rng.randint(-30, 30)))
+                    else:
+                        copy = BookInstance(book_id=i, imprint='Imprint', status=rng.choice(status_choices))
+                    copies.append(copy)
+                    # bulk_create() 不會觸發 signals，計數器在這裡算好
+                    field = STATUS_FIELDS[copy.status]
+                    setattr(book, field, getattr(book, field) + 1)
+                book_objs.append(book)
+            Book.objects.bulk_create(book_objs)
+            through.objects.bulk_create([
+                through(book_id=i, genre_id=genre_id)
+                for i in ids for genre_id in rng.sample(range(1, genres + 1), min(2, genres))])
+            BookInstance.objects.bulk_create(copies)
+
+    return {
+        'authors': authors,
+        'books': books,
+        'genres': genres,
+        'copies': books * copies_per_book,
+        'borrowers': borrowers,
+    }
+
+
+def time_callable(func, repeat=5):
+    """Run func `repeat` times and return the timings in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    return {
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def latency_summary(timings):
+    return {
+        'requests': len(timings),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p90_ms': round(percentile(timings, 90), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+class QueryRecorder:
+    """A connection.execute_wrapper() hook that records every statement with its parameters."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def count_rows(queries):
+    """Re-run the SELECTs among `queries` wrapped in COUNT(*) and return how many rows they fetched."""
+    total = 0
+    with connection.cursor() as cursor:
+        for sql, params in queries:
+            if sql.lstrip().upper().startswith('SELECT'):
+                cursor.execute(f'SELECT COUNT(*) FROM ({sql}) rows_fetched', params)
+                total += cursor.fetchone()[0]
+    return total
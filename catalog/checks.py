@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+from django.template import engines
+from django.template.backends.django import DjangoTemplates
+from django.template.loaders.cached import Loader as CachedLoader
+
+
+@register(Tags.templates, deploy=True)
+def check_cached_template_loader(app_configs, **kwargs):
+    """Warn (on `check --deploy`) when production templates are parsed again on every render."""
+    if settings.DEBUG:
+        return []
+    errors = []
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        if not any(isinstance(loader, CachedLoader) for loader in engine.engine.template_loaders):
+            errors.append(Warning(
+                f'Template engine {engine.name!r} does not use the cached template loader.',
+                hint="Wrap its loaders in 'django.template.loaders.cached.Loader' when DEBUG is off.",
+                id='catalog.W001',
+            ))
+    return errors
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_version_cache(app_configs, **kwargs):
+    """
+    Warn (on `check --deploy`) when the version stamps of catalog/caching.py
+    live in a per-process cache: a bump from a management command or another
+    worker is never seen, so cached pages and API ETags stay stale.
+    """
+    backend = caches['default']
+    if not isinstance(backend, (LocMemCache, DummyCache)):
+        return []
+    page_cache = getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 60 * 10)
+    uses = 'the anonymous page cache and the API ETags' if page_cache else 'the API ETags'
+    return [Warning(
+        f'The default cache ({type(backend).__name__}) is not shared between processes, but {uses} '
+        f'depend on the catalog version stamps kept in it.',
+        hint='Set DJANGO_CACHE_BACKEND (and DJANGO_CACHE_LOCATION) to a shared backend: memcached, redis, '
+             'the database or file based cache.',
+        id='catalog.W002',
+    )]
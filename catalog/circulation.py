@@ -0,0 +1,264 @@
+"""
+Circulation operations: checkout, return and the hold queue, plus bulk
+renew/return of many copies at once.
+
+Every status change is a conditional UPDATE (... WHERE status = <expected>),
+so when two requests race for the same copy exactly one of them updates the
+row and the other sees 0 rows changed; no copy is ever lent twice, on any
+backend. The bulk operations read the current status of the requested copies
+once, apply the change with a single UPDATE ... WHERE id IN (...), and return
+a per-copy result.
+
+QuerySet.update() bypasses the model signals, so anything derived from
+BookInstance status (the Book availability counters, the home page counters,
+the page cache versions) is refreshed here instead.
+
+Every checkout, renewal and return also appends a CirculationEvent in the
+same transaction, so the loan history survives the copy being overwritten;
+`manage.py rollup_circulation` aggregates the events into daily summaries.
+"""
+import datetime
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .availability import apply_deltas, copy_deltas, merge_deltas
+from .caching import BOOKINSTANCE, bump_versions
+from .models import BookInstance, CirculationEvent, Hold
+from .stats import invalidate_catalog_stats
+
+RENEWED = 'renewed'
+RETURNED = 'returned'
+NOT_FOUND = 'not found'
+NOT_ON_LOAN = 'not on loan'
+
+# SQLite 一個 IN (...) 最多 999 個參數
+_CHUNK = 500
+
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+
+class CirculationError(Exception):
+    pass
+
+
+class NoCopyAvailable(CirculationError):
+    pass
+
+
+class AlreadyOnHold(CirculationError):
+    pass
+
+
+def _chunked(values):
+    values = list(values)
+    for start in range(0, len(values), _CHUNK):
+        yield values[start:start + _CHUNK]
+
+
+def _current_status(ids):
+    """
+    Return {pk: (book_id, status, borrower_id)} for the copies that exist,
+    locking them where the backend supports it.
+    """
+    current = {}
+    for chunk in _chunked(ids):
+        rows = (BookInstance.objects.select_for_update().filter(pk__in=chunk)
+                .values_list('pk', 'book_id', 'status', 'borrower_id'))
+        current.update((pk, (book_id, status, borrower_id)) for pk, book_id, status, borrower_id in rows)
+    return current
+
+
+def record_events(events):
+    """Append CirculationEvents ([(kind, copy_id, book_id, borrower_id, due_back)]) to the loan history."""
+    now = timezone.now()
+    CirculationEvent.objects.bulk_create([
+        CirculationEvent(kind=kind, book_instance_id=copy_id, book_id=book_id, borrower_id=borrower_id,
+                         due_back=due_back, created_at=now)
+        for kind, copy_id, book_id, borrower_id, due_back in events])
+
+
+def loan_events(copy_id, book_id, previous, current):
+    """
+    The events for a copy changing from `previous` to `current` (both
+    (status, borrower_id, due_back)), for changes saved outside this module.
+    """
+    (old_status, old_borrower, old_due), (status, borrower, due_back) = previous, current
+    on_loan, was_on_loan = status == 'o', old_status == 'o'
+    events = []
+    if was_on_loan and (not on_loan or borrower != old_borrower):
+        events.append((CirculationEvent.RETURN, copy_id, book_id, old_borrower, None))
+    if on_loan and (not was_on_loan or borrower != old_borrower):
+        events.append((CirculationEvent.CHECKOUT, copy_id, book_id, borrower, due_back))
+    elif on_loan and due_back != old_due:
+        events.append((CirculationEvent.RENEWAL, copy_id, book_id, borrower, due_back))
+    return events
+
+
+def _status_changed(copies, new_status):
+    """Refresh what is derived from the status of `copies` ([(book_id, old status)])."""
+    apply_deltas(merge_deltas(*(
+        merge_deltas(copy_deltas(book_id, status, -1), copy_deltas(book_id, new_status, 1))
+        for book_id, status in copies)))
+    transaction.on_commit(invalidate_catalog_stats)
+    transaction.on_commit(partial(bump_versions, BOOKINSTANCE))
+
+
+def _apply(ids, result, **changes):
+    """Update every copy in `ids` that is on loan and return {pk: result or the reason it was skipped}."""
+    ids = list(dict.fromkeys(ids))
+    with transaction.atomic():
+        current = _current_status(ids)
+        eligible = [pk for pk in ids if pk in current and current[pk][1] == 'o']
+        for chunk in _chunked(eligible):
+            BookInstance.objects.filter(pk__in=chunk, status__exact='o').update(**changes)
+        kind = CirculationEvent.RETURN if 'status' in changes else CirculationEvent.RENEWAL
+        record_events((kind, pk, current[pk][0], current[pk][2], changes['due_back']) for pk in eligible)
+        if eligible and 'status' in changes:
+            _status_changed([current[pk][:2] for pk in eligible], changes['status'])
+            if changes['status'] == 'a':
+                _promote_holds([(pk, current[pk][0]) for pk in eligible])
+        elif eligible:
+            transaction.on_commit(partial(bump_versions, BOOKINSTANCE))
+    results = {}
+    for pk in ids:
+        if pk not in current:
+            results[pk] = NOT_FOUND
+        elif current[pk][1] != 'o':
+            results[pk] = NOT_ON_LOAN
+        else:
+            results[pk] = result
+    return results
+
+
+def copy_titles(ids):
+    """Return {pk: book title} for the given copies, for reporting results."""
+    titles = {}
+    for chunk in _chunked(ids):
+        titles.update(BookInstance.objects.filter(pk__in=chunk).values_list('pk', 'book__title'))
+    return titles
+
+
+def renew(copy_id, due_back):
+    """Move the due date of one copy on loan to `due_back`; False when the copy is not on loan."""
+    return _apply([copy_id], RENEWED, due_back=due_back)[copy_id] == RENEWED
+
+
+def bulk_renew(ids, due_back):
+    """Move the due date of every listed copy that is on loan to `due_back`."""
+    return _apply(ids, RENEWED, due_back=due_back)
+
+
+def bulk_return(ids):
+    """Mark every listed copy that is on loan as returned: available, no borrower, no due date."""
+    return _apply(ids, RETURNED, status='a', borrower=None, due_back=None)
+
+
+def _claim(copy_id, expected, **changes):
+    """Change one copy only if its status is still `expected`; True when this call won the row."""
+    return BookInstance.objects.filter(pk=copy_id, status__exact=expected).update(**changes) == 1
+
+
+def _next_hold(book_id, copy_id):
+    """Give `copy_id` (just made available) to the first waiting hold on the book, if any."""
+    for hold_id in Hold.objects.filter(book_id=book_id, status=Hold.WAITING).values_list('pk', flat=True):
+        # 同一個預約可能同時被另一個歸還搶走，條件式 UPDATE 確保只會成功一次
+        if Hold.objects.filter(pk=hold_id, status=Hold.WAITING).update(
+                status=Hold.READY, book_instance_id=copy_id, ready_at=timezone.now()):
+            if _claim(copy_id, 'a', status='r'):
+                _status_changed([(book_id, 'a')], 'r')
+                return hold_id
+            # 副本已被別人借走，把預約放回佇列
+            Hold.objects.filter(pk=hold_id).update(status=Hold.WAITING, book_instance=None, ready_at=None)
+            return None
+    return None
+
+
+def _promote_holds(copies):
+    """Offer each of `copies` ([(pk, book_id)], now available) to its book's hold queue."""
+    waiting = set()
+    for chunk in _chunked({book_id for _, book_id in copies}):
+        waiting.update(Hold.objects.filter(book_id__in=chunk, status=Hold.WAITING)
+                       .values_list('book_id', flat=True).distinct())
+    for pk, book_id in copies:
+        if book_id in waiting and _next_hold(book_id, pk) is None:
+            waiting.discard(book_id)
+
+
+def checkout(book_id, patron, due_back=None):
+    """
+    Lend a copy of the book to `patron` and return its pk: the copy held for
+    them if their hold is ready, otherwise any available copy. Raises
+    NoCopyAvailable when every copy is taken.
+    """
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    with transaction.atomic():
+        ready = (Hold.objects.filter(book_id=book_id, patron=patron, status=Hold.READY)
+                 .values_list('pk', 'book_instance_id').first())
+        if ready and _claim(ready[1], 'r', status='o', borrower=patron, due_back=due_back):
+            copy_id, old_status = ready[1], 'r'
+        else:
+            # 先挑一本可借的副本，再以 WHERE status='a' 搶下它；被別人搶走就換下一本
+            for copy_id in BookInstance.objects.filter(book_id=book_id, status__exact='a').order_by().values_list(
+                    'pk', flat=True):
+                if _claim(copy_id, 'a', status='o', borrower=patron, due_back=due_back):
+                    old_status = 'a'
+                    break
+            else:
+                raise NoCopyAvailable(f'No copy of book {book_id} is available.')
+        Hold.objects.filter(book_id=book_id, patron=patron, status__in=Hold.ACTIVE).update(status=Hold.FULFILLED)
+        _status_changed([(book_id, old_status)], 'o')
+        record_events([(CirculationEvent.CHECKOUT, copy_id, book_id, patron.pk, due_back)])
+    return copy_id
+
+
+def return_copy(copy_id):
+    """
+    Check a copy back in. It goes to the first waiting hold on its book (as
+    Reserved) or back on the shelf. Returns False when the copy was not on loan.
+    """
+    with transaction.atomic():
+        # 搶下之後 borrower 就被清掉了，先鎖住副本讀出來
+        book_id, borrower_id = (BookInstance.objects.select_for_update().filter(pk=copy_id)
+                                .values_list('book_id', 'borrower_id').first() or (None, None))
+        if not _claim(copy_id, 'o', status='a', borrower=None, due_back=None):
+            return False
+        _status_changed([(book_id, 'o')], 'a')
+        record_events([(CirculationEvent.RETURN, copy_id, book_id, borrower_id, None)])
+        _next_hold(book_id, copy_id)
+    return True
+
+
+def reserve(book_id, patron):
+    """
+    Put `patron` in the hold queue for the book and return the Hold. When a
+    copy is on the shelf (and nobody is queued ahead) it is set aside at once
+    and the hold is ready. Raises AlreadyOnHold for a second active hold.
+    """
+    try:
+        with transaction.atomic():
+            hold = Hold.objects.create(book_id=book_id, patron=patron)
+            if not Hold.objects.filter(book_id=book_id, status=Hold.WAITING, pk__lt=hold.pk).exists():
+                for copy_id in BookInstance.objects.filter(book_id=book_id, status__exact='a').order_by().values_list(
+                        'pk', flat=True):
+                    if _next_hold(book_id, copy_id) == hold.pk:
+                        hold.refresh_from_db()
+                        break
+    except IntegrityError:
+        raise AlreadyOnHold(f'Patron {patron.pk} already has an active hold on book {book_id}.')
+    return hold
+
+
+def cancel_hold(hold_id):
+    """Cancel a hold; a copy it was holding goes to the next hold in the queue or back on the shelf."""
+    with transaction.atomic():
+        hold = Hold.objects.filter(pk=hold_id, status__in=Hold.ACTIVE).values_list('book_id', 'book_instance_id').first()
+        if hold is None or not Hold.objects.filter(pk=hold_id, status__in=Hold.ACTIVE).update(
+                status=Hold.CANCELLED, book_instance=None):
+            return False
+        book_id, copy_id = hold
+        if copy_id and _claim(copy_id, 'r', status='a'):
+            _status_changed([(book_id, 'r')], 'a')
+            _next_hold(book_id, copy_id)
+    return True
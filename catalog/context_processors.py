@@ -0,0 +1,52 @@
+"""
+Context for the sidebar of base_generic.html.
+
+The sidebar is rendered as two cached fragments ({% cache %}), keyed on
+sidebar_key: 'anonymous', 'user', or for staff a hash of their catalog
+permissions, so each kind of visitor shares one rendered copy and the
+{% url %} tags inside only run on a cache miss. The few links outside the
+fragments (they carry the user name or ?next=) use sidebar_urls, reversed
+once per URLconf instead of on every render.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.urls import get_urlconf, reverse
+from django.utils.functional import SimpleLazyObject
+
+SIDEBAR_URL_NAMES = ('my-borrowed', 'login', 'logout')
+
+
+@lru_cache(maxsize=None)
+def sidebar_urls(urlconf=None):
+    return {name.replace('-', '_'): reverse(name, urlconf=urlconf) for name in SIDEBAR_URL_NAMES}
+
+
+@receiver(setting_changed)
+def _clear_sidebar_urls(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        sidebar_urls.cache_clear()
+
+
+def sidebar_key(user):
+    """Identify what the sidebar shows `user`: authentication state and, for staff, the permission set."""
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if not user.is_staff:
+        return 'user'
+    # get_all_permissions() 會快取在 user 物件上，{% if perms... %} 不會再查一次
+    permissions = ','.join(sorted(perm for perm in user.get_all_permissions() if perm.startswith('catalog.')))
+    return 'staff:' + hashlib.md5(permissions.encode()).hexdigest()
+
+
+def sidebar(request):
+    user = getattr(request, 'user', None)
+    return {
+        # 只有在 {% cache %} 用到時才查權限
+        'sidebar_key': SimpleLazyObject(lambda: sidebar_key(user)),
+        'sidebar_urls': sidebar_urls(get_urlconf()),
+        'sidebar_cache_timeout': getattr(settings, 'CATALOG_SIDEBAR_CACHE_TIMEOUT', 60 * 60),
+    }
@@ -0,0 +1,98 @@
+"""
+Database connection handling: SQLite tuning, health checks for persistent
+connections, and routing of read-only catalog views to read replicas.
+
+The settings come from the environment (see locallibrary/settings.py):
+
+* CATALOG_SQLITE_PRAGMAS are run on every new SQLite connection
+  (WAL journal, synchronous=NORMAL, busy timeout, mmap size). They are only
+  set with DJANGO_SQLITE_TUNING=1, since WAL rewrites the database header.
+* With CATALOG_DB_HEALTH_CHECKS (off by default, it costs a SELECT 1 per
+  connection on every request), a persistent connection (CONN_MAX_AGE > 0)
+  that is no longer usable is closed at the start of a request, so the
+  request opens a fresh one instead of failing on a dead socket.
+* ReadReplicaRouter sends the reads of views wrapped in read_replica() to one
+  of CATALOG_READ_REPLICAS; everything else, and every write, uses 'default'.
+  Anything stored under the current version stamps (cached pages, API ETags)
+  is read from 'default' inside primary_database(): a lagging replica could
+  otherwise serve rows older than the stamps and they would stay cached.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+_use_replica = contextvars.ContextVar('catalog_use_replica', default=False)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver applying CATALOG_SQLITE_PRAGMAS to SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'CATALOG_SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def close_unusable_connections(**kwargs):
+    """request_started receiver: drop persistent connections that no longer respond."""
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+def replica_aliases():
+    return getattr(settings, 'CATALOG_READ_REPLICAS', [])
+
+
+def read_replica(view_func):
+    """
+    Let the reads of a GET/HEAD view go to a read replica. The response is
+    rendered inside, since a TemplateResponse only runs its querysets then.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = _use_replica.set(request.method in ('GET', 'HEAD'))
+        try:
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            return response
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+@contextmanager
+def primary_database():
+    """Read from 'default' inside this block, even in a read_replica() view."""
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReadReplicaRouter:
+    """Reads inside read_replica() views go to a random replica, all other queries to 'default'."""
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if replicas and _use_replica.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 副本與主資料庫是同一份資料
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
@@ -0,0 +1,134 @@
+"""
+Filters and facet counts for the book list (/catalog/books/?genre=&author=&available=1).
+
+Each facet is counted with one grouped aggregate over the books matching the
+other active filters, so the counts say what choosing a value would give:
+books per genre (on the genre through table), books per author, and books
+with and without an available copy (from the copies_available counter).
+
+Every facet is cached on its own, per filter combination. Its key includes
+the version stamps (catalog/caching.py) of just the models it depends on, so
+the signal handlers that bump the stamps invalidate it, and a checkout only
+invalidates the facets that involve availability.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from . import caching
+from .models import Book
+
+FILTER_NAMES = ('genre', 'author', 'available')
+FACET_KEY_PREFIX = 'catalog:facets:'
+# 作者可能有幾十萬位，只列出書最多的這幾位
+FACET_LIMIT = 20
+
+
+def parse_filters(params):
+    """The valid filters in a QueryDict, e.g. {'genre': 3, 'available': True}; anything else is ignored."""
+    filters = {}
+    for name in ('genre', 'author'):
+        value = params.get(name, '')
+        if value.isdigit():
+            filters[name] = int(value)
+    if params.get('available') == '1':
+        filters['available'] = True
+    return filters
+
+
+def _book_conditions(filters, prefix=''):
+    conditions = Q()
+    if 'genre' in filters:
+        conditions &= Q(**{f'{prefix}genre': filters['genre']})
+    if 'author' in filters:
+        conditions &= Q(**{f'{prefix}author': filters['author']})
+    if filters.get('available'):
+        conditions &= Q(**{f'{prefix}copies_available__gt': 0})
+    return conditions
+
+
+def filter_books(queryset, filters):
+    return queryset.filter(_book_conditions(filters))
+
+
+def _without(filters, name):
+    return {key: value for key, value in filters.items() if key != name}
+
+
+def _labels(filters, *labels):
+    # copies_available 的計數器由副本的變動更新，只會 bump BOOKINSTANCE
+    if filters.get('available'):
+        labels += (caching.BOOKINSTANCE,)
+    if 'genre' in filters:
+        labels += (caching.GENRE,)
+    return labels
+
+
+def count_genres(filters, limit=FACET_LIMIT):
+    """[(genre id, name, number of books)] for the books matching `filters`, most books first."""
+    through = Book.genre.through
+    rows = (through.objects.filter(_book_conditions(filters, prefix='book__'))
+            .values_list('genre_id', 'genre__name').annotate(count=Count('book_id'))
+            .order_by('-count', 'genre__name'))
+    return list(rows[:limit])
+
+
+def count_authors(filters, limit=FACET_LIMIT):
+    """[(author id, first name, last name, number of books)] for the books matching `filters`."""
+    rows = (filter_books(Book.objects.filter(author__isnull=False), filters)
+            .values_list('author_id', 'author__first_name', 'author__last_name').annotate(count=Count('id'))
+            .order_by('-count', 'author__last_name', 'author_id'))
+    return list(rows[:limit])
+
+
+def count_availability(filters):
+    """{'available': n, 'unavailable': n} for the books matching `filters`, in one query."""
+    counts = filter_books(Book.objects.all(), filters).aggregate(
+        total=Count('id'), available=Count('id', filter=Q(copies_available__gt=0)))
+    return {'available': counts['available'], 'unavailable': counts['total'] - counts['available']}
+
+
+# facet -> (the filter it sets, the function counting it, the models it always depends on)
+FACETS = {
+    'genre': ('genre', count_genres, (caching.BOOK, caching.GENRE)),
+    'author': ('author', count_authors, (caching.BOOK, caching.AUTHOR)),
+    'available': ('available', count_availability, (caching.BOOK, caching.BOOKINSTANCE)),
+}
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_FACET_CACHE_TIMEOUT', 60 * 10)
+
+
+def _cache_key(facet, filters, labels, versions):
+    combination = '&'.join(f'{name}={filters[name]}' for name in FILTER_NAMES if name in filters)
+    stamps = ':'.join(repr(versions[label]) for label in sorted(set(labels)))
+    digest = hashlib.md5(f'{combination}:{stamps}'.encode()).hexdigest()
+    return f'{FACET_KEY_PREFIX}{facet}:{digest}'
+
+
+def get_facets(filters):
+    """
+    {facet: counts} for the book list. A facet ignores its own filter, so
+    the other values of that facet stay visible while one is selected.
+    """
+    timeout = _timeout()
+    all_labels = (caching.BOOK, caching.AUTHOR, caching.GENRE, caching.BOOKINSTANCE)
+    versions = dict(zip(all_labels, caching.get_versions(*all_labels)))
+    wanted = {}
+    for facet, (own_filter, count, labels) in FACETS.items():
+        others = _without(filters, own_filter)
+        wanted[facet] = (_cache_key(facet, others, _labels(others, *labels), versions), count, others)
+
+    cached = cache.get_many([key for key, _, _ in wanted.values()]) if timeout else {}
+    facets, missing = {}, {}
+    for facet, (key, count, others) in wanted.items():
+        if key in cached:
+            facets[facet] = cached[key]
+        else:
+            facets[facet] = missing[key] = count(others)
+    if missing and timeout:
+        cache.set_many(missing, timeout)
+    return facets
@@ -58,3 +58,50 @@ class RenewBookModelForm(ModelForm):
         help_texts = {'due_back': _('Enter a date between now and 4 weeks (default 3).'), }
 
 
+
+
+
+# 一次續借 / 歸還多本書：沿用 RenewBookForm 的到期日驗證規則，日期只驗證一次
+import uuid
+
+
+class UUIDListField(forms.Field):
+    """A list of UUIDs posted as repeated form values (e.g. checkboxes named "copies")."""
+    widget = forms.MultipleHiddenInput
+    default_error_messages = {
+        'invalid': _('Enter valid copy ids.'),
+    }
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            return [uuid.UUID(str(item)) for item in value]
+        except ValueError:
+            raise ValidationError(self.error_messages['invalid'], code='invalid')
+
+
+class BulkRenewForm(RenewBookForm):
+    RENEW = 'renew'
+    RETURN = 'return'
+    ACTIONS = (
+        (RENEW, _('Renew')),
+        (RETURN, _('Mark returned')),
+    )
+
+    action = forms.ChoiceField(choices=ACTIONS)
+    copies = UUIDListField(error_messages={'required': _('Select at least one copy.')})
+    renewal_date = forms.DateField(required=False, help_text="Enter a date between now and 4 weeks (default 3).")
+
+    def clean_renewal_date(self):
+        # 只有續借才需要日期；歸還時不檢查
+        if self.cleaned_data.get('renewal_date') is None:
+            return None
+        return super().clean_renewal_date()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('action') == self.RENEW and not cleaned_data.get('renewal_date') \
+                and 'renewal_date' not in self.errors:
+            self.add_error('renewal_date', _('Enter the new due date.'))
+        return cleaned_data
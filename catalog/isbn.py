@@ -0,0 +1,50 @@
+"""
+ISBN normalization: every valid ISBN-10 or ISBN-13 maps to one ISBN-13 string.
+
+Hyphens and spaces are ignored, check digits are verified, and an ISBN-10 is
+converted by prefixing 978 and computing the new check digit. Book.isbn13
+stores the result so both forms of a title share one unique, indexed value.
+
+No model imports here: migrations use these functions too.
+"""
+import re
+
+_SEPARATORS = re.compile(r'[\s-]+')
+
+
+def isbn13_check_digit(first12):
+    """The check digit completing the first 12 digits of an ISBN-13."""
+    total = sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def _isbn10_is_valid(isbn10):
+    if not (isbn10[:9].isdigit() and (isbn10[9].isdigit() or isbn10[9] == 'X')):
+        return False
+    digits = [int(d) for d in isbn10[:9]] + [10 if isbn10[9] == 'X' else int(isbn10[9])]
+    return sum(weight * digit for weight, digit in zip(range(10, 0, -1), digits)) % 11 == 0
+
+
+def normalize_isbn(value):
+    """The ISBN-13 form of an ISBN-10 or ISBN-13, raising ValueError when `value` is not a valid ISBN."""
+    isbn = _SEPARATORS.sub('', value or '').upper()
+    if len(isbn) == 10:
+        if not _isbn10_is_valid(isbn):
+            raise ValueError(f'Invalid ISBN-10 check digit: {value!r}.')
+        first12 = '978' + isbn[:9]
+        return first12 + isbn13_check_digit(first12)
+    if len(isbn) == 13 and isbn.isdigit():
+        if isbn[:3] not in ('978', '979'):
+            raise ValueError(f'ISBN-13 must start with 978 or 979: {value!r}.')
+        if isbn13_check_digit(isbn[:12]) != isbn[12]:
+            raise ValueError(f'Invalid ISBN-13 check digit: {value!r}.')
+        return isbn
+    raise ValueError(f'An ISBN has 10 or 13 digits: {value!r}.')
+
+
+def isbn13_or_none(value):
+    """normalize_isbn() for stored data: None instead of an error for blank or invalid ISBNs."""
+    try:
+        return normalize_isbn(value)
+    except ValueError:
+        return None
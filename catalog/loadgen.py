@@ -0,0 +1,62 @@
+"""
+A small asyncio HTTP load generator for `manage.py bench_servers`.
+
+It deliberately imports nothing from Django: it runs in a separate (spawned)
+process so the client does not compete with the server under test for the GIL.
+"""
+import asyncio
+import itertools
+import time
+
+
+async def _fetch(host, port, path, cookie):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        headers = f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n'
+        if cookie:
+            headers += f'Cookie: {cookie}\r\n'
+        writer.write((headers + '\r\n').encode('latin-1'))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def _run(host, port, requests, concurrency, duration):
+    """Keep `concurrency` requests in flight for `duration` seconds, cycling through `requests`."""
+    cycle = itertools.cycle(requests)
+    timings, statuses, errors = [], {}, 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            path, cookie = next(cycle)
+            start = time.perf_counter()
+            try:
+                status = await _fetch(host, port, path, cookie)
+            except (OSError, IndexError, ValueError):
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {
+        'elapsed': time.perf_counter() - start,
+        'timings': timings,
+        'statuses': statuses,
+        'errors': errors,
+    }
+
+
+def run_load(host, port, requests, concurrency, duration):
+    """
+    Hit the server at host:port with [(path, cookie header or None)] and
+    return the elapsed seconds, per-request timings (ms), status counts and
+    connection errors.
+    """
+    return asyncio.run(_run(host, port, requests, concurrency, duration))
@@ -0,0 +1,163 @@
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import time
+
+import django
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog import urls as catalog_urls
+from catalog.bench import QueryRecorder, count_rows, latency_summary, seed_catalog, throwaway_database
+from catalog.models import Author, Book, BookInstance, Genre
+from catalog.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database, request every catalog URL through the test client and '
+            'write latency percentiles, queries per request and rows fetched to a JSON report.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=5000)
+        parser.add_argument('--authors', type=int, default=500)
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--copies-per-book', type=int, default=3)
+        parser.add_argument('--borrowers', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per route.')
+        parser.add_argument('--no-page-cache', action='store_true', help='Turn off the anonymous page cache.')
+        parser.add_argument('--output', '-o', default='bench_report.json', help='Where to write the JSON report.')
+
+    def routes(self):
+        """
+        [(url name, client, method, callable returning (url, data))] covering catalog/urls.py.
+        Ids rotate through the seeded rows so repeated requests do not all hit the same row.
+        """
+        books = itertools.cycle(Book.objects.order_by('?').values_list('pk', flat=True)[:200])
+        isbns = itertools.cycle(Book.objects.order_by('?').values_list('isbn13', flat=True)[:200])
+        genres = itertools.cycle(Genre.objects.values_list('pk', flat=True))
+        authors = itertools.cycle(Author.objects.order_by('?').values_list('pk', flat=True)[:200])
+        loans = list(BookInstance.objects.filter(status='o').values_list('pk', flat=True)[:200])
+        loan_cycle = itertools.cycle(loans)
+        renewal_date = (datetime.date.today() + datetime.timedelta(weeks=3)).isoformat()
+        anonymous, patron, librarian = self.anonymous, self.patron, self.librarian
+        return [
+            ('index', anonymous, 'get', lambda: (reverse('index'), None)),
+            ('books', anonymous, 'get', lambda: (reverse('books'), None)),
+            ('book-detail', anonymous, 'get', lambda: (reverse('book-detail', args=[next(books)]), None)),
+            ('books?genre=&available=1', anonymous, 'get',
+             lambda: (reverse('books'), {'genre': next(genres), 'available': '1'})),
+            ('book-search', anonymous, 'get', lambda: (reverse('book-search'), {'q': 'title summary'})),
+            ('book-by-isbn', anonymous, 'get', lambda: (reverse('book-by-isbn', args=[next(isbns)]), None)),
+            ('genres', anonymous, 'get', lambda: (reverse('genres'), None)),
+            ('genre-detail', anonymous, 'get', lambda: (reverse('genre-detail', args=[next(genres)]), None)),
+            ('my-borrowed', patron, 'get', lambda: (reverse('my-borrowed'), None)),
+            ('all-borrowed', librarian, 'get', lambda: (reverse('all-borrowed'), None)),
+            ('overdue-loans', librarian, 'get', lambda: (reverse('overdue-loans'), None)),
+            ('circulation-report', librarian, 'get', lambda: (reverse('circulation-report'), None)),
+            ('export-catalog', librarian, 'get', lambda: (reverse('export-catalog', args=['loans', 'csv']), None)),
+            ('renew-book-librarian', librarian, 'get',
+             lambda: (reverse('renew-book-librarian', args=[next(loan_cycle)]), None)),
+            ('renew-book-librarian-modelform', librarian, 'get',
+             lambda: (reverse('renew-book-librarian-modelform', args=[next(loan_cycle)]), None)),
+            ('renew-books-bulk', librarian, 'post',
+             lambda: (reverse('renew-books-bulk'),
+                      {'action': 'renew', 'renewal_date': renewal_date, 'copies': [str(pk) for pk in loans[:20]]})),
+            ('author_create', librarian, 'get', lambda: (reverse('author_create'), None)),
+            ('author_update', librarian, 'get', lambda: (reverse('author_update', args=[next(authors)]), None)),
+            ('author_delete', librarian, 'get', lambda: (reverse('author_delete', args=[next(authors)]), None)),
+            ('authors', librarian, 'get', lambda: (reverse('authors'), None)),
+            ('request-metrics', librarian, 'get', lambda: (reverse('request-metrics'), None)),
+            ('api-books', anonymous, 'get', lambda: (reverse('api-books'), {'fields': 'id,title,author,genres'})),
+            ('api-book-detail', anonymous, 'get', lambda: (reverse('api-book-detail', args=[next(books)]), None)),
+            ('api-book-copies', anonymous, 'get', lambda: (reverse('api-book-copies', args=[next(books)]), None)),
+            ('api-authors', anonymous, 'get', lambda: (reverse('api-authors'), None)),
+            ('api-author-detail', anonymous, 'get', lambda: (reverse('api-author-detail', args=[next(authors)]), None)),
+            ('api-genres', anonymous, 'get', lambda: (reverse('api-genres'), None)),
+        ]
+
+    def bench_route(self, client, method, request_args, count):
+        timings, query_counts, statuses = [], [], set()
+        recorder = None
+        for _ in range(count):
+            url, data = request_args()
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - start) * 1000)
+            statuses.add(response.status_code)
+            query_counts.append(len(recorder.queries))
+        return {
+            **latency_summary(timings),
+            'queries_per_request': round(sum(query_counts) / len(query_counts), 2),
+            'max_queries': max(query_counts),
+            # rows fetched by the SELECTs of the last request
+            'rows_fetched': count_rows(recorder.queries),
+            'status_codes': sorted(statuses),
+        }
+
+    def handle(self, *args, **options):
+        settings_overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if options['no_page_cache']:
+            settings_overrides['CATALOG_PAGE_CACHE_TIMEOUT'] = 0
+
+        with throwaway_database(), override_settings(**settings_overrides):
+            cache.clear()
+            counts = seed_catalog(
+                authors=options['authors'], books=options['books'], genres=options['genres'],
+                copies_per_book=options['copies_per_book'], borrowers=options['borrowers'])
+            # bulk_create() 不會觸發 signals，搜尋索引一次建好
+            rebuild_search_index()
+
+            librarian = User.objects.create_user('librarian', password='bench-librarian', is_staff=True)
+            librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+            self.anonymous, self.patron, self.librarian = Client(), Client(), Client()
+            self.patron.force_login(User.objects.get(username='patron1'))
+            self.librarian.force_login(librarian)
+
+            routes = self.routes()
+            covered = {name for name, *_ in routes}
+            for pattern in catalog_urls.urlpatterns:
+                if pattern.name not in covered:
+                    self.stderr.write(f'Route {pattern.name!r} is not benchmarked.')
+
+            results = {}
+            for name, client, method, request_args in routes:
+                results[name] = self.bench_route(client, method, request_args, options['requests'])
+                r = results[name]
+                self.stdout.write(
+                    f'{name:<32} p50 {r["p50_ms"]:>8} ms  p90 {r["p90_ms"]:>8} ms  p99 {r["p99_ms"]:>8} ms  '
+                    f'{r["queries_per_request"]:>6} queries  {r["rows_fetched"]:>6} rows')
+
+        report = {
+            'meta': {
+                'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'commit': self.git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'page_cache': not options['no_page_cache'],
+                'requests_per_route': options['requests'],
+                'seed': counts,
+            },
+            'routes': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["output"]}'))
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
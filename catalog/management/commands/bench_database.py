@@ -0,0 +1,120 @@
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+
+# 這個模組會在 django.setup() 之前被 spawn 出來的 process 載入 (_init_worker)，
+# 所以 catalog 的模型都在函式裡才 import
+BORROWERS = 50
+
+
+def _init_worker(db_path, tuned):
+    # 每個 process 都用環境變數指到同一個 SQLite 檔，再設定 Django (見 settings.py 的 DATABASES)
+    os.environ['DJANGO_DB_NAME'] = db_path
+    os.environ['DJANGO_SQLITE_TUNING'] = '1' if tuned else '0'
+    django.setup()
+
+
+def _prepare(books):
+    from catalog.bench import seed_catalog
+    call_command('migrate', verbosity=0)
+    seed_catalog(authors=max(books // 10, 1), books=books, borrowers=BORROWERS)
+
+
+def _read_loop(duration, seed):
+    """List a page of books and read one book, as the catalog pages do, for `duration` seconds."""
+    from catalog.models import Book
+    rng = random.Random(seed)
+    last_id = Book.objects.order_by('-id').values_list('id', flat=True).first()
+    timings, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            list(Book.objects.select_related('author').only('id', 'title', 'author__last_name')
+                 .order_by('title', 'id')[:20])
+            Book.objects.filter(pk=rng.randint(1, last_id)).values('title', 'copies_available').first()
+        except OperationalError:
+            errors += 1
+            continue
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, errors
+
+
+def _write_loop(duration, seed):
+    """Check a copy of a random book out and back in (two write transactions) for `duration` seconds."""
+    from catalog import circulation
+    from catalog.models import Book
+    from django.contrib.auth.models import User
+    rng = random.Random(seed)
+    last_id = Book.objects.order_by('-id').values_list('id', flat=True).first()
+    patron = User.objects.get(pk=rng.randint(1, BORROWERS))
+    timings, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            copy_id = circulation.checkout(rng.randint(1, last_id), patron)
+            circulation.return_copy(copy_id)
+        except circulation.NoCopyAvailable:
+            continue
+        except OperationalError:
+            errors += 1
+            continue
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, errors
+
+
+def _summary(results, duration):
+    from catalog.bench import latency_summary
+    timings = [t for worker_timings, _ in results for t in worker_timings]
+    errors = sum(worker_errors for _, worker_errors in results)
+    summary = latency_summary(timings) if timings else {'requests': 0}
+    summary.update(per_second=round(len(timings) / duration, 1), errors=errors)
+    return summary
+
+
+class Command(BaseCommand):
+    help = ('Measure concurrent read/write throughput on a SQLite file with the default settings and with '
+            'CATALOG_SQLITE_PRAGMAS (WAL, synchronous=NORMAL, busy timeout, mmap), using separate processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--readers', type=int, default=6, help='Reader processes.')
+        parser.add_argument('--writers', type=int, default=2, help='Writer processes.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per configuration.')
+        parser.add_argument('--output', '-o', help='Also write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        readers, writers, duration = options['readers'], options['writers'], options['duration']
+        results = {}
+        for name, tuned in (('default', False), ('tuned', True)):
+            with tempfile.TemporaryDirectory() as directory:
+                db_path = os.path.join(directory, 'bench.sqlite3')
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=readers + writers, mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker, initargs=(db_path, tuned)) as pool:
+                    pool.submit(_prepare, options['books']).result()
+                    reads = [pool.submit(_read_loop, duration, seed) for seed in range(readers)]
+                    writes = [pool.submit(_write_loop, duration, seed) for seed in range(writers)]
+                    results[name] = {
+                        'reads': _summary([future.result() for future in reads], duration),
+                        'writes': _summary([future.result() for future in writes], duration),
+                    }
+            for kind in ('reads', 'writes'):
+                r = results[name][kind]
+                self.stdout.write(f'{name:<8} {kind:<7} {r["per_second"]:>9}/s  p50 {r.get("p50_ms")} ms  '
+                                  f'p99 {r.get("p99_ms")} ms  errors {r["errors"]}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'readers': readers, 'writers': writers, 'duration': duration, 'books': options['books'],
+                           'results': results}, f, indent=2, sort_keys=True)
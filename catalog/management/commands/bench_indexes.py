@@ -0,0 +1,88 @@
+import datetime
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from catalog.bench import seed_catalog, summarize, throwaway_database, time_callable
+from catalog.models import Author, Book, BookInstance
+
+
+def hot_path_queries():
+    """
+    The queries behind the loan lists, the index counters, the author list and
+    ISBN lookups, as {name: (queryset to explain, callable to time)}.
+    """
+    today = datetime.date.today()
+    pages = {
+        'all_borrowed': BookInstance.objects.filter(status='o').order_by('due_back', 'id')[:11],
+        'my_borrowed': BookInstance.objects.filter(borrower_id=1, status='o').order_by('due_back', 'id')[:11],
+        'overdue_loans': BookInstance.objects.filter(status='o', due_back__lt=today).order_by('due_back', 'id')[:11],
+        'author_list': Author.objects.order_by('last_name', 'first_name', 'id')[:11],
+        'isbn_lookup': Book.objects.filter(isbn='9780000000422'),
+        'isbn13_lookup': Book.objects.filter(isbn13='9780000000422'),
+    }
+    queries = {name: (qs, lambda qs=qs: list(qs.all())) for name, qs in pages.items()}
+    available = BookInstance.objects.filter(status='a').order_by()
+    queries['available_count'] = (available, available.count)
+    return queries
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database with a large catalog and report query plans and timings '
+            'for the hot filter paths with and without the catalog indexes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=50000)
+        parser.add_argument('--authors', type=int, default=5000)
+        parser.add_argument('--copies-per-book', type=int, default=3)
+        parser.add_argument('--borrowers', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per query and phase.')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this JSON file.')
+
+    def measure(self, label):
+        results = {}
+        for name, (queryset, run) in hot_path_queries().items():
+            plan = queryset.explain()
+            results[name] = {'plan': plan, **summarize(time_callable(run, self.repeat))}
+            self.stdout.write(f'[{label}] {name}: median {results[name]["median_ms"]} ms')
+            for line in plan.splitlines():
+                self.stdout.write(f'    {line}')
+        return results
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        models = (Author, Book, BookInstance)
+        with throwaway_database():
+            self.stdout.write('Seeding...')
+            counts = seed_catalog(
+                authors=options['authors'], books=options['books'],
+                copies_per_book=options['copies_per_book'], borrowers=options['borrowers'])
+            self.stdout.write(f'Seeded {counts}')
+
+            with connection.schema_editor() as editor:
+                for model in models:
+                    for index in model._meta.indexes:
+                        editor.remove_index(model, index)
+            before = self.measure('before')
+
+            with connection.schema_editor() as editor:
+                for model in models:
+                    for index in model._meta.indexes:
+                        editor.add_index(model, index)
+            if connection.vendor == 'sqlite':
+                # let the query planner see the statistics for the new indexes
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            after = self.measure('after')
+
+        self.stdout.write('')
+        self.stdout.write(f'{"query":<18}{"before (ms)":>14}{"after (ms)":>14}{"speedup":>10}')
+        for name in before:
+            b, a = before[name]['median_ms'], after[name]['median_ms']
+            self.stdout.write(f'{name:<18}{b:>14}{a:>14}{(b / a if a else 0):>9.1f}x')
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'seed': counts, 'before': before, 'after': after}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {options["json_path"]}'))
@@ -0,0 +1,139 @@
+import concurrent.futures
+import json
+import multiprocessing
+import socket
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog.bench import latency_summary, seed_catalog, throwaway_database
+from catalog.loadgen import run_load
+from catalog.models import Book
+
+
+class BenchWSGIServer(ThreadedWSGIServer):
+    # listen() backlog, as large as uvicorn's
+    request_queue_size = 1024
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the read-only catalog pages served over WSGI (threaded server) '
+            'and over ASGI (uvicorn) at high concurrency, against a seeded throwaway database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--authors', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests kept in flight.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per server.')
+        parser.add_argument('--server', choices=['wsgi', 'asgi'], action='append',
+                            help='Server(s) to benchmark; both by default.')
+        parser.add_argument('--no-page-cache', action='store_true', help='Turn off the anonymous page cache.')
+        parser.add_argument('--output', '-o', help='Also write the results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        servers = options['server'] or ['wsgi', 'asgi']
+        if 'asgi' in servers:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                raise CommandError('uvicorn is not installed; run with --server wsgi or pip install uvicorn.')
+
+        settings_overrides = {'ALLOWED_HOSTS': ['127.0.0.1', 'localhost']}
+        if options['no_page_cache']:
+            settings_overrides['CATALOG_PAGE_CACHE_TIMEOUT'] = 0
+
+        results = {}
+        # 測試資料庫是 shared-cache 的 in-memory SQLite，伺服器要跑在同一個 process 的 thread 裡才看得到
+        with throwaway_database(), override_settings(**settings_overrides):
+            cache.clear()
+            seed_catalog(authors=options['authors'], books=options['books'], genres=20, borrowers=10)
+            requests = self.requests()
+            for name in servers:
+                port = free_port()
+                stop = getattr(self, f'start_{name}')(port)
+                try:
+                    results[name] = self.load(port, requests, options['concurrency'], options['duration'])
+                finally:
+                    stop()
+                r = results[name]
+                self.stdout.write(
+                    f'{name}: {r["requests_per_second"]:>8} req/s  p50 {r["p50_ms"]} ms  p99 {r["p99_ms"]} ms  '
+                    f'errors {r["errors"]}  statuses {r["status_codes"]}')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'concurrency': options['concurrency'], 'duration': options['duration'],
+                           'page_cache': not options['no_page_cache'], 'servers': results},
+                          f, indent=2, sort_keys=True)
+
+    def requests(self):
+        """[(path, cookie)] for the read-only pages: anonymous home/book pages, the author list logged in."""
+        client = Client()
+        client.force_login(User.objects.create_user('bench-reader', password='bench-reader'))
+        session = f'sessionid={client.cookies["sessionid"].value}'
+        books = Book.objects.order_by('?').values_list('pk', flat=True)[:50]
+        requests = [(reverse('index'), None), (reverse('books'), None), (reverse('authors'), session)]
+        requests += [(reverse('book-detail', args=[pk]), None) for pk in books]
+        return requests
+
+    def load(self, port, requests, concurrency, duration):
+        # 用 spawn 另開一個乾淨的 process 產生負載，不跟伺服器搶 GIL
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_load, '127.0.0.1', port, requests, concurrency, duration).result()
+        if not result['timings']:
+            raise CommandError(f'No request succeeded ({result["errors"]} errors).')
+        return {
+            **latency_summary(result['timings']),
+            'requests_per_second': round(len(result['timings']) / result['elapsed'], 1),
+            'errors': result['errors'],
+            'status_codes': {str(code): n for code, n in sorted(result['statuses'].items())},
+        }
+
+    def start_wsgi(self, port):
+        server = BenchWSGIServer(('127.0.0.1', port), QuietWSGIRequestHandler)
+        server.set_app(get_wsgi_application())
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return stop
+
+    def start_asgi(self, port):
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(
+            get_asgi_application(), host='127.0.0.1', port=port, log_level='warning', lifespan='off',
+            backlog=1024))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                raise CommandError('uvicorn failed to start.')
+            time.sleep(0.05)
+
+        def stop():
+            server.should_exit = True
+            thread.join()
+        return stop
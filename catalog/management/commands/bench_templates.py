@@ -0,0 +1,190 @@
+import datetime
+import json
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, Prefetch
+from django.forms import modelform_factory
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+
+from catalog.availability import STATUS_FIELDS
+from catalog.bench import QueryRecorder, latency_summary, seed_catalog, throwaway_database
+from catalog.facets import get_facets
+from catalog.forms import RenewBookForm, RenewBookModelForm
+from catalog.models import Author, Book, BookInstance, Genre
+from catalog.rollups import circulation_report
+from catalog.stats import get_catalog_stats
+
+TEMPLATE_DIR = os.path.join(settings.BASE_DIR, 'catalog', 'templates')
+LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+# (name, cached loader, sidebar fragment cache)
+CONFIGURATIONS = [
+    ('uncached_loader', False, False),
+    ('cached_loader', True, False),
+    ('cached_loader_sidebar', True, True),
+]
+
+
+def templates_setting(cached):
+    """settings.TEMPLATES with template debugging off (as in production) and the cached loader on or off."""
+    engine = dict(settings.TEMPLATES[0], APP_DIRS=False)
+    engine['OPTIONS'] = dict(engine.get('OPTIONS', {}), debug=False,
+                             loaders=[('django.template.loaders.cached.Loader', LOADERS)] if cached else LOADERS)
+    return [engine] + list(settings.TEMPLATES[1:])
+
+
+class Command(BaseCommand):
+    help = ('Render every template in catalog/templates against a seeded throwaway database, with lists of '
+            'realistic size, and report the render time per template with and without the cached template '
+            'loader and the sidebar fragment cache.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--list-size', type=int, default=20, help='Rows in every list template.')
+        parser.add_argument('--repeat', type=int, default=200, help='Renders per template and configuration.')
+        parser.add_argument('--output', '-o', help='Also write the results as JSON to this file.')
+
+    def cases(self, size):
+        """
+        [(template name, request, context)]. Querysets are evaluated here, as the
+        views hand them over, so the timings are about rendering.
+        """
+        factory = RequestFactory()
+
+        def request(path, user):
+            r = factory.get(path)
+            r.user = user
+            return r
+
+        anonymous, patron, librarian = AnonymousUser(), self.patron, self.librarian
+        today = datetime.date.today()
+        books = list(Book.objects.select_related('author').only(
+            'id', 'title', 'copies_available', 'copies_total', 'author__first_name', 'author__last_name',
+        ).order_by('title', 'id')[:size])
+        book = Book.objects.select_related('author').prefetch_related(
+            Prefetch('genre', queryset=Genre.objects.order_by('name'))).get(pk=books[0].pk)
+        copies = list(BookInstance.objects.filter(book=book).order_by('status', 'due_back', 'id'))
+        loans = list(BookInstance.objects.on_loan().with_overdue().select_related('book', 'borrower')
+                     .order_by('due_back')[:size])
+        overdue = list(BookInstance.objects.overdue(today).select_related('book', 'borrower')
+                       .order_by('due_back')[:size])
+        authors = list(Author.objects.order_by('last_name', 'first_name')[:size])
+        loan = loans[0]
+        renewal = today + datetime.timedelta(weeks=3)
+        stats = get_catalog_stats()
+        facet_counts = get_facets({})
+        genres = list(Genre.objects.annotate(num_books=Count('book')).order_by('name'))
+        # 種子資料沒有借閱紀錄，報表用假的每日數字填滿
+        report = circulation_report(days=30, top=size)
+        report['daily'] = [dict(row, checkouts=i, renewals=i // 2, returns=i) for i, row in enumerate(report['daily'])]
+        report['top_books'] = [{'book_id': b.pk, 'book': b, 'checkouts': size - i, 'renewals': i, 'returns': size - i}
+                               for i, b in enumerate(books)]
+
+        return [
+            ('index.html', request('/catalog/', anonymous), {**{k: stats[k] for k in (
+                'num_books', 'num_instances', 'num_instances_available', 'num_authors')}, 'num_visits': 3}),
+            ('catalog/book_list.html', request('/catalog/books/', anonymous), {
+                'book_list': books, 'is_paginated': True, 'page_obj': Paginator(books, size).page(1),
+                'genre_facet': [{'name': name, 'count': count, 'selected': False, 'querystring': f'genre={pk}'}
+                                for pk, name, count in facet_counts['genre']],
+                'author_facet': [{'name': f'{last}, {first}', 'count': count, 'selected': False,
+                                  'querystring': f'author={pk}'} for pk, first, last, count in facet_counts['author']],
+                'availability_facet': {**facet_counts['available'], 'selected': False, 'querystring': 'available=1'},
+                'filtered': False}),
+            ('catalog/genre_list.html', request('/catalog/genres/', anonymous), {'genre_list': genres}),
+            ('catalog/genre_detail.html', request(genres[0].get_absolute_url(), anonymous), {
+                'genre': genres[0], 'books': books, 'books_querystring': f'genre={genres[0].pk}'}),
+            ('catalog/book_detail.html', request(book.get_absolute_url(), anonymous), {
+                'book': book, 'copy_count': len(copies),
+                'copy_status_counts': [(status, label, getattr(book, STATUS_FIELDS[status]))
+                                       for status, label in BookInstance.LOAN_STATUS],
+                'copies_page': Paginator(copies, 20).page(1)}),
+            ('catalog/book_search.html', request('/catalog/search/', anonymous), {
+                'query': 'title', 'results': books, 'page': 1, 'has_previous': False, 'has_next': True}),
+            ('catalog/author_list.html', request('/catalog/authors/', librarian), {'author_list': authors}),
+            ('catalog/author_form.html', request('/catalog/author/create/', librarian), {
+                'form': modelform_factory(Author, fields='__all__')()}),
+            ('catalog/author_confirm_delete.html', request('/catalog/author/1/delete/', librarian), {
+                'author': authors[0], 'object': authors[0]}),
+            ('catalog/bookinstance_list_borrowed_user.html', request('/catalog/mybooks/', patron), {
+                'bookinstance_list': loans}),
+            ('catalog/bookinstance_list_borrowed_all.html', request('/catalog/borrowed/', librarian), {
+                'bookinstance_list': loans}),
+            ('catalog/bookinstance_list_overdue.html', request('/catalog/overdue/', librarian), {
+                'bookinstance_list': overdue, 'today': today, 'overdue_count': len(overdue),
+                'due_soon_count': size, 'due_soon_days': 7}),
+            ('catalog/circulation_report.html', request('/catalog/reports/circulation/', librarian), report),
+            ('catalog/bookinstance_bulk_renew.html', request('/catalog/borrowed/renew/', librarian), {
+                'form': RenewBookForm(), 'rows': [(copy.pk, copy.book.title, 'renewed') for copy in loans],
+                'summary': sorted(Counter({'renewed': len(loans)}).items())}),
+            ('catalog/book_renew_librarian.html', request('/catalog/book/renew/', librarian), {
+                'form': RenewBookForm(initial={'renewal_date': renewal}), 'bookinst': loan}),
+            ('catalog/book_renew_librarian_modelform.html', request('/catalog/book/renew/', librarian), {
+                'form': RenewBookModelForm(initial={'due_back': renewal}), 'bookinst': loan}),
+        ]
+
+    def bench_template(self, name, request, context, repeat):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            start = time.perf_counter()
+            render_to_string(name, context, request)
+            first = (time.perf_counter() - start) * 1000
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            render_to_string(name, context, request)
+            timings.append((time.perf_counter() - start) * 1000)
+        summary = latency_summary(timings)
+        # 第一次 render 含讀檔與編譯 (cached loader 之後就不用)
+        summary.update(first_ms=round(first, 3), queries=len(recorder.queries))
+        return summary
+
+    def handle(self, *args, **options):
+        with throwaway_database():
+            cache.clear()
+            seed_catalog(authors=max(options['books'] // 10, 1), books=options['books'])
+            self.patron = User.objects.get(username='patron1')
+            self.librarian = User.objects.create_user('librarian', is_staff=True)
+            self.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+            cases = self.cases(options['list_size'])
+
+            covered = {name for name, *_ in cases}
+            for directory, _, filenames in os.walk(TEMPLATE_DIR):
+                for filename in filenames:
+                    name = os.path.relpath(os.path.join(directory, filename), TEMPLATE_DIR).replace(os.sep, '/')
+                    if name.endswith('.html') and name != 'base_generic.html' and name not in covered:
+                        self.stderr.write(f'Template {name!r} is not benchmarked.')
+
+            results = {}
+            for config, cached_loader, sidebar_cache in CONFIGURATIONS:
+                overrides = {
+                    'TEMPLATES': templates_setting(cached_loader),
+                    'CATALOG_SIDEBAR_CACHE_TIMEOUT': 60 * 60 if sidebar_cache else 0,
+                }
+                with override_settings(**overrides):
+                    cache.clear()
+                    results[config] = {}
+                    for name, request, context in cases:
+                        # 每個 configuration 用新的 user 物件，權限快取不會沿用
+                        request.user = (User.objects.get(pk=request.user.pk)
+                                        if request.user.is_authenticated else request.user)
+                        r = results[config][name] = self.bench_template(name, request, context, options['repeat'])
+                        self.stdout.write(f'{config:<22} {name:<46} first {r["first_ms"]:>8} ms  '
+                                          f'p50 {r["p50_ms"]:>7} ms  p99 {r["p99_ms"]:>7} ms  '
+                                          f'{r["queries"]} queries')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'list_size': options['list_size'], 'repeat': options['repeat'], 'books': options['books'],
+                           'results': results}, f, indent=2, sort_keys=True)
@@ -0,0 +1,135 @@
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from catalog import circulation, search
+from catalog.availability import recount_availability
+from catalog.caching import BOOK, BOOKINSTANCE, GENRE, bump_versions
+from catalog.isbn import isbn13_or_none
+from catalog.models import Book, BookInstance, Hold
+
+# 一個 CASE WHEN 有兩個參數，再加上 IN (...)，SQLite 最多 999 個參數
+REPOINT_CHUNK = 300
+
+
+def chunked(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def repoint(model, mapping):
+    """Move the `model` rows of the duplicate books in `mapping` ({duplicate id: book id}) with a few UPDATEs."""
+    moved = 0
+    for chunk in chunked(mapping.items(), REPOINT_CHUNK):
+        moved += model.objects.filter(book_id__in=[duplicate for duplicate, _ in chunk]).update(
+            book=Case(*[When(book_id=duplicate, then=Value(book)) for duplicate, book in chunk],
+                      output_field=IntegerField()))
+    return moved
+
+
+def cancel_double_holds(mapping):
+    """A patron with active holds on a book and its duplicates keeps only the oldest one."""
+    books = {*mapping, *mapping.values()}
+    seen, cancel = set(), []
+    for chunk in chunked(books, 500):
+        active = (Hold.objects.filter(book_id__in=chunk, status__in=Hold.ACTIVE)
+                  .order_by('created_at', 'id').values_list('id', 'book_id', 'patron_id'))
+        for hold_id, book_id, patron_id in active:
+            key = (mapping.get(book_id, book_id), patron_id)
+            if key in seen:
+                cancel.append(hold_id)
+            else:
+                seen.add(key)
+    for hold_id in cancel:
+        # 已保留副本的預約要把副本放回去，交給 circulation 處理
+        circulation.cancel_hold(hold_id)
+    return len(cancel)
+
+
+def merge_books(mapping):
+    """
+    Merge each duplicate book into the book `mapping` points it to: its copies,
+    holds and genres move over and the duplicate row is deleted.
+    """
+    cancelled = cancel_double_holds(mapping)
+    copies = repoint(BookInstance, mapping)
+    repoint(Hold, mapping)
+
+    through = Book.genre.through
+    genres = []
+    for chunk in chunked(mapping, 500):
+        for duplicate, genre_id in through.objects.filter(book_id__in=chunk).values_list('book_id', 'genre_id'):
+            genres.append(through(book_id=mapping[duplicate], genre_id=genre_id))
+    through.objects.bulk_create(genres, ignore_conflicts=True)
+
+    for chunk in chunked(mapping, 500):
+        Book.objects.filter(pk__in=chunk).delete()
+    books = set(mapping.values())
+    for chunk in chunked(books, 500):
+        # update() 不會觸發 signals，計數器與搜尋索引自己更新
+        recount_availability(Book.objects.filter(pk__in=chunk))
+    search.index_books(books)
+    transaction.on_commit(partial(bump_versions, BOOK, BOOKINSTANCE, GENRE))
+    return copies, cancelled
+
+
+class Command(BaseCommand):
+    help = ('Find books whose ISBNs normalize to the same ISBN-13 and merge them, in batches: the book that '
+            'already has the ISBN-13 (or the lowest id) keeps it and the copies, holds and genres of the others.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Books examined per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be merged.')
+
+    def handle(self, *args, **options):
+        batch_size, dry_run = options['batch_size'], options['dry_run']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        totals = dict(examined=0, invalid=0, claimed=0, merged=0, copies=0, holds_cancelled=0)
+
+        # 有 ISBN-13 的書都是唯一的；要處理的只有還沒有 isbn13 的書
+        last_id = 0
+        while True:
+            rows = list(Book.objects.filter(pk__gt=last_id, isbn13__isnull=True).exclude(isbn='')
+                        .order_by('pk').values_list('pk', 'isbn')[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            pending = {pk: isbn13_or_none(isbn) for pk, isbn in rows}
+            totals['examined'] += len(rows)
+            totals['invalid'] += sum(1 for isbn13 in pending.values() if isbn13 is None)
+            pending = {pk: isbn13 for pk, isbn13 in pending.items() if isbn13}
+
+            with transaction.atomic():
+                owners = {}
+                for chunk in chunked(set(pending.values()), 500):
+                    owners.update(Book.objects.select_for_update().filter(isbn13__in=chunk)
+                                  .values_list('isbn13', 'pk'))
+                claims, mapping = [], {}
+                for pk, isbn13 in pending.items():
+                    if isbn13 in owners:
+                        mapping[pk] = owners[isbn13]
+                    else:
+                        owners[isbn13] = pk
+                        claims.append(Book(pk=pk, isbn13=isbn13))
+                totals['claimed'] += len(claims)
+                totals['merged'] += len(mapping)
+                if dry_run:
+                    continue
+                Book.objects.bulk_update(claims, ['isbn13'])
+                if mapping:
+                    copies, cancelled = merge_books(mapping)
+                    totals['copies'] += copies
+                    totals['holds_cancelled'] += cancelled
+
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Up to book {last_id}: {totals}')
+
+        prefix = 'Would merge' if dry_run else 'Merged'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {totals["merged"]} duplicate books ({totals["copies"]} copies moved, '
+            f'{totals["holds_cancelled"]} double holds cancelled); {totals["claimed"]} books got their ISBN-13, '
+            f'{totals["invalid"]} have an invalid ISBN.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from catalog.exports import EXPORTS, FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream books (with author and genres), copies or current loans to CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write; standard output when omitted.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['kind'], options['format'], chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                f.writelines(lines)
+        else:
+            # self.stdout 而不是 sys.stdout，call_command(stdout=...) 才接得到
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from catalog import search
+from catalog.availability import STATUS_FIELDS
+from catalog.caching import AUTHOR, BOOK, BOOKINSTANCE, GENRE, bump_versions
+from catalog.isbn import isbn13_or_none
+from catalog.models import Author, Book, BookInstance, Genre
+from catalog.stats import invalidate_catalog_stats
+
+STATUSES = {code for code, label in BookInstance.LOAN_STATUS}
+
+# 一個 IN (...) 查詢最多放幾個參數 (SQLite 上限是 999)
+LOOKUP_CHUNK = 500
+
+
+def chunked(values, size=LOOKUP_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def read_csv(stream):
+    """
+    One book per row with the columns title, summary, isbn, author_first_name,
+    author_last_name, genres (separated by ';'), copies, imprint and status.
+    """
+    for record in csv.DictReader(stream):
+        yield record
+
+
+def read_jsonl(stream):
+    """One JSON object per line, with the same keys as the CSV columns (genres as a list)."""
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = ('Bulk import books, authors, genres and copies from a CSV or JSONL file (or - for stdin), '
+            'streaming the input and writing it in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import, or - to read standard input.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format; guessed from the file extension when omitted.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Books written per transaction.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        # 作者與類別的 lookup cache：(first_name, last_name) / name -> id
+        self.authors = {}
+        self.genres = {}
+        self.books_written = self.copies_written = 0
+
+        if options['path'] == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            stream = open(options['path'], encoding='utf-8', newline='')
+
+        start = time.perf_counter()
+        reader = read_jsonl if fmt == 'jsonl' else read_csv
+        batch = []
+        with stream:
+            for number, record in enumerate(reader(stream), start=1):
+                batch.append(self.clean(number, record))
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch)
+                    batch = []
+                    self.report(start)
+            if batch:
+                self.write_batch(batch)
+
+        invalidate_catalog_stats()
+        bump_versions(BOOK, AUTHOR, GENRE, BOOKINSTANCE)
+        elapsed = time.perf_counter() - start
+        rows = self.books_written + self.copies_written
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.books_written} books and {self.copies_written} copies in {elapsed:.1f}s '
+            f'({rows / elapsed if elapsed else rows:.0f} rows/sec).'))
+
+    def report(self, start):
+        if self.verbosity >= 2 or self.books_written % (self.batch_size * 10) == 0:
+            elapsed = time.perf_counter() - start
+            rows = self.books_written + self.copies_written
+            self.stdout.write(f'{self.books_written} books, {self.copies_written} copies '
+                              f'({rows / elapsed if elapsed else rows:.0f} rows/sec)')
+
+    def clean(self, number, record):
+        title = (record.get('title') or '').strip()
+        if not title:
+            raise CommandError(f'Record {number}: title is required.')
+        status = (record.get('status') or 'm').strip()
+        if status not in STATUSES:
+            raise CommandError(f'Record {number}: unknown status {status!r}.')
+        try:
+            copies = int(record.get('copies') or 0)
+        except (TypeError, ValueError):
+            raise CommandError(f'Record {number}: copies must be a number.')
+        if copies < 0:
+            raise CommandError(f'Record {number}: copies cannot be negative.')
+        first_name = (record.get('author_first_name') or '').strip()
+        last_name = (record.get('author_last_name') or '').strip()
+        genres = record.get('genres') or []
+        if isinstance(genres, str):
+            genres = genres.split(';')
+        return {
+            'title': title,
+            'summary': (record.get('summary') or '').strip(),
+            'isbn': (record.get('isbn') or '').strip(),
+            'author': (first_name, last_name) if first_name or last_name else None,
+            'genres': [name.strip() for name in genres if name.strip()],
+            'copies': copies,
+            'imprint': (record.get('imprint') or '').strip(),
+            'status': status,
+        }
+
+    def resolve_authors(self, keys):
+        missing = {key for key in keys if key not in self.authors}
+        if not missing:
+            return
+        for key in self._existing_authors(missing):
+            missing.discard(key)
+        if missing:
+            Author.objects.bulk_create(Author(first_name=first, last_name=last) for first, last in missing)
+            # bulk_create() 不一定會回傳 id，重新查一次
+            self._existing_authors(missing)
+
+    def _existing_authors(self, keys):
+        found = []
+        for last_names in chunked({last for _, last in keys}):
+            rows = Author.objects.filter(last_name__in=last_names).values_list('id', 'first_name', 'last_name')
+            for pk, first, last in rows.iterator():
+                if (first, last) in keys:
+                    self.authors.setdefault((first, last), pk)
+                    found.append((first, last))
+        return found
+
+    def resolve_genres(self, names):
+        missing = {name for name in names if name not in self.genres}
+        if not missing:
+            return
+        for names in chunked(missing):
+            self.genres.update(Genre.objects.filter(name__in=names).values_list('name', 'id'))
+        new = [name for name in missing if name not in self.genres]
+        if new:
+            Genre.objects.bulk_create(Genre(name=name) for name in new)
+            for names in chunked(new):
+                self.genres.update(Genre.objects.filter(name__in=names).values_list('name', 'id'))
+
+    def claim_isbns(self, batch):
+        """
+        The ISBN-13 for each record, or None when it is invalid or another book
+        already has it; such duplicates are imported and left for dedupe_books.
+        """
+        normalized = [isbn13_or_none(record['isbn']) for record in batch]
+        taken = set()
+        for values in chunked({n for n in normalized if n}):
+            taken.update(Book.objects.filter(isbn13__in=values).values_list('isbn13', flat=True))
+        claimed = []
+        for isbn13 in normalized:
+            if isbn13 in taken:
+                isbn13 = None
+            elif isbn13:
+                taken.add(isbn13)
+            claimed.append(isbn13)
+        return claimed
+
+    def write_batch(self, batch):
+        with transaction.atomic():
+            self.resolve_authors({record['author'] for record in batch if record['author']})
+            self.resolve_genres({name for record in batch for name in record['genres']})
+
+            # 可借閱數量的計數器直接在建立時填好 (bulk_create() 不會觸發 signals)
+            books = [
+                Book(title=record['title'], summary=record['summary'], isbn=record['isbn'], isbn13=isbn13,
+                     author_id=self.authors[record['author']] if record['author'] else None,
+                     copies_total=record['copies'], **{STATUS_FIELDS[record['status']]: record['copies']})
+                for record, isbn13 in zip(batch, self.claim_isbns(batch))]
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # 這個資料庫的 bulk_create() 不會回傳 id，所以在同一個交易裡自己分配
+                next_id = (Book.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+                for offset, book in enumerate(books):
+                    book.id = next_id + offset
+            Book.objects.bulk_create(books)
+
+            through = Book.genre.through
+            through.objects.bulk_create([
+                through(book_id=book.id, genre_id=self.genres[name])
+                for book, record in zip(books, batch) for name in set(record['genres'])])
+
+            copies = [
+                BookInstance(book_id=book.id, imprint=record['imprint'], status=record['status'])
+                for book, record in zip(books, batch) for _ in range(record['copies'])]
+            BookInstance.objects.bulk_create(copies)
+
+            # bulk_create() 不會觸發 signals，搜尋索引要自己更新
+            search.index_books([book.id for book in books])
+
+        self.books_written += len(books)
+        self.copies_written += len(copies)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.search import rebuild_search_index, search_enabled
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text book search index (SQLite FTS5) from the Book, Author and Genre tables.'
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            raise CommandError('Full-text search needs the SQLite database backend.')
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} books.'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from catalog.availability import recount_availability
+from catalog.caching import BOOK, bump_versions
+from catalog.models import Book
+from catalog.stats import invalidate_catalog_stats
+
+
+class Command(BaseCommand):
+    help = 'Recount the per-book availability counters from the BookInstance rows and repair any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Books recounted per UPDATE / transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Book.objects.aggregate(low=Min('id'), high=Max('id'))
+        repaired = 0
+        if bounds['low'] is not None:
+            # 依 id 範圍分批，每批一個 UPDATE，避免長時間鎖住整張表
+            for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+                with transaction.atomic():
+                    repaired += recount_availability(Book.objects.filter(id__gte=start, id__lt=start + batch_size))
+        invalidate_catalog_stats()
+        bump_versions(BOOK)
+        self.stdout.write(self.style.SUCCESS(f'Repaired the availability counters of {repaired} books.'))
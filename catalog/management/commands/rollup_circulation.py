@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.rollups import rollup_circulation
+
+
+class Command(BaseCommand):
+    help = ('Add the circulation events logged since the last run to the per-day and per-book summary tables '
+            'read by the staff circulation report. Safe to run as often as you like (e.g. every few minutes).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Events added per transaction.')
+        parser.add_argument('--settle', type=int, default=60,
+                            help='Leave events younger than this many seconds for the next run.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['settle'] < 0:
+            raise CommandError('--settle cannot be negative.')
+        added = rollup_circulation(settle=options['settle'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {added} circulation events.'))
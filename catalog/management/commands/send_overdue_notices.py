@@ -0,0 +1,104 @@
+import concurrent.futures
+import datetime
+import itertools
+import multiprocessing
+
+import django
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Exists, F, OuterRef
+from django.template.loader import render_to_string
+
+from catalog.models import BookInstance, OverdueNotice
+
+
+def pending_loans(today, shard=0, shards=1):
+    """
+    Overdue loans with a borrower email that have not been notified for their
+    current due date, ordered by borrower so they can be grouped while streaming.
+    """
+    notified = OverdueNotice.objects.filter(book_instance=OuterRef('pk'), due_back=OuterRef('due_back'))
+    loans = (BookInstance.objects.overdue(today).filter(~Exists(notified))
+             .filter(borrower__isnull=False).exclude(borrower__email=''))
+    if shards > 1:
+        loans = loans.annotate(shard=F('borrower_id') % shards).filter(shard=shard)
+    return (loans.order_by('borrower_id', 'due_back', 'id')
+            .values_list('borrower_id', 'borrower__email', 'borrower__first_name', 'borrower__username',
+                         'id', 'book__title', 'due_back'))
+
+
+def digest(borrower_id, loans):
+    """The EmailMessage for one borrower and the OverdueNotice rows recording it."""
+    loans = list(loans)
+    _, email, first_name, username = loans[0][:4]
+    body = render_to_string('catalog/email/overdue_notice.txt', {
+        'name': first_name or username,
+        'loans': [(title, due_back) for *_, title, due_back in loans],
+    })
+    message = EmailMessage('Overdue library books', body, settings.DEFAULT_FROM_EMAIL, [email])
+    notices = [OverdueNotice(book_instance_id=pk, borrower_id=borrower_id, due_back=due_back)
+               for *_, pk, title, due_back in loans]
+    return message, notices
+
+
+def send_notices(today, batch_size, chunk_size, dry_run=False, shard=0, shards=1):
+    """
+    Send one digest per borrower, `batch_size` borrowers per send_messages()
+    call over a single mail connection, recording each batch once it is sent.
+    Returns (borrowers, loans) notified.
+    """
+    rows = pending_loans(today, shard, shards).iterator(chunk_size=chunk_size)
+    by_borrower = itertools.groupby(rows, key=lambda row: row[0])
+    borrowers = loans = 0
+    # dry run 不必真的連上 SMTP
+    with get_connection('django.core.mail.backends.dummy.EmailBackend' if dry_run else None) as mail:
+        while True:
+            batch = [digest(borrower_id, group) for borrower_id, group in itertools.islice(by_borrower, batch_size)]
+            if not batch:
+                break
+            messages = [message for message, _ in batch]
+            notices = [notice for _, group in batch for notice in group]
+            if not dry_run:
+                mail.send_messages(messages)
+                # 寄出之後才記錄；寄信失敗的這一批下次重跑會再寄
+                OverdueNotice.objects.bulk_create(notices, ignore_conflicts=True)
+            borrowers += len(messages)
+            loans += len(notices)
+    return borrowers, loans
+
+
+class Command(BaseCommand):
+    help = ('Email each borrower one digest of their overdue books, skipping loans already notified for '
+            'their current due date.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Digests sent per send_messages() call.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Loans fetched from the database at a time.')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Split the borrowers across this many worker processes.')
+        parser.add_argument('--dry-run', action='store_true', help='Count the notices without sending or recording.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['processes'] < 1:
+            raise CommandError('--batch-size and --processes must be at least 1.')
+        today = datetime.date.today()
+        args = (today, options['batch_size'], options['chunk_size'], options['dry_run'])
+        processes = options['processes']
+
+        if processes == 1:
+            borrowers, loans = send_notices(*args)
+        else:
+            # 每個 process 依 borrower_id % processes 分到自己的讀者，各用自己的資料庫與郵件連線
+            connections.close_all()
+            context = multiprocessing.get_context('spawn')
+            # spawn 出來的 process 要先 django.setup() 才能載入這個模組
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                                        initializer=django.setup) as pool:
+                futures = [pool.submit(send_notices, *args, shard, processes) for shard in range(processes)]
+                results = [future.result() for future in futures]
+            borrowers, loans = map(sum, zip(*results))
+
+        verb = 'Would send' if options['dry_run'] else 'Sent'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {borrowers} notices covering {loans} overdue loans.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from catalog.stats import warm_catalog_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the home page catalog counters and store them in the cache (run at deploy time).'
+
+    def handle(self, *args, **options):
+        stats = warm_catalog_stats()
+        for name, value in stats.items():
+            self.stdout.write(f'{name}: {value}')
+        self.stdout.write(self.style.SUCCESS('Catalog stats cache warmed.'))
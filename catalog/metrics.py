@@ -0,0 +1,109 @@
+"""
+In-process request metrics per view, rendered in the Prometheus text format.
+
+RequestMetricsMiddleware records one observation per request. Each process
+keeps its own registry: cumulative histograms and counters (what Prometheus
+expects to scrape) plus a rolling window of the latest requests per view, from
+which the current p50/p90/p99 are reported.
+"""
+import bisect
+import threading
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+# 秒；最後一個 bucket (+Inf) 由 render 補上
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _window_size():
+    return getattr(settings, 'CATALOG_METRICS_WINDOW', 1000)
+
+
+class ViewMetrics:
+    """Everything recorded for one view name."""
+
+    def __init__(self, window):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.duration_sum = 0.0
+        self.db_sum = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, duration, db_time, queries, duplicates):
+        index = bisect.bisect_left(DURATION_BUCKETS, duration)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.duration_sum += duration
+        self.db_sum += db_time
+        self.queries += queries
+        self.duplicate_queries += duplicates
+        self.recent.append(duration)
+
+    def quantiles(self):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(lambda: ViewMetrics(_window_size()))
+
+    def observe(self, view, duration, db_time, queries, duplicates):
+        with self._lock:
+            self._views[view].observe(duration, db_time, queries, duplicates)
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """The registry in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                '# HELP catalog_request_duration_seconds Wall time of requests by view.',
+                '# TYPE catalog_request_duration_seconds histogram',
+            ]
+            for view, m in views:
+                cumulative = 0
+                for bound, n in zip(DURATION_BUCKETS, m.buckets):
+                    cumulative += n
+                    lines.append(f'catalog_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'catalog_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {m.count}')
+                lines.append(f'catalog_request_duration_seconds_sum{{view="{view}"}} {m.duration_sum:.6f}')
+                lines.append(f'catalog_request_duration_seconds_count{{view="{view}"}} {m.count}')
+
+            lines += [
+                '# HELP catalog_request_recent_duration_seconds Wall time quantiles over the latest requests by view.',
+                '# TYPE catalog_request_recent_duration_seconds gauge',
+            ]
+            for view, m in views:
+                for q, value in m.quantiles().items():
+                    lines.append(f'catalog_request_recent_duration_seconds{{view="{view}",quantile="{q}"}} {value:.6f}')
+
+            counters = (
+                ('catalog_request_db_seconds_total', 'Time spent in database queries by view.', 'db_sum'),
+                ('catalog_request_queries_total', 'Database queries by view.', 'queries'),
+                ('catalog_request_duplicate_queries_total',
+                 'Queries repeating the SQL of an earlier query in the same request (likely N+1), by view.',
+                 'duplicate_queries'),
+            )
+            for name, help_text, attr in counters:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for view, m in views:
+                    value = getattr(m, attr)
+                    lines.append(f'{name}{{view="{view}"}} {value:.6f}' if isinstance(value, float)
+                                 else f'{name}{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,184 @@
+import contextlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimer:
+    """A connection.execute_wrapper() hook that times every statement and keeps its SQL."""
+
+    def __init__(self):
+        self.statements = []
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.statements.append(sql)
+
+    @property
+    def duplicates(self):
+        """Statements whose SQL (ignoring the parameters) already ran in this request."""
+        return len(self.statements) - len(set(self.statements))
+
+
+class RequestMetricsMiddleware:
+    """
+    Record wall time, database time, query count and duplicate queries of each
+    request under its view name, add them to the response as a Server-Timing
+    header, and feed catalog.metrics.registry (served at /catalog/_metrics).
+
+    Turned off by setting CATALOG_REQUEST_METRICS = False. For streaming
+    responses only the time until the response is returned is measured.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CATALOG_REQUEST_METRICS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(settings, 'CATALOG_DUPLICATE_QUERY_THRESHOLD', 5)
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        queries, duplicates = len(timer.statements), timer.duplicates
+        registry.observe(view, duration, timer.duration, queries, duplicates)
+        if duplicates >= self.duplicate_threshold:
+            logger.warning('%s ran %d duplicate queries out of %d (possible N+1): %s',
+                           view, duplicates, queries, request.path)
+
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={duration * 1000:.1f}',
+            f'db;dur={timer.duration * 1000:.1f};desc="{queries} queries, {duplicates} duplicate"',
+        ])
+        return response
+
+
+class StaticFilesMiddleware:
+    """
+    Serve the files collected in STATIC_ROOT straight from the middleware.
+
+    The files are indexed once at startup (run collectstatic, then restart).
+    A request gets the .br or .gz variant written by
+    catalog.storage.CompressedManifestStaticFilesStorage when its
+    Accept-Encoding allows it. Names listed in staticfiles.json as hashed
+    never change, so they are sent with a one-year immutable Cache-Control
+    and browsers do not ask for them again. The .br / .gz variants themselves
+    are not served under their own names. Without a collected STATIC_ROOT or
+    with DEBUG on, the middleware removes itself.
+    """
+    IMMUTABLE = 'public, max-age=31536000, immutable'
+    SHORT = 'public, max-age=60'
+    ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, get_response):
+        root = getattr(settings, 'STATIC_ROOT', None)
+        # DEBUG 時交給 runserver，才不會拿到舊的 collectstatic 結果
+        if settings.DEBUG or not root or not os.path.isdir(root) or not settings.STATIC_URL.startswith('/'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+        self.files = self.index(root)
+        self.variants = {name + suffix for name in self.files for _, suffix in self.ENCODINGS} & set(self.files)
+        self.immutable = self.hashed_names(root)
+
+    @staticmethod
+    def index(root):
+        """{url path relative to STATIC_URL: absolute file path} for every file under root."""
+        files = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                files[os.path.relpath(path, root).replace(os.sep, '/')] = path
+        return files
+
+    @staticmethod
+    def hashed_names(root):
+        try:
+            with open(os.path.join(root, 'staticfiles.json')) as f:
+                return set(json.load(f).get('paths', {}).values())
+        except (OSError, ValueError):
+            return set()
+
+    @staticmethod
+    def accepted_encodings(header):
+        """{coding: q} from an Accept-Encoding header, e.g. 'gzip;q=0, br' -> {'gzip': 0.0, 'br': 1.0}."""
+        accepted = {}
+        for item in header.split(','):
+            coding, *params = [part.strip() for part in item.split(';')]
+            if not coding:
+                continue
+            q = 1.0
+            for param in params:
+                key, _, value = param.partition('=')
+                if key.strip().lower() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            accepted[coding.lower()] = q
+        return accepted
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            name = posixpath.normpath(request.path_info[len(self.prefix):]).lstrip('/')
+            # foo.css.gz 只當作 foo.css 的壓縮版本送出，不單獨提供 (否則會被當成未壓縮的 text/css)
+            if name in self.files and name not in self.variants:
+                return self.serve(request, name)
+        return self.get_response(request)
+
+    def headers(self, response, name):
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = self.IMMUTABLE if name in self.immutable else self.SHORT
+        return response
+
+    def serve(self, request, name):
+        path = self.files[name]
+        stat = os.stat(path)
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+            return self.headers(HttpResponseNotModified(), name)
+
+        content_type, _ = mimetypes.guess_type(name)
+        accepted = self.accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding = None
+        for candidate, suffix in self.ENCODINGS:
+            # q=0 表示不接受；沒列出的編碼看 * 的設定
+            if accepted.get(candidate, accepted.get('*', 0)) > 0 and name + suffix in self.files:
+                encoding, path = candidate, self.files[name + suffix]
+                break
+
+        content_type = content_type or 'application/octet-stream'
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = os.path.getsize(path)
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        return self.headers(response, name)
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+FTS_TABLE = 'catalog_book_fts'
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 是 SQLite 專用的功能，其他資料庫就跳過
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+        f"title, summary, author, genre, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    # ORDER BY rank uses bm25 with these column weights: title, summary, author, genre
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0, 2.0)')")
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, title, summary, author, genre) "
+        f"SELECT b.id, b.title, b.summary, COALESCE(a.first_name || ' ' || a.last_name, ''), "
+        f"COALESCE((SELECT group_concat(g.name, ' ') FROM catalog_book_genre bg "
+        f"JOIN catalog_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '') "
+        f"FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
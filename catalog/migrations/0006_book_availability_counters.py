@@ -0,0 +1,59 @@
+# Generated by Django 3.0.8 on 2026-10-18 04:49
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+
+    def count(condition=Q()):
+        copies = (BookInstance.objects.filter(condition, book=OuterRef('pk')).order_by()
+                  .values('book').annotate(n=Count('pk')).values('n'))
+        return Coalesce(Subquery(copies, output_field=IntegerField()), Value(0))
+
+    Book.objects.update(
+        copies_total=count(),
+        copies_available=count(Q(status='a')),
+        copies_on_loan=count(Q(status='o')),
+        copies_maintenance=count(Q(status='m')),
+        copies_reserved=count(Q(status='r')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_maintenance',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.0.8 on 2026-10-18 05:15
+
+import catalog.models
+from django.db import migrations, models
+
+from catalog.isbn import isbn13_or_none
+
+BATCH_SIZE = 500
+
+
+def fill_isbn13(apps, schema_editor):
+    """
+    Normalize the existing ISBNs in batches. The first book (lowest id) with a
+    given ISBN-13 gets it; later duplicates stay NULL until dedupe_books
+    merges them, so the unique constraint can be added right after.
+    """
+    Book = apps.get_model('catalog', 'Book')
+    db = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        rows = list(Book.objects.using(db).filter(pk__gt=last_id).order_by('pk').values_list('pk', 'isbn')[:BATCH_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        normalized = {pk: isbn13_or_none(isbn) for pk, isbn in rows}
+        taken = set(Book.objects.using(db).filter(isbn13__in={n for n in normalized.values() if n})
+                    .values_list('isbn13', flat=True))
+        updates = []
+        for pk, isbn13 in normalized.items():
+            if isbn13 and isbn13 not in taken:
+                taken.add(isbn13)
+                updates.append(Book(pk=pk, isbn13=isbn13))
+        Book.objects.using(db).bulk_update(updates, ['isbn13'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_hold_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn13',
+            field=models.CharField(blank=True, editable=False, max_length=13, null=True, verbose_name='ISBN-13'),
+        ),
+        migrations.RunPython(fill_isbn13, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>', max_length=13, validators=[catalog.models.validate_isbn], verbose_name='ISBN'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(fields=('isbn13',), name='catalog_book_isbn13_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.8 on 2026-10-18 05:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_circulation_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupcursor',
+            name='complete_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.8 on 2026-10-18 05:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_rollupcursor_complete_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='circulationevent',
+            name='book',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='catalog.Book'),
+        ),
+    ]
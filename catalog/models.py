@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.urls import reverse                 # To generate URLS by reversing URL patterns
 import uuid                                     # Required for unique book instances
 from django.contrib.auth.models import User     # Part 8
-from datetime import date                       # Part 8
+from datetime import date, timedelta            # Part 8
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from .isbn import isbn13_or_none, normalize_isbn
 
 # Create your models here.
 class MyModelName(models.Model):
@@ -39,6 +42,18 @@ class Genre(models.Model):
         """String for representing the Model object."""
         return self.name
 
+    def get_absolute_url(self):
+        """Returns the url to access the page of this genre."""
+        return reverse('genre-detail', args=[str(self.id)])
+
+def validate_isbn(value):
+    """Reject anything that is not a valid ISBN-10 or ISBN-13 (checksum included)."""
+    try:
+        normalize_isbn(value)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+
 # 書本模型 (Book model)
 class Book(models.Model):
     """Model representing a book (but not a specific copy of a book)."""
@@ -53,13 +68,35 @@ class Book(models.Model):
     # Foreign Key used because book can only have one author, but authors can have multiple books
     # Author as a string rather than object because it hasn't been declared yet in the file.
     summary = models.TextField(max_length=1000, help_text='Enter a brief description of the book')
-    isbn = models.CharField('ISBN', max_length=13,
+    isbn = models.CharField('ISBN', max_length=13, validators=[validate_isbn],
                             help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
 
+    # isbn 正規化後的 ISBN-13 (ISBN-10 會轉換)，有唯一索引，用來查詢與找出重複的書 (見 catalog/isbn.py)
+    # 空白或無效的 ISBN，以及還沒被 dedupe_books 合併的重複書，這個欄位是 NULL
+    isbn13 = models.CharField('ISBN-13', max_length=13, null=True, blank=True, editable=False)
+
     # ManyToManyField used because genre can contain many books. Books can cover many genres.
     # Genre class has already been defined so we can specify the object above.
     genre = models.ManyToManyField(Genre, help_text='Select a genre for this book')
 
+    # 各狀態副本數量的計數器 (denormalized)，在 BookInstance 變更時以 F() 原子更新，
+    # 列表頁顯示可借閱數量就不必再去數 BookInstance。見 catalog/availability.py
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+    copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+    copies_maintenance = models.PositiveIntegerField(default=0, editable=False)
+    copies_reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # ISBN 查詢用
+            models.Index(fields=['isbn'], name='catalog_book_isbn_idx'),
+        ]
+        constraints = [
+            # 同一個 ISBN-13 只能有一本書；NULL 不受限制
+            models.UniqueConstraint(fields=['isbn13'], name='catalog_book_isbn13_unique'),
+        ]
+
     # 這個模型也定義了 __str__() ，使用書本的 title 字段來表示一筆 Book 的紀錄。
     def __str__(self):
         """String for representing the Model object."""
@@ -71,6 +108,24 @@ class Book(models.Model):
         """Returns the url to access a detail record for this book."""
         return reverse('book-detail', args=[str(self.id)])
 
+    def clean(self):
+        isbn13 = isbn13_or_none(self.isbn)
+        if isbn13 and Book.objects.filter(isbn13=isbn13).exclude(pk=self.pk).exists():
+            raise ValidationError({'isbn': f'Another book already has ISBN {isbn13}.'})
+
+    # 計數器只由 catalog/availability.py 以 F() 更新；一般的儲存不能用記憶體中 (可能已過時) 的值覆蓋
+    COUNTER_FIELDS = ('copies_total', 'copies_available', 'copies_on_loan', 'copies_maintenance', 'copies_reserved')
+
+    def save(self, *args, **kwargs):
+        self.isbn13 = isbn13_or_none(self.isbn)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        if update_fields is not None:
+            update_fields = {*update_fields, 'isbn13'} if 'isbn' in update_fields else set(update_fields)
+            kwargs['update_fields'] = update_fields - set(self.COUNTER_FIELDS)
+        super().save(*args, **kwargs)
+
     # 這會從genre記錄的的頭三個值（如果有的話）創建一個字符串, 和創建一個在管理者網站中出現的short_description標題。
     def display_genre(self):
         """Create a string for the Genre. This is required to display genre in Admin."""
@@ -78,6 +133,29 @@ class Book(models.Model):
 
     display_genre.short_description = 'Genre'
 
+# 借閱中 / 逾期的判斷放在 QuerySet 裡，由資料庫一次篩選、計數、排序，不必逐筆在 Python 判斷
+class BookInstanceQuerySet(models.QuerySet):
+    """Loan queries evaluated in SQL; `today` defaults to date.today()."""
+
+    def on_loan(self):
+        return self.filter(status__exact='o')
+
+    def overdue(self, today=None):
+        """Copies on loan whose due date has passed (uses the status/due_back index)."""
+        return self.on_loan().filter(due_back__lt=today or date.today())
+
+    def due_within(self, days, today=None):
+        """Copies on loan due between today and `days` days from now, inclusive."""
+        today = today or date.today()
+        return self.on_loan().filter(due_back__gte=today, due_back__lte=today + timedelta(days=days))
+
+    def with_overdue(self, today=None):
+        """Annotate is_overdue, computed by the database instead of the model property."""
+        return self.annotate(is_overdue=models.Case(
+            models.When(status__exact='o', due_back__lt=today or date.today(), then=models.Value(True)),
+            default=models.Value(False), output_field=models.BooleanField()))
+
+
 # 書本詳情模型 (BookInstance model)
 class BookInstance(models.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed from the library)."""
@@ -109,6 +187,12 @@ class BookInstance(models.Model):
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        indexes = [
+            # 借閱清單：status='o' 依 due_back (再以 id 當 cursor 分頁的 tie-breaker) 排序；首頁的 status='a' 計數也用得到
+            models.Index(fields=['status', 'due_back', 'id'], name='catalog_bi_status_due_idx'),
+            # 我的借閱清單：borrower + status='o' 依 due_back 排序
+            models.Index(fields=['borrower', 'status', 'due_back', 'id'], name='catalog_bi_borrower_due_idx'),
+        ]
 
     # 而 __str__() 模型用來表示 BookInstance 這個物件的「唯一 ID」和「相關之 Book 書本名稱(title)」的組合。
     def __str__(self):
@@ -118,12 +202,32 @@ class BookInstance(models.Model):
         # 在舊版 Python 這部分的教學中，我們則使用了另一種有效的 formatted string 語法
         # (e.g. '{0} ({1})'.format(self.id,self.book.title))
 
+    objects = BookInstanceQuerySet.as_manager()
+
+    # catalog/signals.py 在 pre_save 鎖住並讀出舊的狀態，再於 post_save 調整計數器、寫借閱紀錄；
+    # 整個儲存放在同一個交易裡，鎖才有效 (PostgreSQL / MySQL 在交易外不能 select_for_update)，
+    # 也不會只寫了一半
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(BookInstance, instance=self)):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(BookInstance, instance=self)):
+            return super().delete(*args, **kwargs)
+
     @property
     def is_overdue(self):
+        # with_overdue() 查出來的物件直接用資料庫算好的值
+        if '_is_overdue' in self.__dict__:
+            return self._is_overdue
         if self.due_back and date.today() > self.due_back:
             return True
         return False
 
+    @is_overdue.setter
+    def is_overdue(self, value):
+        self._is_overdue = value
+
 # 作者模型(Author model)
 class Author(models.Model):
     """Model representing an author."""
@@ -134,6 +238,9 @@ class Author(models.Model):
 
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['last_name', 'first_name', 'id'], name='catalog_author_name_idx'),
+        ]
 
     # def get_absolute_url(self):
     #     """Returns the url to access a particular author instance."""
@@ -145,3 +252,119 @@ class Author(models.Model):
 
 
 
+
+# 逾期通知的寄送紀錄：同一本副本、同一個到期日只通知一次，所以 send_overdue_notices 重跑不會重複寄信
+# (續借後 due_back 改變，再次逾期時會再通知)
+class OverdueNotice(models.Model):
+    """An overdue notice sent to the borrower of a copy for one due date."""
+    book_instance = models.ForeignKey('BookInstance', on_delete=models.CASCADE, related_name='overdue_notices')
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE)
+    due_back = models.DateField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book_instance', 'due_back'], name='catalog_overdue_notice_once'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_instance_id} due {self.due_back} ({self.borrower_id})'
+
+# 預約 (hold) 佇列：每本書 (Book) 依預約時間排隊，有副本歸還時保留給排第一位的讀者
+class Hold(models.Model):
+    """A patron's place in the queue for a Book; see catalog/circulation.py for the services."""
+    WAITING = 'w'
+    READY = 'r'
+    FULFILLED = 'f'
+    CANCELLED = 'c'
+    HOLD_STATUS = (
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+    )
+    ACTIVE = (WAITING, READY)
+
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='holds')
+    patron = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    status = models.CharField(max_length=1, choices=HOLD_STATUS, default=WAITING)
+    # 保留給這位讀者的副本 (status 為 Reserved)，READY 時才有值
+    book_instance = models.ForeignKey('BookInstance', on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='holds')
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            # 排隊順序：某本書 status='w' 依預約時間
+            models.Index(fields=['book', 'status', 'created_at', 'id'], name='catalog_hold_queue_idx'),
+        ]
+        constraints = [
+            # 一位讀者對同一本書只能有一筆進行中的預約
+            models.UniqueConstraint(fields=['book', 'patron'], condition=models.Q(status__in=['w', 'r']),
+                                    name='catalog_hold_one_active'),
+        ]
+
+    def __str__(self):
+        return f'{self.patron_id} on {self.book_id} ({self.get_status_display()})'
+
+# 借閱紀錄 (append-only)：借出、續借、歸還都在同一個交易裡新增一筆，不會修改或刪除
+# 副本或書被刪除 (或被 dedupe_books 合併) 後紀錄仍然保留，所以不建立資料庫的外鍵約束
+class CirculationEvent(models.Model):
+    """One checkout, renewal or return of a copy, written by catalog/circulation.py."""
+    CHECKOUT = 'c'
+    RENEWAL = 'n'
+    RETURN = 'r'
+    EVENT_KINDS = (
+        (CHECKOUT, 'Checkout'),
+        (RENEWAL, 'Renewal'),
+        (RETURN, 'Return'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=1, choices=EVENT_KINDS)
+    book_instance = models.ForeignKey('BookInstance', on_delete=models.DO_NOTHING, db_constraint=False,
+                                      related_name='+')
+    # 副本的 book 可以是 NULL (書被刪除時 SET_NULL)，這樣的紀錄只計入每日總數
+    book = models.ForeignKey('Book', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    borrower = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                                 related_name='+')
+    # 事件之後的到期日 (歸還時為 NULL)
+    due_back = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.get_kind_display()} of {self.book_instance_id} at {self.created_at:%Y-%m-%d %H:%M}'
+
+
+# 借閱紀錄的每日彙總，由 `manage.py rollup_circulation` 逐步累加；報表只讀這些表
+class DailyBookCirculation(models.Model):
+    """Checkouts, renewals and returns of one book on one day."""
+    day = models.DateField()
+    book = models.ForeignKey('Book', on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    checkouts = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'book'], name='catalog_daily_book_circulation_once'),
+        ]
+
+
+class DailyCirculation(models.Model):
+    """Checkouts, renewals and returns of the whole library on one day."""
+    day = models.DateField(unique=True)
+    checkouts = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+
+class RollupCursor(models.Model):
+    """How far a rollup has read an append-only table: the last id it has added in."""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+    # 最後一次跑完時，這個時間之前建立的紀錄都已經加進彙總 (比執行時間早 settle 秒)
+    complete_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,225 @@
+"""
+Keyset (cursor) pagination for the catalog list views.
+
+Instead of OFFSET/LIMIT plus a COUNT(*), each page is fetched with a WHERE
+clause that starts right after the last row of the previous page, following
+the view's ordering (or the model's Meta.ordering) with the primary key as a
+tie-breaker. The position is passed around as an opaque ?cursor= token.
+
+EstimatedCountPaginator is for the admin, which needs page numbers: it
+replaces the COUNT(*) over a whole large table with the database's own row
+estimate.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404, QueryDict
+from django.utils.functional import cached_property
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+def encode_cursor(direction, values):
+    data = json.dumps({'d': direction, 'v': values}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (direction, values) for a token, raising Http404 for anything malformed."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        direction, values = data['d'], data['v']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise Http404('Invalid cursor.')
+    if direction not in (FORWARD, BACKWARD) or not isinstance(values, list):
+        raise Http404('Invalid cursor.')
+    return direction, values
+
+
+class CursorPage:
+    """One page of rows, with tokens pointing at its neighbours."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, query_params=None,
+                 cursor_query_param='cursor', total_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.query_params = query_params if query_params is not None else QueryDict()
+        self.cursor_query_param = cursor_query_param
+        self.total_count = total_count
+
+    cursor_paginated = True
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def _querystring(self, cursor):
+        # 保留其他的 GET 參數 (例如篩選條件)，只替換 cursor
+        params = self.query_params.copy()
+        params.pop('page', None)
+        params[self.cursor_query_param] = cursor
+        return params.urlencode()
+
+    @property
+    def next_querystring(self):
+        return self._querystring(self.next_cursor)
+
+    @property
+    def previous_querystring(self):
+        return self._querystring(self.previous_cursor)
+
+
+class CursorPaginationMixin:
+    """
+    ListView mixin replacing Django's OFFSET pagination with keyset pagination.
+
+    The ordering comes from the view's ``ordering`` or the model's
+    ``Meta.ordering``; only concrete fields of the model itself are supported.
+    Set ``cursor_count = True`` to also show the total number of rows, which
+    costs a COUNT(*) per page.
+    """
+    cursor_query_param = 'cursor'
+    cursor_count = False
+
+    def get_cursor_ordering(self):
+        """Return [(field name, descending)], always ending with the primary key."""
+        ordering = self.get_ordering() or self.model._meta.ordering
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        pk_name = self.model._meta.pk.name
+        fields = []
+        for name in ordering:
+            if not isinstance(name, str) or '__' in name or name.lstrip('-') == '?':
+                raise ImproperlyConfigured(
+                    f'{self.__class__.__name__} cannot use {name!r} as a cursor pagination ordering.')
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            fields.append((pk_name if name == 'pk' else name, descending))
+        if pk_name not in [name for name, _ in fields]:
+            fields.append((pk_name, False))
+        return fields
+
+    def _row_values(self, obj, ordering):
+        meta = self.model._meta
+        return [getattr(obj, meta.get_field(name).attname) for name, _ in ordering]
+
+    def _keyset_filter(self, ordering, values, backward, nulls_largest):
+        """Build the WHERE clause selecting rows strictly after `values` in the given direction."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending), value in zip(ordering, values):
+            descending = descending != backward
+            # 不同資料庫排序 NULL 的位置不一樣 (SQLite/MySQL 視為最小值，PostgreSQL/Oracle 視為最大值)
+            nulls_first = nulls_largest == descending
+            if value is None:
+                after = Q(**{f'{name}__isnull': False}) if nulls_first else Q(pk__in=[])
+                same = Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+                if not nulls_first:
+                    after |= Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+            condition |= equal & after
+            equal &= same
+        return condition
+
+    def get_cursor_page(self, queryset, page_size):
+        ordering = self.get_cursor_ordering()
+        token = self.request.GET.get(self.cursor_query_param)
+        direction, values = decode_cursor(token) if token else (FORWARD, None)
+        if values is not None and len(values) != len(ordering):
+            raise Http404('Invalid cursor.')
+        backward = direction == BACKWARD
+
+        order_by = [('-' if descending != backward else '') + name for name, descending in ordering]
+        page_qs = queryset.order_by(*order_by)
+        if values is not None:
+            nulls_largest = connections[queryset.db].features.nulls_order_largest
+            page_qs = page_qs.filter(self._keyset_filter(ordering, values, backward, nulls_largest))
+
+        # 多取一筆，用來判斷後面還有沒有下一頁，不需要 COUNT(*)
+        rows = list(page_qs[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backward:
+                next_cursor = encode_cursor(FORWARD, self._row_values(rows[-1], ordering))
+            if (has_more and backward) or (values is not None and not backward):
+                previous_cursor = encode_cursor(BACKWARD, self._row_values(rows[0], ordering))
+
+        return CursorPage(
+            rows, next_cursor, previous_cursor,
+            query_params=self.request.GET,
+            cursor_query_param=self.cursor_query_param,
+            total_count=queryset.count() if self.cursor_count else None,
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        page = self.get_cursor_page(queryset, page_size)
+        return None, page, page.object_list, page.has_other_pages()
+
+
+def estimated_row_count(model, using='default'):
+    """The database's estimate of the number of rows of `model`, or None when it has none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        elif connection.vendor == 'sqlite':
+            # ANALYZE 之後 sqlite_stat1 才有資料；stat 的第一個數字是資料表的列數
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that, for an unfiltered queryset over a large table, uses the
+    database's row estimate instead of COUNT(*). Filtered querysets, and
+    tables estimated below `exact_count_below` rows, are counted exactly.
+    """
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.exact_count_below:
+                return estimate
+        return super().count
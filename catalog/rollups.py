@@ -0,0 +1,137 @@
+"""
+Daily summaries of the circulation event log (CirculationEvent).
+
+The log only grows, so the rollup never rereads it: a cursor row remembers
+the last event id already added in, and each run groups only the events
+after it, by day and book, and adds the counts to DailyBookCirculation and
+DailyCirculation in the same transaction that moves the cursor. Running it
+twice adds nothing the second time.
+
+Ids are assigned at INSERT but become visible at COMMIT, so a long
+transaction could commit an id below one already rolled up. Events younger
+than `settle` seconds are left for the next run, which covers every
+circulation transaction (they are short) on backends with concurrent writers.
+
+Staff reports read only the summary tables, so they cost the same whatever
+the size of the log.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Book, CirculationEvent, DailyBookCirculation, DailyCirculation, RollupCursor
+
+CURSOR_NAME = 'circulation'
+COUNTERS = ('checkouts', 'renewals', 'returns')
+KIND_COUNTERS = {
+    'checkouts': CirculationEvent.CHECKOUT,
+    'renewals': CirculationEvent.RENEWAL,
+    'returns': CirculationEvent.RETURN,
+}
+# SQLite 一個查詢最多 999 個參數
+_CHUNK = 400
+
+
+def _chunked(values):
+    values = list(values)
+    for start in range(0, len(values), _CHUNK):
+        yield values[start:start + _CHUNK]
+
+
+def _add_counts(model, rows, key_fields):
+    """Add `rows` ({key: {counter: n}}) to the existing `model` rows, creating the missing ones."""
+    existing = {}
+    keys = list(rows)
+    for chunk in _chunked(keys):
+        conditions = Q()
+        for key in chunk:
+            conditions |= Q(**dict(zip(key_fields, key)))
+        for row in model.objects.select_for_update().filter(conditions):
+            existing[tuple(getattr(row, field) for field in key_fields)] = row
+    changed, created = [], []
+    for key, counts in rows.items():
+        row = existing.get(key)
+        if row is None:
+            created.append(model(**dict(zip(key_fields, key)), **counts))
+            continue
+        for counter, n in counts.items():
+            setattr(row, counter, getattr(row, counter) + n)
+        changed.append(row)
+    model.objects.bulk_update(changed, COUNTERS, batch_size=_CHUNK)
+    model.objects.bulk_create(created, batch_size=_CHUNK)
+
+
+def _rollup_range(first_id, last_id):
+    """Add the events with first_id < id <= last_id to the daily summaries; returns how many there were."""
+    rows = (CirculationEvent.objects.filter(pk__gt=first_id, pk__lte=last_id)
+            .annotate(day=TruncDate('created_at')).values_list('day', 'book_id')
+            .annotate(**{counter: Count('id', filter=Q(kind=kind)) for counter, kind in KIND_COUNTERS.items()})
+            .order_by())
+    per_book, per_day = {}, {}
+    for day, book_id, *counts in rows:
+        # 沒有書的副本 (書已刪除) 只計入每日總數
+        if book_id is not None:
+            per_book[(day, book_id)] = dict(zip(COUNTERS, counts))
+        totals = per_day.setdefault((day,), dict.fromkeys(COUNTERS, 0))
+        for counter, n in zip(COUNTERS, counts):
+            totals[counter] += n
+    _add_counts(DailyBookCirculation, per_book, ('day', 'book_id'))
+    _add_counts(DailyCirculation, per_day, ('day',))
+    return sum(sum(counts.values()) for counts in per_day.values())
+
+
+def rollup_circulation(settle=60, batch_size=5000):
+    """
+    Add the circulation events not rolled up yet (and older than `settle`
+    seconds) to the daily summaries, `batch_size` events per transaction.
+    Returns the number of events added.
+    """
+    cutoff = timezone.now() - datetime.timedelta(seconds=settle)
+    added = 0
+    while True:
+        with transaction.atomic():
+            # 鎖住游標：兩個 rollup 同時執行時，第二個會等第一個 commit 後再從新的位置接著做
+            RollupCursor.objects.get_or_create(name=CURSOR_NAME)
+            cursor = RollupCursor.objects.select_for_update().get(name=CURSOR_NAME)
+            ids = list(CirculationEvent.objects.filter(pk__gt=cursor.last_id, created_at__lte=cutoff)
+                       .order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                # 跑完了：cutoff 之前的事件都已計入
+                cursor.complete_until = cutoff
+                cursor.save()
+                return added
+            added += _rollup_range(cursor.last_id, ids[-1])
+            cursor.last_id = ids[-1]
+            cursor.save()
+
+
+def circulation_report(days=30, top=20, today=None):
+    """
+    The staff circulation report for the last `days` days, from the summary
+    tables only: the totals per day (days without events included), the
+    totals of the period and the most borrowed books.
+    """
+    today = today or timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    counted = {row['day']: row for row in
+               DailyCirculation.objects.filter(day__gte=start, day__lte=today).values('day', *COUNTERS)}
+    daily = [counted.get(day) or dict(day=day, **dict.fromkeys(COUNTERS, 0))
+             for day in (today - datetime.timedelta(days=n) for n in range(days))]
+    totals = {counter: sum(row[counter] for row in daily) for counter in COUNTERS}
+
+    books = list(DailyBookCirculation.objects.filter(day__gte=start, day__lte=today).values('book_id')
+                 .annotate(**{counter: Sum(counter) for counter in COUNTERS})
+                 .order_by('-checkouts', '-renewals', 'book_id')[:top])
+    titles = Book.objects.only('title').in_bulk([row['book_id'] for row in books])
+    for row in books:
+        # 書可能已被刪除或合併，紀錄照樣保留
+        row['book'] = titles.get(row['book_id'])
+
+    cursor = RollupCursor.objects.filter(name=CURSOR_NAME).first()
+    return {
+        'start': start, 'end': today, 'days': days, 'daily': daily, 'totals': totals, 'top_books': books,
+        'complete_until': cursor.complete_until if cursor else None,
+    }
@@ -0,0 +1,125 @@
+"""
+Ranked full-text book search backed by an SQLite FTS5 virtual table.
+
+catalog_book_fts holds one row per Book (rowid = Book.id) with the title,
+summary, author name and genre names. It is created by migration 0005 and
+kept in sync from the signal handlers in catalog/signals.py; run
+`manage.py rebuild_search_index` to rebuild it from scratch.
+
+On other database backends the index does not exist and every function here
+is a no-op.
+"""
+import re
+
+from django.db import connections, router
+
+from .models import Author, Book, Genre
+
+FTS_TABLE = 'catalog_book_fts'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _write_connection():
+    return connections[router.db_for_write(Book)]
+
+
+def _read_connection():
+    # 經過 router：read_replica() 的 view 裡從副本讀
+    return connections[router.db_for_read(Book)]
+
+
+def search_enabled(connection=None):
+    return (connection or _write_connection()).vendor == 'sqlite'
+
+
+def _reindex(where, params):
+    """Replace the index rows of every book matching `where` (an SQL condition on alias b)."""
+    connection = _write_connection()
+    qn = connection.ops.quote_name
+    book, author, genre = (qn(m._meta.db_table) for m in (Book, Author, Genre))
+    through = qn(Book.genre.through._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT b.id FROM {book} b WHERE {where})', params)
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, summary, author, genre) '
+            f'SELECT b.id, b.title, b.summary, '
+            f"COALESCE(a.first_name || ' ' || a.last_name, ''), "
+            f"COALESCE((SELECT group_concat(g.name, ' ') FROM {through} bg "
+            f'JOIN {genre} g ON g.id = bg.genre_id WHERE bg.book_id = b.id), \'\') '
+            f'FROM {book} b LEFT JOIN {author} a ON a.id = b.author_id WHERE {where}',
+            params)
+
+
+def index_books(book_ids):
+    """(Re)index the given books."""
+    book_ids = list(book_ids)
+    if not search_enabled() or not book_ids:
+        return
+    # SQLite 一次能綁定的參數數量有限，分批處理
+    for start in range(0, len(book_ids), 500):
+        batch = book_ids[start:start + 500]
+        _reindex(f'b.id IN ({", ".join(["%s"] * len(batch))})', batch)
+
+
+def index_author_books(author_id):
+    if search_enabled():
+        _reindex('b.author_id = %s', [author_id])
+
+
+def index_genre_books(genre_id):
+    if search_enabled():
+        through = _write_connection().ops.quote_name(Book.genre.through._meta.db_table)
+        _reindex(f'b.id IN (SELECT book_id FROM {through} WHERE genre_id = %s)', [genre_id])
+
+
+def remove_books(book_ids):
+    book_ids = list(book_ids)
+    if not search_enabled() or not book_ids:
+        return
+    with _write_connection().cursor() as cursor:
+        for start in range(0, len(book_ids), 500):
+            batch = book_ids[start:start + 500]
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({", ".join(["%s"] * len(batch))})', batch)
+
+
+def rebuild_search_index():
+    """Drop every index row and rebuild the whole index in one INSERT ... SELECT."""
+    if not search_enabled():
+        return 0
+    with _write_connection().cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        _reindex('1 = 1', [])
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+def build_match_query(text):
+    """
+    Turn free text typed by a patron into an FTS5 MATCH expression.
+
+    Every word must match (implicit AND); words are quoted so FTS5 operators in
+    the input are treated as text, and the last word also matches as a prefix
+    so results show up while the patron is still typing.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return ''
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_book_ids(text, limit=20, offset=0):
+    """Return the ids of the best matching books, best first."""
+    match = build_match_query(text)
+    connection = _read_connection()
+    if not search_enabled(connection) or not match:
+        return []
+    with connection.cursor() as cursor:
+        # rank 已在建表時設定為 bm25(title 10, summary 1, author 5, genre 2)
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s',
+            [match, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,154 @@
+"""Signal handlers keeping cached catalog data, page cache versions and the search index in step with the models."""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import availability, caching, circulation, search
+from .models import Author, Book, BookInstance, Genre
+from .stats import adjust_catalog_stats, invalidate_catalog_stats
+
+
+def _on_commit_adjust(**deltas):
+    # 等交易 commit 之後才更新快取，避免 rollback 時計數器跟資料庫不一致
+    transaction.on_commit(partial(adjust_catalog_stats, **deltas))
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, **kwargs):
+    if created:
+        _on_commit_adjust(num_books=1)
+    # The search index is written in the same transaction as the book itself.
+    search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    _on_commit_adjust(num_books=-1)
+    search.remove_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.index_books([instance.pk])
+    elif pk_set:
+        # genre.book_set.add(...) 之類的反向操作，instance 是 Genre
+        search.index_books(pk_set)
+    else:
+        search.index_genre_books(instance.pk)
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, **kwargs):
+    if created:
+        _on_commit_adjust(num_authors=1)
+    else:
+        search.index_author_books(instance.pk)
+
+
+@receiver(pre_delete, sender=Author)
+def author_deleting(sender, instance, **kwargs):
+    # The books are detached with SET_NULL (no signals), so remember them now.
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    _on_commit_adjust(num_authors=-1)
+    search.index_books(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved(sender, instance, created, **kwargs):
+    if not created:
+        search.index_genre_books(instance.pk)
+
+
+@receiver(pre_delete, sender=Genre)
+def genre_deleting(sender, instance, **kwargs):
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+    search.index_books(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(pre_save, sender=BookInstance)
+def book_instance_saving(sender, instance, raw, **kwargs):
+    # 先讀出 (並鎖住) 資料庫中目前的 book / status，儲存後才知道計數器要怎麼調整；
+    # 不依賴記憶體中可能已經過時的物件
+    instance._previous_availability = instance._previous_loan = None
+    if not instance._state.adding and not raw:
+        previous = (BookInstance.objects.select_for_update().filter(pk=instance.pk)
+                    .values_list('book_id', 'status', 'borrower_id', 'due_back').first())
+        if previous is not None:
+            instance._previous_availability, instance._previous_loan = previous[:2], previous[1:]
+
+
+@receiver(post_save, sender=BookInstance)
+def book_instance_saved(sender, instance, created, **kwargs):
+    current = (instance.book_id, instance.status)
+    previous = getattr(instance, '_previous_availability', None)
+
+    if created:
+        availability.apply_deltas(availability.copy_deltas(*current, 1))
+        _on_commit_adjust(num_instances=1, num_instances_available=int(instance.status == 'a'))
+    elif previous is not None:
+        availability.apply_deltas(availability.merge_deltas(
+            availability.copy_deltas(*previous, -1), availability.copy_deltas(*current, 1)))
+        _on_commit_adjust(num_instances_available=int(current[1] == 'a') - int(previous[1] == 'a'))
+    else:
+        # Raw (fixture) saves: recount the book and let the next read recount the home page counters.
+        availability.recount_availability(Book.objects.filter(pk=instance.book_id))
+        transaction.on_commit(invalidate_catalog_stats)
+
+
+@receiver(post_save, sender=BookInstance)
+def book_instance_loan_changed(sender, instance, created, raw, **kwargs):
+    # 直接 save() 的借還 (admin、表單) 也要寫進借閱紀錄；circulation.py 的服務用 update()，不會經過這裡
+    if raw:
+        return
+    previous = (None, None, None) if created else getattr(instance, '_previous_loan', None)
+    if previous is not None:
+        circulation.record_events(circulation.loan_events(
+            instance.pk, instance.book_id, previous, (instance.status, instance.borrower_id, instance.due_back)))
+
+
+@receiver(post_delete, sender=BookInstance)
+def book_instance_deleted(sender, instance, **kwargs):
+    # The row is gone and the in-memory status may be stale, so recount rather than adjust.
+    availability.recount_availability(Book.objects.filter(pk=instance.book_id))
+    transaction.on_commit(invalidate_catalog_stats)
+
+
+# Page cache version stamps (catalog/caching.py): bumped after commit, so a page
+# rendered from the old data is never cached under the new version.
+VERSION_LABELS = {
+    Book: caching.BOOK,
+    Author: caching.AUTHOR,
+    Genre: caching.GENRE,
+    BookInstance: caching.BOOKINSTANCE,
+}
+
+
+def _on_commit_bump(*labels):
+    transaction.on_commit(partial(caching.bump_versions, *labels))
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Genre)
+@receiver([post_save, post_delete], sender=BookInstance)
+def catalog_model_changed(sender, **kwargs):
+    _on_commit_bump(VERSION_LABELS[sender])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_version(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _on_commit_bump(caching.BOOK, caching.GENRE)
@@ -0,0 +1,78 @@
+"""
+Catalog statistics shown on the home page.
+
+All counters are computed with a single aggregate query and kept in the cache,
+one key per counter, so signal handlers can adjust them with cache.incr()
+instead of recounting whole tables.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Author, Book, BookInstance
+
+STAT_NAMES = ('num_books', 'num_instances', 'num_instances_available', 'num_authors')
+
+CACHE_KEY_PREFIX = 'catalog:stats:'
+
+
+def _cache_key(name):
+    return CACHE_KEY_PREFIX + name
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_STATS_TIMEOUT', 60 * 15)
+
+
+def compute_catalog_stats():
+    """Count books, copies, available copies and authors in one round-trip."""
+    qn = connection.ops.quote_name
+    book_table = qn(Book._meta.db_table)
+    instance_table = qn(BookInstance._meta.db_table)
+    author_table = qn(Author._meta.db_table)
+    sql = (
+        f'SELECT (SELECT COUNT(*) FROM {book_table}), '
+        f'(SELECT COUNT(*) FROM {instance_table}), '
+        f'(SELECT COUNT(*) FROM {instance_table} WHERE {qn("status")} = %s), '
+        f'(SELECT COUNT(*) FROM {author_table})'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ['a'])
+        row = cursor.fetchone()
+    return dict(zip(STAT_NAMES, row))
+
+
+def warm_catalog_stats():
+    """Recompute every counter and store it in the cache."""
+    stats = compute_catalog_stats()
+    cache.set_many({_cache_key(name): value for name, value in stats.items()}, _timeout())
+    return stats
+
+
+def get_catalog_stats():
+    """Return the counters from the cache, recomputing them all if any is missing."""
+    cached = cache.get_many([_cache_key(name) for name in STAT_NAMES])
+    if len(cached) == len(STAT_NAMES):
+        return {name: cached[_cache_key(name)] for name in STAT_NAMES}
+    return warm_catalog_stats()
+
+
+def invalidate_catalog_stats():
+    cache.delete_many([_cache_key(name) for name in STAT_NAMES])
+
+
+def adjust_catalog_stats(**deltas):
+    """
+    Add the given deltas to the cached counters, e.g. adjust_catalog_stats(num_books=1).
+
+    If a counter has already expired the whole set is dropped, so the next read
+    recomputes all of them together rather than mixing fresh and stale values.
+    """
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_cache_key(name), delta)
+        except ValueError:
+            invalidate_catalog_stats()
+            return
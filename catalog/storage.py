@@ -0,0 +1,56 @@
+"""
+Static files storage: manifest-hashed names plus pre-compressed variants.
+
+After ManifestStaticFilesStorage has written the hashed copies
+(styles.1a2b3c4d5e6f.css) and staticfiles.json, every compressible file in
+STATIC_ROOT also gets a .gz variant and, when the optional `brotli` package
+is installed, a .br variant. A variant is kept only when it is smaller than
+the original. catalog.middleware.StaticFilesMiddleware serves them.
+"""
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.map', '.xml')
+# 太小的檔案壓縮後省不了多少，還要多一次解壓縮
+MIN_SIZE = 256
+
+
+def compressed_variants(content):
+    """{suffix: bytes} for the encodings that make `content` smaller."""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return {suffix: data for suffix, data in variants.items() if len(data) < len(content)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        # 原始檔名與 hash 過的檔名都壓縮一份
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                for compressed_name in self.compress(name):
+                    yield name, compressed_name, True
+
+    def compress(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        if len(content) < MIN_SIZE:
+            return []
+        written = []
+        for suffix, data in compressed_variants(content).items():
+            path = self.path(name + suffix)
+            with open(path, 'wb') as f:
+                f.write(data)
+            written.append(name + suffix)
+        return written
@@ -1,3 +1,1240 @@
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Permission, User
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+from django.utils import timezone
+
+from . import caching, circulation, facets, rollups, search
+from .checks import check_cached_template_loader, check_shared_version_cache
+from .context_processors import sidebar_key
+from .availability import recount_availability
+from .db import ReadReplicaRouter, read_replica
+from .isbn import isbn13_or_none, normalize_isbn
+from .metrics import registry as metrics_registry
+from .stats import STAT_NAMES, compute_catalog_stats, get_catalog_stats
+from .middleware import StaticFilesMiddleware
+from .models import (Author, Book, BookInstance, CirculationEvent, DailyBookCirculation, DailyCirculation, Genre,
+                     Hold, OverdueNotice)
 
 # Create your tests here.
+
+
+class QueryCountTestMixin:
+    """
+    Regression harness for N+1 queries: a page must cost the same number of
+    queries whether it shows one row or a full page of rows.
+    """
+
+    def assertConstantQueries(self, num, url, add_row, rows=(1, 10)):
+        created = 0
+        for total in rows:
+            while created < total:
+                add_row(created)
+                created += 1
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CATALOG_PAGE_CACHE_TIMEOUT=0, CATALOG_FACET_CACHE_TIMEOUT=0)
+class ListViewQueryCountTest(QueryCountTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.borrower = User.objects.create_user(username='borrower', password='1X<ISRUkw+tuK')
+        cls.librarian = User.objects.create_user(username='librarian', password='2HJ1vRV0Z&3iD')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def make_book(self, i):
+        return Book.objects.create(title=f'Book {i}', summary='Summary', isbn=f'{i:013d}', author=self.author)
+
+    def lend_copy(self, i):
+        BookInstance.objects.create(
+            book=self.make_book(i), imprint='Imprint', status='o', borrower=self.borrower,
+            due_back=datetime.date.today() + datetime.timedelta(days=i - 5))
+
+    def test_book_list(self):
+        # one SELECT joining the author (cursor pagination, no COUNT) + one grouped query per facet
+        self.assertConstantQueries(4, reverse('books'), self.make_book, rows=(1, 3))
+
+    def test_book_detail(self):
+        book = self.make_book(0)
+
+        def add_copy(i):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='am'[i % 2])
+
+        # book + author, genres, COUNT + one page of copies
+        self.assertConstantQueries(4, book.get_absolute_url(), add_copy, rows=(1, 30))
+
+    def test_my_borrowed(self):
+        self.client.force_login(self.borrower)
+        # session + user + one SELECT joining the book
+        self.assertConstantQueries(3, reverse('my-borrowed'), self.lend_copy)
+
+    def test_all_borrowed(self):
+        self.client.force_login(self.librarian)
+        # session + user + user/group permissions + one SELECT joining book and borrower
+        self.assertConstantQueries(5, reverse('all-borrowed'), self.lend_copy)
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='2HJ1vRV0Z&3iD')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        book = Book.objects.create(title='Book', summary='Summary', isbn='0000000000000')
+        today = datetime.date.today()
+        # due_back is nullable and has duplicates, so the walk also checks NULLs and the pk tie-breaker
+        for i in range(25):
+            BookInstance.objects.create(
+                book=book, imprint='Imprint', status='o',
+                due_back=None if i % 6 == 0 else today + datetime.timedelta(days=i % 4))
+
+    def test_walk_forward_and_back(self):
+        self.client.force_login(self.librarian)
+        url = reverse('all-borrowed')
+        page = self.client.get(url).context['page_obj']
+        forward = [[copy.pk for copy in page]]
+        while page.has_next():
+            page = self.client.get(f'{url}?{page.next_querystring}').context['page_obj']
+            forward.append([copy.pk for copy in page])
+        self.assertEqual([len(rows) for rows in forward], [10, 10, 5])
+        expected = [copy.pk for copy in BookInstance.objects.order_by('due_back', 'id')]
+        self.assertEqual(sum(forward, []), expected)
+
+        backward = []
+        while page.has_previous():
+            page = self.client.get(f'{url}?{page.previous_querystring}').context['page_obj']
+            backward.insert(0, [copy.pk for copy in page])
+        self.assertEqual(backward, forward[:-1])
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('all-borrowed'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AnonymousPageCacheTest(TransactionTestCase):
+    # TransactionTestCase so the on_commit version bumps actually run
+
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+
+    def test_cached_page_costs_no_queries(self):
+        url = reverse('books')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, 'Earthsea')
+
+    def test_deploy_check_wants_shared_cache(self):
+        # 版本戳記放在各 process 自己的 LocMemCache，管理指令或其他 worker 的更新看不到
+        self.assertEqual([e.id for e in check_shared_version_cache(None)], ['catalog.W002'])
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': directory}}
+            with override_settings(CACHES=shared):
+                self.assertEqual(check_shared_version_cache(None), [])
+
+    def test_change_invalidates_page(self):
+        url = self.book.get_absolute_url()
+        self.client.get(url)
+        self.book.title = 'The Farthest Shore'
+        self.book.save()
+        self.assertContains(self.client.get(url), 'The Farthest Shore')
+
+    def test_index_visits_without_session(self):
+        url = reverse('index')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.context['num_visits'], 1)
+        self.assertNotIn('sessionid', response.cookies)
+
+
+@override_settings(CATALOG_PAGE_CACHE_TIMEOUT=0, CATALOG_FACET_CACHE_TIMEOUT=0)
+class RequestMetricsTest(TestCase):
+
+    def setUp(self):
+        metrics_registry.reset()
+
+    def test_server_timing_header(self):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        for i in range(3):
+            Book.objects.create(title=f'Book {i}', summary='Summary', isbn=f'{i:013d}', author=author)
+        response = self.client.get(reverse('books'))
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="4 queries, 0 duplicate"$')
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.get(reverse('authors'))
+        response = self.client.get(reverse('request-metrics'))
+        self.assertEqual(response.status_code, 302)
+
+        staff = User.objects.create_user(username='staff', password='3kT!vq9Lm2#pz', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('request-metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('catalog_request_duration_seconds_count{view="authors"} 1', body)
+        self.assertIn('catalog_request_queries_total{view="request-metrics"} 0', body)
+
+
+class JsonApiTest(TransactionTestCase):
+    # TransactionTestCase so the on_commit version bumps actually run
+
+    def setUp(self):
+        cache.clear()
+        self.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        self.books = [
+            Book.objects.create(title=f'Book {i}', summary='Summary', isbn=f'{i:013d}', author=self.author)
+            for i in range(3)]
+
+    def test_sparse_fieldset_and_paging(self):
+        response = self.client.get(reverse('api-books'), {'fields': 'id,title', 'limit': 2})
+        data = response.json()
+        self.assertEqual(data['results'], [{'id': book.id, 'title': book.title} for book in self.books[:2]])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(data['results'], [{'id': self.books[2].id, 'title': 'Book 2'}])
+        self.assertIsNone(data['next'])
+
+    def test_ids_out_of_range(self):
+        # 超出 SQLite 64 位元整數的 id 不能進到查詢裡 (OverflowError -> 500)
+        response = self.client.get(reverse('api-books'), {'after': 2 ** 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('api-books'), {'after': 2 ** 63 - 1}).json()['results'], [])
+        self.assertEqual(self.client.get(reverse('api-book-detail', args=[2 ** 64])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api-book-copies', args=[2 ** 64])).status_code, 404)
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('api-books'), {'fields': 'title,borrower'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+        response = self.client.get(reverse('api-book-detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_not_modified(self):
+        url = reverse('api-book-detail', args=[self.books[0].pk])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        BookInstance.objects.create(book=self.books[0], imprint='Imprint', status='a')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['copies_available'], 1)
+
+    def test_no_last_modified(self):
+        # Last-Modified 只到秒，同一秒內的第二次變更會被 If-Modified-Since 誤判為沒變
+        url = reverse('api-book-detail', args=[self.books[0].pk])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        BookInstance.objects.create(book=self.books[0], imprint='Imprint', status='a')
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['copies_available'], 1)
+
+
+class OverdueQuerySetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        cls.copies = {
+            days: BookInstance.objects.create(book=book, imprint='Imprint', status='o',
+                                              due_back=cls.today + datetime.timedelta(days=days))
+            for days in (-10, -1, 0, 3, 10)}
+        # 已歸還的副本就算 due_back 過期也不算逾期
+        BookInstance.objects.create(book=book, imprint='Imprint', status='a',
+                                    due_back=cls.today - datetime.timedelta(days=5))
+
+    def test_overdue(self):
+        self.assertCountEqual(BookInstance.objects.overdue(), [self.copies[-10], self.copies[-1]])
+
+    def test_due_within(self):
+        self.assertCountEqual(BookInstance.objects.due_within(3), [self.copies[0], self.copies[3]])
+
+    def test_with_overdue_matches_property(self):
+        for copy in BookInstance.objects.with_overdue():
+            self.assertEqual(copy.is_overdue, copy.status == 'o' and copy.due_back < self.today)
+        self.assertEqual(BookInstance.objects.with_overdue().filter(is_overdue=True).count(), 2)
+
+    def report(self, **options):
+        out = io.StringIO()
+        call_command('overdue_report', stdout=out, **options)
+        return out.getvalue()
+
+    def test_report_command(self):
+        self.assertEqual(self.report(count=True), '2\n')
+        self.assertEqual(self.report(due_within=3, count=True), '2\n')
+        rows = list(csv.reader(io.StringIO(self.report(chunk_size=1))))
+        self.assertEqual(rows[0], ['id', 'book_id', 'book_title', 'borrower', 'email', 'due_back', 'days_overdue'])
+        self.assertEqual([(row[0], row[-1]) for row in rows[1:]],
+                         [(str(self.copies[-10].pk), '10'), (str(self.copies[-1].pk), '1')])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'overdue.csv')
+            self.assertEqual(self.report(output=path), '')
+            with open(path, encoding='utf-8', newline='') as f:
+                self.assertEqual(list(csv.reader(f)), rows)
+
+    def test_overdue_view(self):
+        url = reverse('overdue-loans')
+        self.assertRedirects(self.client.get(url), f"{reverse('login')}?next={url}")
+        librarian = User.objects.create_user(username='librarian', password='secret', is_staff=True)
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.client.login(username='librarian', password='secret')
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['bookinstance_list']), [self.copies[-10], self.copies[-1]])
+        self.assertEqual((response.context['overdue_count'], response.context['due_soon_count']), (2, 2))
+        self.assertContains(response, '2 overdue, 2 due in the next 7 days.')
+
+
+class OverdueNoticeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        cls.ged = User.objects.create_user(username='ged', email='ged@example.com', first_name='Ged')
+        cls.tenar = User.objects.create_user(username='tenar', email='tenar@example.com')
+        cls.copies = [
+            BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=borrower,
+                                        due_back=today - datetime.timedelta(days=days))
+            for borrower, days in ((cls.ged, 3), (cls.ged, 1), (cls.tenar, 2))]
+        # 還沒到期，不通知
+        BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=cls.tenar,
+                                    due_back=today + datetime.timedelta(days=1))
+
+    def send(self):
+        call_command('send_overdue_notices', batch_size=1, stdout=io.StringIO())
+
+    def test_one_digest_per_borrower(self):
+        self.send()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['ged@example.com', 'tenar@example.com'])
+        ged = next(message for message in mail.outbox if message.to == ['ged@example.com'])
+        self.assertIn('Hello Ged', ged.body)
+        self.assertEqual(ged.body.count('Earthsea'), 2)
+        self.assertEqual(OverdueNotice.objects.count(), 3)
+
+    def test_rerun_is_idempotent(self):
+        self.send()
+        mail.outbox.clear()
+        self.send()
+        self.assertEqual(mail.outbox, [])
+
+        # 續借後又逾期，會再通知一次
+        copy = self.copies[2]
+        copy.due_back -= datetime.timedelta(days=1)
+        copy.save()
+        self.send()
+        self.assertEqual([message.to for message in mail.outbox], [['tenar@example.com']])
+
+
+class AdminQueryCountTest(QueryCountTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'Wq8#mZ2!rT5y')
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.genre = Genre.objects.create(name='Fantasy')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def make_book(self, i):
+        book = Book.objects.create(title=f'Book {i}', summary='Summary', isbn=f'{i:013d}', author=self.author)
+        book.genre.add(self.genre)
+        BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=self.admin,
+                                    due_back=datetime.date.today())
+        return book
+
+    def assertConstantAdminQueries(self, num, url, add_row):
+        add_row(0)
+        self.client.get(url)  # ContentType 等快取先暖好
+        self.assertConstantQueries(num, url, add_row, rows=(2, 10))
+
+    def test_book_changelist(self):
+        # session, user, 2 COUNTs, books + author, genres prefetch
+        self.assertConstantAdminQueries(6, reverse('admin:catalog_book_changelist'), self.make_book)
+
+    def test_bookinstance_changelist(self):
+        # session, user, row estimate lookup, exact COUNT (small table), copies + book + borrower
+        self.assertConstantAdminQueries(5, reverse('admin:catalog_bookinstance_changelist'), self.make_book)
+
+    def test_book_change_inline(self):
+        book = self.make_book(0)
+
+        def add_copy(i):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=self.admin,
+                                        due_back=datetime.date.today())
+
+        # session, user, savepoint pair, book, genres, copies + book + borrower, author, genre choices
+        self.assertConstantAdminQueries(9, reverse('admin:catalog_book_change', args=[book.pk]), add_copy)
+
+
+class CirculationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+        cls.ged, cls.tenar, cls.arren = (User.objects.create_user(username=name) for name in ('ged', 'tenar', 'arren'))
+
+    def test_checkout_and_return(self):
+        self.assertEqual(circulation.checkout(self.book.pk, self.ged), self.copy.pk)
+        with self.assertRaises(circulation.NoCopyAvailable):
+            circulation.checkout(self.book.pk, self.tenar)
+        self.assertTrue(circulation.return_copy(self.copy.pk))
+        self.assertFalse(circulation.return_copy(self.copy.pk))
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+
+    def test_return_promotes_next_hold(self):
+        circulation.checkout(self.book.pk, self.ged)
+        tenar = circulation.reserve(self.book.pk, self.tenar)
+        arren = circulation.reserve(self.book.pk, self.arren)
+        with self.assertRaises(circulation.AlreadyOnHold):
+            circulation.reserve(self.book.pk, self.tenar)
+
+        circulation.return_copy(self.copy.pk)
+        tenar.refresh_from_db()
+        self.assertEqual((tenar.status, tenar.book_instance_id), (Hold.READY, self.copy.pk))
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'r')
+        # 保留給 tenar 的副本別人借不走
+        with self.assertRaises(circulation.NoCopyAvailable):
+            circulation.checkout(self.book.pk, self.arren)
+
+        # tenar 取消，副本改保留給下一位
+        circulation.cancel_hold(tenar.pk)
+        arren.refresh_from_db()
+        self.assertEqual(arren.status, Hold.READY)
+        self.assertEqual(circulation.checkout(self.book.pk, self.arren), self.copy.pk)
+        arren.refresh_from_db()
+        self.assertEqual(arren.status, Hold.FULFILLED)
+
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_available, self.book.copies_on_loan, self.book.copies_reserved), (0, 1, 0))
+
+
+class CheckoutStressTest(TransactionTestCase):
+    """Many threads racing to lend, return and reserve copies of the same title."""
+    threads = 8
+    rounds = 10
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        for _ in range(3):
+            BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.patrons = [User.objects.create_user(username=f'patron{i}') for i in range(self.threads)]
+
+    def retrying(self, func, *args):
+        # SQLite 的 shared-cache 測試資料庫遇到同時寫入會直接回報 locked，重試即可
+        while True:
+            try:
+                return func(*args)
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                time.sleep(0.001)
+
+    def borrow_and_return(self, patron, lent, errors):
+        try:
+            for _ in range(self.rounds):
+                try:
+                    copy_id = self.retrying(circulation.checkout, self.book.pk, patron)
+                except circulation.NoCopyAvailable:
+                    try:
+                        self.retrying(circulation.reserve, self.book.pk, patron)
+                    except circulation.AlreadyOnHold:
+                        pass
+                    continue
+                lent.append(copy_id)
+                # 借到的副本此刻只屬於這位讀者
+                borrower = self.retrying(lambda: BookInstance.objects.get(pk=copy_id).borrower_id)
+                if borrower != patron.pk:
+                    errors.append(f'{copy_id} lent to {patron.pk} but borrowed by {borrower}')
+                self.retrying(circulation.return_copy, copy_id)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            connection.close()
+
+    def test_no_copy_is_lent_twice(self):
+        lent, errors = [], []
+        workers = [threading.Thread(target=self.borrow_and_return, args=(patron, lent, errors))
+                   for patron in self.patrons]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(lent)
+        self.assertFalse(BookInstance.objects.filter(status='o').exists())
+        # 計數器與實際副本狀態一致，副本只會是可借或保留給某個預約
+        self.assertEqual(recount_availability(), 0)
+        reserved = BookInstance.objects.filter(status='r').count()
+        self.assertEqual(Hold.objects.filter(status=Hold.READY).count(), reserved)
+        if Hold.objects.filter(status=Hold.WAITING).exists():
+            self.assertEqual(reserved, 3)
+
+
+@override_settings(CATALOG_READ_REPLICAS=['replica1'])
+class ReadReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_db(self, method):
+        @read_replica
+        def view(request):
+            return self.router.db_for_read(Book)
+        return view(getattr(self.factory, method)('/'))
+
+    def test_read_only_views_read_from_replica(self):
+        self.assertEqual(self.read_db('get'), 'replica1')
+        self.assertEqual(self.read_db('post'), 'default')
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+        self.assertEqual(self.router.db_for_write(Book), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'catalog'))
+
+    @override_settings(CATALOG_PAGE_CACHE_TIMEOUT=60)
+    def test_cached_pages_are_read_from_primary(self):
+        # 要存進快取的頁面不能從可能落後的副本讀
+        @read_replica
+        @caching.cache_anonymous_page(caching.BOOK)
+        def view(request):
+            return HttpResponse(self.router.db_for_read(Book))
+
+        cache.clear()
+        self.assertEqual(view(self.factory.get('/')).content, b'default')
+        request = self.factory.get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = 'session'
+        self.assertEqual(view(request).content, b'replica1')
+
+    def test_search_follows_the_router(self):
+        with mock.patch.object(search.router, 'db_for_read', return_value='default') as db_for_read:
+            search.search_book_ids('earthsea')
+        db_for_read.assert_called_once_with(Book)
+
+
+class StaticFilesTest(TestCase):
+    """collectstatic writes hashed, pre-compressed files that StaticFilesMiddleware serves with long caching."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            STATIC_ROOT=directory.name,
+            STATICFILES_STORAGE='catalog.storage.CompressedManifestStaticFilesStorage',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(directory.name, 'staticfiles.json')) as f:
+            self.hashed = json.load(f)['paths']['vendor/bootstrap/css/bootstrap.min.css']
+        self.middleware = StaticFilesMiddleware(lambda request: None)
+        self.factory = RequestFactory()
+
+    def test_hashed_file_is_served_compressed_and_immutable(self):
+        request = self.factory.get('/static/' + self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = self.middleware(request)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertTrue(gzip.decompress(body).startswith(b'/*!'))
+
+    def test_unhashed_name_and_plain_encoding(self):
+        request = self.factory.get('/static/vendor/bootstrap/css/bootstrap.min.css')
+        response = self.middleware(request)
+        response.close()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_other_paths_pass_through(self):
+        self.assertIsNone(self.middleware(self.factory.get('/static/missing.css')))
+        self.assertIsNone(self.middleware(self.factory.get('/catalog/')))
+
+    def test_accept_encoding_is_parsed(self):
+        for header, encoding in [('gzip;q=0', None), ('x-gzip', None), ('br;q=0, gzip;q=0.5', 'gzip'),
+                                 ('*;q=0.1', 'gzip'), ('gzip;q=0, *', None), ('GZIP', 'gzip')]:
+            with self.subTest(header=header):
+                response = self.middleware(self.factory.get('/static/' + self.hashed, HTTP_ACCEPT_ENCODING=header))
+                response.close()
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+
+    def test_variants_are_not_served_directly(self):
+        self.assertIsNone(self.middleware(self.factory.get('/static/' + self.hashed + '.gz')))
+
+    def test_not_modified_keeps_caching_headers(self):
+        response = self.middleware(self.factory.get('/static/' + self.hashed))
+        response.close()
+        request = self.factory.get('/static/' + self.hashed, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        not_modified = self.middleware(request)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['Vary'], 'Accept-Encoding')
+        self.assertEqual(not_modified['Cache-Control'], StaticFilesMiddleware.IMMUTABLE)
+
+
+class TemplateCachingTest(TestCase):
+    """The sidebar fragments are shared per visitor kind, and production templates use the cached loader."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user('patron', password='patron-password')
+        cls.staff = User.objects.create_user('staff', password='staff-password', is_staff=True)
+        cls.librarian = User.objects.create_user('librarian', password='librarian-password', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sidebar_key_depends_on_auth_state_and_permissions(self):
+        keys = {sidebar_key(user) for user in (AnonymousUser(), self.patron, self.staff, self.librarian)}
+        self.assertEqual(len(keys), 4)
+        other = User.objects.create_user('other', is_staff=True)
+        self.assertEqual(sidebar_key(other), sidebar_key(User.objects.get(pk=self.staff.pk)))
+
+    def test_cached_sidebar_follows_permissions(self):
+        self.client.force_login(self.librarian)
+        self.assertContains(self.client.get(reverse('index')), reverse('overdue-loans'))
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Staff')
+        self.assertNotContains(response, reverse('overdue-loans'))
+        self.assertContains(response, 'User: staff')
+
+    def _templates(self, loaders):
+        return [{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'OPTIONS': {'loaders': loaders},
+        }]
+
+    def test_deploy_check_wants_cached_loader(self):
+        loaders = ['django.template.loaders.app_directories.Loader']
+        with override_settings(DEBUG=False, TEMPLATES=self._templates(loaders)):
+            self.assertEqual([e.id for e in check_cached_template_loader(None)], ['catalog.W001'])
+        cached = [('django.template.loaders.cached.Loader', loaders)]
+        with override_settings(DEBUG=False, TEMPLATES=self._templates(cached)):
+            self.assertEqual(check_cached_template_loader(None), [])
+
+
+@override_settings(CATALOG_PAGE_CACHE_TIMEOUT=0)
+class FacetTest(TransactionTestCase):
+    # TransactionTestCase so the on_commit version bumps actually run
+
+    def setUp(self):
+        cache.clear()
+        self.le_guin = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        self.tolkien = Author.objects.create(first_name='J.R.R.', last_name='Tolkien')
+        self.fantasy = Genre.objects.create(name='Fantasy')
+        self.poetry = Genre.objects.create(name='Poetry')
+        self.books = []
+        for i, (author, genres) in enumerate([(self.le_guin, [self.fantasy]), (self.le_guin, [self.poetry]),
+                                              (self.tolkien, [self.fantasy, self.poetry])]):
+            book = Book.objects.create(title=f'Book {i}', summary='Summary', isbn=f'{i:013d}', author=author)
+            book.genre.set(genres)
+            self.books.append(book)
+        BookInstance.objects.create(book=self.books[0], imprint='Imprint', status='a')
+
+    def test_filters_and_counts(self):
+        response = self.client.get(reverse('books'), {'genre': self.fantasy.pk, 'available': '1'})
+        self.assertEqual([book.pk for book in response.context['book_list']], [self.books[0].pk])
+        # the genre facet ignores the genre filter, the others apply it
+        self.assertEqual([(g['name'], g['count']) for g in response.context['genre_facet']],
+                         [('Fantasy', 1)])
+        self.assertEqual({a['name']: a['count'] for a in response.context['author_facet']},
+                         {'Le Guin, Ursula': 1})
+        self.assertEqual(response.context['availability_facet']['available'], 1)
+        self.assertEqual(response.context['availability_facet']['unavailable'], 1)
+
+    def test_cached_until_a_change(self):
+        facets.get_facets({'author': self.le_guin.pk})
+        with self.assertNumQueries(0):
+            counts = facets.get_facets({'author': self.le_guin.pk})
+        self.assertEqual(counts['available'], {'available': 1, 'unavailable': 1})
+
+        BookInstance.objects.create(book=self.books[1], imprint='Imprint', status='a')
+        # the copy bumps the availability facet only
+        with self.assertNumQueries(1):
+            counts = facets.get_facets({'author': self.le_guin.pk})
+        self.assertEqual(counts['available'], {'available': 2, 'unavailable': 0})
+
+    def test_genre_pages(self):
+        response = self.client.get(reverse('genres'))
+        self.assertEqual([(g.name, g.num_books) for g in response.context['genre_list']],
+                         [('Fantasy', 2), ('Poetry', 2)])
+        response = self.client.get(self.fantasy.get_absolute_url())
+        self.assertContains(response, 'Book 2')
+        self.assertNotContains(response, 'Book 1')
+
+
+class IsbnTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poetry = Genre.objects.create(name='Poetry')
+        cls.book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0-306-40615-2', author=cls.author)
+        cls.book.genre.add(cls.fantasy)
+
+    def test_normalize(self):
+        self.assertEqual(normalize_isbn('0-306-40615-2'), '9780306406157')
+        self.assertEqual(normalize_isbn('978 0 306 40615 7'), '9780306406157')
+        self.assertEqual(normalize_isbn('080442957x'), '9780804429573')
+        for invalid in ('0306406153', '9780306406158', '0000000000000', 'abc', ''):
+            self.assertIsNone(isbn13_or_none(invalid))
+        self.assertEqual(self.book.isbn13, '9780306406157')
+
+    def test_lookup_redirects_to_the_book(self):
+        for isbn in ('0306406152', '978-0-306-40615-7'):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('book-by-isbn', args=[isbn]))
+            self.assertRedirects(response, self.book.get_absolute_url(), fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('book-by-isbn', args=['9780306406158'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('book-by-isbn', args=['9780804429573'])).status_code, 404)
+
+    def test_duplicate_isbn_is_a_validation_error(self):
+        duplicate = Book(title='Earthsea again', summary='Summary', isbn='9780306406157', author=self.author)
+        with self.assertRaises(ValidationError):
+            duplicate.full_clean()
+
+    def test_dedupe_merges_duplicates(self):
+        # bulk_create() skips save(), as imports and old rows did: the duplicates have no isbn13
+        Book.objects.bulk_create([
+            Book(title='Earthsea (2nd)', summary='Summary', isbn='9780306406157', author=self.author),
+            Book(title='Earthsea (3rd)', summary='Summary', isbn='978-0306406157', author=self.author),
+            Book(title='Other', summary='Summary', isbn='080442957X', author=self.author),
+        ])
+        duplicates = list(Book.objects.filter(title__startswith='Earthsea (').order_by('pk'))
+        duplicates[0].genre.add(self.poetry)
+        for duplicate in duplicates:
+            BookInstance.objects.create(book=duplicate, imprint='Imprint', status='a')
+        patron = User.objects.create_user('patron')
+        Hold.objects.create(book=self.book, patron=patron)
+        Hold.objects.create(book=duplicates[1], patron=patron)
+
+        out = io.StringIO()
+        call_command('dedupe_books', batch_size=2, stdout=out)
+        self.assertIn('Merged 2 duplicate books', out.getvalue())
+
+        self.assertFalse(Book.objects.filter(pk__in=[d.pk for d in duplicates]).exists())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_total, self.book.copies_available), (2, 2))
+        self.assertEqual(set(self.book.genre.all()), {self.fantasy, self.poetry})
+        self.assertEqual(Hold.objects.filter(book=self.book, status__in=Hold.ACTIVE).count(), 1)
+        self.assertEqual(Book.objects.get(title='Other').isbn13, '9780804429573')
+
+
+class CirculationEventTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Tehanu', summary='Summary', isbn='0000000000000')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+        cls.ged = User.objects.create_user(username='ged')
+        cls.librarian = User.objects.create_user(username='librarian', password='secret', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def events(self):
+        return list(CirculationEvent.objects.order_by('pk').values_list('kind', 'borrower_id'))
+
+    def test_services_and_saves_log_events(self):
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        circulation.checkout(self.book.pk, self.ged)
+        self.assertTrue(circulation.renew(self.copy.pk, due_back))
+        circulation.bulk_renew([self.copy.pk], due_back + datetime.timedelta(days=1))
+        self.assertTrue(circulation.return_copy(self.copy.pk))
+        self.assertFalse(circulation.renew(self.copy.pk, due_back))
+
+        # 直接 save() (admin) 的借還也要記錄
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        copy.status, copy.borrower, copy.due_back = 'o', self.ged, due_back
+        copy.save()
+        copy.imprint = 'Second imprint'
+        copy.save()
+        circulation.bulk_return([self.copy.pk])
+
+        c, n, r = CirculationEvent.CHECKOUT, CirculationEvent.RENEWAL, CirculationEvent.RETURN
+        ged = self.ged.pk
+        self.assertEqual(self.events(), [(c, ged), (n, ged), (n, ged), (r, ged), (c, ged), (r, ged)])
+
+    def test_rollup_is_incremental(self):
+        circulation.checkout(self.book.pk, self.ged)
+        circulation.return_copy(self.copy.pk)
+        self.assertEqual(rollups.rollup_circulation(settle=0, batch_size=1), 2)
+        self.assertEqual(rollups.rollup_circulation(settle=0), 0)
+
+        circulation.checkout(self.book.pk, self.ged)
+        # 還沒超過 settle 秒的事件留給下一次
+        self.assertEqual(rollups.rollup_circulation(settle=3600), 0)
+        # 報表說明計入到哪個時間點：是 cutoff，不是執行的時間
+        report = rollups.circulation_report()
+        self.assertLess(report['complete_until'], timezone.now() - datetime.timedelta(seconds=3500))
+        call_command('rollup_circulation', settle=0, stdout=io.StringIO())
+
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        self.assertEqual(list(DailyBookCirculation.objects.values_list('day', 'book_id', 'checkouts', 'returns')),
+                         [(today, self.book.pk, 2, 1)])
+        self.assertEqual(list(DailyCirculation.objects.values_list('day', 'checkouts', 'renewals', 'returns')),
+                         [(today, 2, 0, 1)])
+
+    def test_copies_without_a_book(self):
+        circulation.checkout(self.book.pk, self.ged)
+        other = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        # save() of a copy on loan whose book is cleared
+        copy = BookInstance.objects.get(pk=other.pk)
+        copy.status, copy.borrower, copy.book = 'o', self.ged, None
+        copy.save()
+        # 書被刪除 (副本的 book 設為 NULL) 之後的批次歸還與續借
+        Book.objects.filter(pk=self.book.pk).delete()
+        self.assertEqual(circulation.bulk_renew([self.copy.pk], datetime.date.today()),
+                         {self.copy.pk: circulation.RENEWED})
+        self.assertEqual(circulation.bulk_return([self.copy.pk, other.pk]),
+                         {self.copy.pk: circulation.RETURNED, other.pk: circulation.RETURNED})
+
+        self.assertEqual(CirculationEvent.objects.filter(book__isnull=True).count(), 4)
+        self.assertEqual(rollups.rollup_circulation(settle=0), 5)
+        # 沒有書的事件只計入每日總數
+        self.assertEqual(list(DailyBookCirculation.objects.values_list('book_id', 'checkouts', 'returns')),
+                         [(self.book.pk, 1, 0)])
+        self.assertEqual(list(DailyCirculation.objects.values_list('checkouts', 'renewals', 'returns')),
+                         [(2, 1, 2)])
+
+    def test_report_reads_rollups(self):
+        circulation.checkout(self.book.pk, self.ged)
+        rollups.rollup_circulation(settle=0)
+        self.client.login(username='librarian', password='secret')
+        # 報表只讀彙總表 (加上書名)，與借閱紀錄的大小無關
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('circulation-report'), {'days': '7'})
+        self.assertEqual(len(response.context['daily']), 7)
+        self.assertEqual(response.context['totals']['checkouts'], 1)
+        self.assertEqual(response.context['top_books'][0]['book'].title, 'Tehanu')
+
+
+class BookInstanceSaveTest(TransactionTestCase):
+    # TransactionTestCase: save() runs in autocommit mode, as in the admin and the renew views
+
+    def test_save_outside_atomic(self):
+        book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        ged = User.objects.create_user(username='ged')
+        # 模擬 PostgreSQL / MySQL：交易外的 select_for_update 會出錯 (SQLite 不支援 FOR UPDATE 語法，所以不輸出)
+        with mock.patch.object(connection.features, 'has_select_for_update', True), \
+                mock.patch.object(connection.ops, 'for_update_sql', return_value=''):
+            self.assertTrue(connection.get_autocommit())
+            copy = BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+            copy.status, copy.borrower, copy.due_back = 'o', ged, datetime.date.today()
+            copy.save()
+            BookInstance.objects.create(book=book, imprint='Imprint', status='m').delete()
+
+        book.refresh_from_db()
+        self.assertEqual((book.copies_total, book.copies_available, book.copies_on_loan, book.copies_maintenance),
+                         (1, 0, 1, 0))
+        self.assertEqual(list(CirculationEvent.objects.values_list('kind', 'book_instance_id', 'borrower_id')),
+                         [(CirculationEvent.CHECKOUT, copy.pk, ged.pk)])
+
+
+class ImportCatalogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+
+    def import_file(self, suffix, content, **options):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        call_command('import_catalog', f.name, stdout=io.StringIO(), **options)
+
+    def test_csv(self):
+        self.import_file('.csv', (
+            'title,summary,isbn,author_first_name,author_last_name,genres,copies,imprint,status\n'
+            'A Wizard of Earthsea,Wizards,0-553-38304-3,Ursula,Le Guin,Fantasy;Young adult,3,Parnassus,a\n'
+            'The Dispossessed,Anarchists,,Ursula,Le Guin,Science fiction,2,Harper,o\n'))
+
+        # 已經存在的作者與類別沿用，不會重複建立
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(sorted(Genre.objects.values_list('name', flat=True)),
+                         ['Fantasy', 'Science fiction', 'Young adult'])
+        earthsea = Book.objects.get(title='A Wizard of Earthsea')
+        self.assertEqual(earthsea.author, self.author)
+        self.assertEqual(earthsea.isbn13, '9780553383041')
+        self.assertEqual(sorted(earthsea.genre.values_list('name', flat=True)), ['Fantasy', 'Young adult'])
+        self.assertEqual(Book.genre.through.objects.count(), 3)
+
+        counters = ('copies_total', 'copies_available', 'copies_on_loan', 'copies_maintenance', 'copies_reserved')
+        self.assertEqual(list(Book.objects.order_by('title').values_list(*counters)),
+                         [(3, 3, 0, 0, 0), (2, 0, 2, 0, 0)])
+        # 計數器要與副本一致
+        self.assertEqual(recount_availability(Book.objects.all()), 0)
+        self.assertEqual(search.search_book_ids('young adult'), [earthsea.pk])
+        self.assertEqual(len(search.search_book_ids('guin')), 2)
+
+    def test_jsonl(self):
+        self.import_file('.jsonl', '\n'.join(json.dumps(record) for record in [
+            {'title': 'Tehanu', 'author_first_name': 'Ursula', 'author_last_name': 'Le Guin',
+             'genres': ['Fantasy'], 'copies': 1, 'status': 'm'},
+            {'title': 'Kindred', 'author_first_name': 'Octavia', 'author_last_name': 'Butler', 'genres': []},
+        ]) + '\n', batch_size=1)
+
+        tehanu, kindred = Book.objects.get(title='Tehanu'), Book.objects.get(title='Kindred')
+        self.assertEqual(tehanu.author, self.author)
+        self.assertEqual(list(tehanu.genre.all()), [self.fantasy])
+        self.assertEqual((tehanu.copies_total, tehanu.copies_maintenance), (1, 1))
+        self.assertEqual(str(kindred.author), 'Butler, Octavia')
+        self.assertEqual(kindred.copies_total, 0)
+        self.assertEqual(search.search_book_ids('octavia'), [kindred.pk])
+
+    def test_bad_records(self):
+        header = 'title,copies,status\n'
+        for row, message in [
+            (',1,a', 'Record 2: title is required.'),
+            ('Earthsea,many,a', 'Record 2: copies must be a number.'),
+            ('Earthsea,-1,a', 'Record 2: copies cannot be negative.'),
+            ('Earthsea,1,x', "Record 2: unknown status 'x'."),
+        ]:
+            with self.subTest(row=row), self.assertRaisesMessage(CommandError, message):
+                self.import_file('.csv', header + 'Tehanu,1,a\n' + row + '\n', batch_size=1)
+        with self.assertRaisesMessage(CommandError, '--batch-size must be at least 1.'):
+            self.import_file('.csv', header, batch_size=0)
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.wizard = Book.objects.create(title='A Wizard of Earthsea', summary='A boy goes to school.',
+                                         isbn='0000000000000', author=cls.author)
+        cls.tombs = Book.objects.create(title='The Tombs of Atuan', summary='A young wizard escapes the tombs.',
+                                        isbn='0000000000000', author=cls.author)
+        cls.kindred = Book.objects.create(title='Kindred', summary='Time travel "and" slavery.', isbn='0000000000000')
+        cls.wizard.genre.add(cls.genre)
+
+    def test_ranked_match(self):
+        # 書名的權重比摘要高
+        self.assertEqual(search.search_book_ids('wizard'), [self.wizard.pk, self.tombs.pk])
+        self.assertEqual(search.search_book_ids('wizard tombs'), [self.tombs.pk])
+        self.assertEqual(search.search_book_ids('wizard', limit=1, offset=1), [self.tombs.pk])
+        self.assertEqual(search.search_book_ids(''), [])
+
+    def test_prefix_on_last_word(self):
+        self.assertEqual(search.search_book_ids('earth'), [self.wizard.pk])
+        self.assertEqual(search.search_book_ids('wizard earth'), [self.wizard.pk])
+        # 只有最後一個字做前綴比對
+        self.assertEqual(search.search_book_ids('earth wizard'), [])
+
+    def test_operators_are_quoted(self):
+        self.assertEqual(search.build_match_query('time "AND" NEAR(travel) -slavery*'),
+                         '"time" "AND" "NEAR" "travel" "slavery"*')
+        for text in ['"', 'time AND', 'NOT travel', 'kindred OR', '(time', 'title:kindred', '^time', 'travel*"']:
+            with self.subTest(text=text):
+                search.search_book_ids(text)
+        self.assertEqual(search.search_book_ids('kindred OR'), [])
+        self.assertEqual(search.search_book_ids('"and" slavery'), [self.kindred.pk])
+
+    def test_reindex_on_related_changes(self):
+        self.author.first_name = 'Ursula K.'
+        self.author.last_name = 'LeGuin'
+        self.author.save()
+        self.assertCountEqual(search.search_book_ids('leguin'), [self.wizard.pk, self.tombs.pk])
+
+        self.genre.name = 'Speculative'
+        self.genre.save()
+        self.assertEqual(search.search_book_ids('speculative'), [self.wizard.pk])
+        self.genre.book_set.add(self.kindred)
+        self.assertCountEqual(search.search_book_ids('speculative'), [self.wizard.pk, self.kindred.pk])
+
+        self.author.delete()
+        self.assertEqual(search.search_book_ids('leguin'), [])
+        self.assertEqual(search.search_book_ids('tombs'), [self.tombs.pk])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('book-search'), {'q': 'wizard'})
+        self.assertEqual([book.pk for book in response.context['results']], [self.wizard.pk, self.tombs.pk])
+        self.assertFalse(response.context['has_next'])
+        response = self.client.get(reverse('book-search'), {'q': '"NEAR("', 'page': 'x'})
+        self.assertEqual((response.status_code, response.context['page']), (200, 1))
+        self.assertContains(response, 'No books match')
+
+    def test_search_view_page_out_of_range(self):
+        response = self.client.get(reverse('book-search'), {'q': 'wizard', 'page': 2})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('book-search'), {'q': 'wizard', 'page': 10 ** 18})
+        self.assertEqual(response.status_code, 404)
+
+
+class BulkRenewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        cls.ged = User.objects.create_user(username='ged')
+        due_back = datetime.date.today() + datetime.timedelta(days=3)
+        cls.loans = [BookInstance.objects.create(book=cls.book, imprint='Imprint', status='o', borrower=cls.ged,
+                                                 due_back=due_back) for _ in range(2)]
+        cls.shelved = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+        cls.librarian = User.objects.create_user(username='librarian', password='secret', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        User.objects.create_user(username='patron', password='secret')
+        User.objects.create_superuser(username='admin', password='secret', email='admin@example.com')
+
+    def setUp(self):
+        CirculationEvent.objects.all().delete()
+
+    def post(self, **data):
+        return self.client.post(reverse('renew-books-bulk'), data)
+
+    def test_permission_required(self):
+        data = {'action': 'return', 'copies': [self.loans[0].pk]}
+        response = self.post(**data)
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('renew-books-bulk')}")
+        self.client.login(username='patron', password='secret')
+        self.assertEqual(self.post(**data).status_code, 302)
+        self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).status, 'o')
+
+    def test_renew(self):
+        self.client.login(username='librarian', password='secret')
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+        missing = uuid.uuid4()
+        response = self.post(action='renew', renewal_date=renewal_date.isoformat(),
+                             copies=[self.loans[0].pk, self.shelved.pk, missing])
+        self.assertEqual(response.context['summary'], [('not found', 1), ('not on loan', 1), ('renewed', 1)])
+        self.assertContains(response, f'{missing}: not found')
+        self.assertContains(response, 'Earthsea: not on loan')
+        self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).due_back, renewal_date)
+        self.assertEqual(BookInstance.objects.get(pk=self.loans[1].pk).due_back, self.loans[1].due_back)
+        self.assertEqual(list(CirculationEvent.objects.values_list('kind', 'due_back')),
+                         [(CirculationEvent.RENEWAL, renewal_date)])
+
+    def test_invalid_renewal_date(self):
+        self.client.login(username='librarian', password='secret')
+        for renewal_date in ['', (datetime.date.today() + datetime.timedelta(weeks=5)).isoformat()]:
+            with self.subTest(renewal_date=renewal_date):
+                response = self.post(action='renew', renewal_date=renewal_date, copies=[self.loans[0].pk])
+                self.assertTrue(response.context['form'].errors['renewal_date'])
+        self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).due_back, self.loans[0].due_back)
+        self.assertFalse(CirculationEvent.objects.exists())
+
+    def test_return(self):
+        self.client.login(username='librarian', password='secret')
+        response = self.post(action='return', copies=[copy.pk for copy in self.loans] + [self.shelved.pk])
+        self.assertEqual(response.context['summary'], [('not on loan', 1), ('returned', 2)])
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_available, self.book.copies_on_loan), (3, 0))
+        self.assertEqual(CirculationEvent.objects.filter(kind=CirculationEvent.RETURN, borrower=self.ged).count(), 2)
+
+    def test_admin_actions(self):
+        self.client.login(username='admin', password='secret')
+        url = reverse('admin:catalog_bookinstance_changelist')
+        selected = [self.loans[0].pk, self.shelved.pk]
+        response = self.client.post(url, {'action': 'renew_three_weeks', '_selected_action': selected}, follow=True)
+        self.assertContains(response, 'Copies: 1 not on loan, 1 renewed.')
+        self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).due_back,
+                         datetime.date.today() + datetime.timedelta(weeks=3))
+
+        response = self.client.post(url, {'action': 'mark_returned', '_selected_action': selected}, follow=True)
+        self.assertContains(response, 'Copies: 1 not on loan, 1 returned.')
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_available, self.book.copies_on_loan), (2, 1))
+        self.assertEqual(list(CirculationEvent.objects.order_by('pk').values_list('kind', 'book_instance_id')),
+                         [(CirculationEvent.RENEWAL, self.loans[0].pk), (CirculationEvent.RETURN, self.loans[0].pk)])
+
+
+class ExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.book = Book.objects.create(title='Earthsea, Book 1', summary='Summary', isbn='9780553383041', author=author)
+        cls.book.genre.add(Genre.objects.create(name='Young adult'), Genre.objects.create(name='Fantasy'))
+        cls.ged = User.objects.create_user(username='ged')
+        cls.loan = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='o', borrower=cls.ged,
+                                               due_back=datetime.date(2020, 1, 2))
+        BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+        cls.librarian = User.objects.create_user(username='librarian', password='secret', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def get(self, kind, fmt):
+        response = self.client.get(reverse('export-catalog', args=[kind, fmt]))
+        return response, b''.join(response.streaming_content).decode() if response.status_code == 200 else ''
+
+    def test_requires_permission(self):
+        url = reverse('export-catalog', args=['books', 'csv'])
+        self.assertRedirects(self.client.get(url), f"{reverse('login')}?next={url}")
+
+    def test_csv(self):
+        self.client.login(username='librarian', password='secret')
+        response, body = self.get('books', 'csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.csv"')
+        self.assertEqual(body.splitlines(), [
+            'id,title,isbn,author_first_name,author_last_name,genres',
+            f'{self.book.pk},"Earthsea, Book 1",9780553383041,Ursula,Le Guin,Fantasy;Young adult',
+        ])
+        _, body = self.get('copies', 'csv')
+        self.assertEqual(len(body.splitlines()), 3)
+
+    def test_jsonl(self):
+        self.client.login(username='librarian', password='secret')
+        response, body = self.get('loans', 'jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in body.splitlines()], [{
+            'id': str(self.loan.pk), 'book_id': self.book.pk, 'book_title': 'Earthsea, Book 1',
+            'borrower_id': self.ged.pk, 'borrower': 'ged', 'due_back': '2020-01-02'}])
+
+    def test_unknown_export(self):
+        self.client.login(username='librarian', password='secret')
+        self.assertEqual(self.get('patrons', 'csv')[0].status_code, 404)
+        self.assertEqual(self.get('books', 'xml')[0].status_code, 404)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_catalog', 'books', format='jsonl', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['genres'], 'Fantasy;Young adult')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'copies.csv')
+            call_command('export_catalog', 'copies', output=path, chunk_size=1)
+            with open(path, encoding='utf-8') as f:
+                rows = f.read().splitlines()
+        self.assertEqual(rows[0], 'id,book_id,book_title,imprint,status,due_back,borrower')
+        self.assertEqual(len(rows), 3)
+
+
+class CatalogStatsTest(TransactionTestCase):
+    # TransactionTestCase: the counters are adjusted in on_commit callbacks
+
+    def setUp(self):
+        cache.clear()
+
+    def cached_stats(self):
+        return {name: cache.get(f'catalog:stats:{name}') for name in STAT_NAMES}
+
+    def test_counters_follow_commits(self):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000', author=author)
+        self.assertEqual(get_catalog_stats(), compute_catalog_stats())
+
+        # 之後的變更用 cache.incr() 調整，不重新計算
+        with self.assertNumQueries(0):
+            get_catalog_stats()
+        second = Book.objects.create(title='Tehanu', summary='Summary', isbn='0000000000000')
+        copy = BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=second, imprint='Imprint', status='m')
+        Author.objects.create(first_name='Octavia', last_name='Butler')
+        self.assertEqual(self.cached_stats(), compute_catalog_stats())
+
+        copy.status = 'm'
+        copy.save()
+        self.assertEqual(self.cached_stats(), compute_catalog_stats())
+        second.delete()
+        author.delete()
+        self.assertEqual(get_catalog_stats(), compute_catalog_stats())
+        # 刪除書時副本保留 (book 設為 NULL)
+        self.assertEqual(compute_catalog_stats(),
+                         {'num_books': 1, 'num_instances': 2, 'num_instances_available': 0, 'num_authors': 1})
+
+    def test_rolled_back_changes_are_not_counted(self):
+        get_catalog_stats()
+        try:
+            with transaction.atomic():
+                Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+                raise DatabaseError('rollback')
+        except DatabaseError:
+            pass
+        self.assertEqual(self.cached_stats()['num_books'], 0)
+
+    def test_warm_empty_cache(self):
+        Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+        cache.clear()
+        out = io.StringIO()
+        call_command('warm_catalog_stats', stdout=out)
+        self.assertIn('num_books: 1', out.getvalue())
+        self.assertEqual(self.cached_stats(),
+                         {'num_books': 1, 'num_instances': 0, 'num_instances_available': 0, 'num_authors': 0})
+
+
+class AvailabilityCounterTest(TestCase):
+
+    def setUp(self):
+        self.book = Book.objects.create(title='Earthsea', summary='Summary', isbn='0000000000000')
+
+    def counters(self):
+        return Book.objects.filter(pk=self.book.pk).values_list(*Book.COUNTER_FIELDS).get()
+
+    def test_book_edit_keeps_counters(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        # 過時的 Book 物件 (admin、編輯表單) 儲存時不能把計數器寫回 0
+        stale.title = 'A Wizard of Earthsea'
+        stale.save()
+        self.assertEqual(self.counters(), (1, 1, 0, 0, 0))
+        Book.objects.get(pk=self.book.pk).save(update_fields=['isbn', 'copies_total'])
+        self.assertEqual(self.counters(), (1, 1, 0, 0, 0))
+
+        copy.status = 'm'
+        copy.save()
+        self.assertEqual(self.counters(), (1, 0, 0, 1, 0))
+        self.assertEqual(Book.objects.get(pk=self.book.pk).title, 'A Wizard of Earthsea')
+
+    def test_book_admin_edit_keeps_counters(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='o')
+        User.objects.create_superuser(username='admin', password='secret', email='admin@example.com')
+        self.client.login(username='admin', password='secret')
+        genre = Genre.objects.create(name='Fantasy')
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        response = self.client.post(reverse('admin:catalog_book_change', args=[self.book.pk]), {
+            'title': 'Tehanu', 'summary': 'Summary', 'isbn': '9780553383041', 'author': author.pk, 'genre': [genre.pk],
+            'bookinstance_set-TOTAL_FORMS': '1', 'bookinstance_set-INITIAL_FORMS': '1',
+            'bookinstance_set-0-id': copy.pk, 'bookinstance_set-0-book': self.book.pk,
+            'bookinstance_set-0-imprint': 'Imprint', 'bookinstance_set-0-status': 'o'})
+        self.assertRedirects(response, reverse('admin:catalog_book_changelist'))
+        self.assertEqual(self.counters(), (1, 0, 1, 0, 0))
+
+    def test_recount_command(self):
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='r')
+        other = Book.objects.create(title='Tehanu', summary='Summary', isbn='0000000000000')
+        Book.objects.filter(pk=self.book.pk).update(copies_total=7, copies_available=0)
+        out = io.StringIO()
+        call_command('recount_availability', batch_size=1, stdout=out)
+        self.assertIn('Repaired the availability counters of 1 books.', out.getvalue())
+        self.assertEqual(self.counters(), (2, 1, 0, 0, 1))
+        self.assertEqual(Book.objects.filter(pk=other.pk).values_list(*Book.COUNTER_FIELDS).get(), (0, 0, 0, 0, 0))
+        call_command('recount_availability', stdout=out)
+        self.assertIn('Repaired the availability counters of 0 books.', out.getvalue())
+
@@ -1,11 +1,15 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('books/', views.BookListView.as_view(), name='books'),
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
+    path('search/', views.book_search, name='book-search'),
+    path('isbn/<str:isbn>', views.book_by_isbn, name='book-by-isbn'),
+    path('genres/', views.GenreListView.as_view(), name='genres'),
+    path('genre/<int:pk>', views.GenreDetailView.as_view(), name='genre-detail'),
     # This method is used just like path() except that it allows you to specify a pattern using a Regular expression.
     # For example, the previous path could have been written as shown below:
     # re_path(r'^book/(?P<pk>\d+)$', views.BookDetailView.as_view(), name='book-detail'),
@@ -14,6 +18,13 @@ urlpatterns = [
 urlpatterns += [
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
     path(r'borrowed/', views.LoanedBooksAllListView.as_view(), name='all-borrowed'),  # Added for challenge
+    path('overdue/', views.OverdueLoansListView.as_view(), name='overdue-loans'),
+]
+
+#圖書館管理人員限定的 匯出功能
+#網址格式：/catalog/export/<books|copies|loans>.<csv|jsonl>
+urlpatterns += [
+    path('export/<slug:kind>.<slug:fmt>', views.export_catalog, name='export-catalog'),
 ]
 
 #圖書館管理人員限定的 更新讀者書本到期日的功能
@@ -30,6 +41,12 @@ urlpatterns += [
     path('book/<uuid:pk>/renew_bymodelform/', views.renew_book_librarian_modelform, name='renew-book-librarian-modelform'),
 ]
 
+#圖書館管理人員限定的 一次續借 / 歸還多本書
+#網址格式：/catalog/borrowed/bulk/ (只接受 POST，表單在 All borrowed 頁面)
+urlpatterns += [
+    path('borrowed/bulk/', views.renew_books_bulk, name='renew-books-bulk'),
+]
+
 
 
 #modelform實做範例
@@ -48,3 +65,25 @@ urlpatterns += [
 
 
 
+#staff 限定的 request 統計 (Prometheus 格式)，資料來自 catalog.middleware.RequestMetricsMiddleware
+#網址格式：/catalog/_metrics
+urlpatterns += [
+    path('_metrics', views.request_metrics, name='request-metrics'),
+]
+
+#唯讀的 JSON API (見 catalog/api.py)，給 kiosk 與手機 app 使用
+#支援 ?fields=、?after=&limit= 分頁，以及 ETag / Last-Modified 的 304 Not Modified
+urlpatterns += [
+    path('api/books/', api.book_list, name='api-books'),
+    path('api/books/<int:pk>/', api.book_detail, name='api-book-detail'),
+    path('api/books/<int:pk>/copies/', api.book_copies, name='api-book-copies'),
+    path('api/authors/', api.author_list, name='api-authors'),
+    path('api/authors/<int:pk>/', api.author_detail, name='api-author-detail'),
+    path('api/genres/', api.genre_list, name='api-genres'),
+]
+
+#圖書館管理人員限定的借閱統計 (每日借出 / 續借 / 歸還與最常借的書)，資料來自 manage.py rollup_circulation
+#網址格式：/catalog/reports/circulation/?days=30
+urlpatterns += [
+    path('reports/circulation/', views.circulation_report, name='circulation-report'),
+]
@@ -1,46 +1,116 @@
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.http import Http404, HttpResponseRedirect, QueryDict, StreamingHttpResponse
+from django.shortcuts import redirect, render
 from .models import Book, Author, BookInstance, Genre
 from django.views import generic
 from django.shortcuts import get_object_or_404
+from django.core.paginator import Paginator
+from django.db.models import Count, Prefetch
+from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required       # Part 8
 from django.contrib.auth.mixins import LoginRequiredMixin       # Part 8
 from django.contrib.auth.decorators import permission_required  # Part 9
 import datetime
+from . import caching, circulation, facets, rollups
+from .availability import STATUS_FIELDS
+from .caching import cache_anonymous_page
+from .db import read_replica
+from .exports import EXPORTS, FORMATS as EXPORT_FORMATS, export_lines
 from .forms import RenewBookForm
+from .isbn import normalize_isbn
+from .pagination import CursorPaginationMixin
+from .search import search_book_ids
+from .stats import get_catalog_stats
+
+# 搜尋結果最多翻到第幾頁
+SEARCH_MAX_PAGE = 500
+
 # Create your views here.
 
 def index(request):
     """View function for home page of site."""
 
-    # Generate counts of some of the main objects
-    num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
-
-    # Available books (status = 'a')
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
+    # Counts of the main objects, served from the cache (one aggregate query on a miss).
+    stats = get_catalog_stats()
 
-    # The 'all()' is implied by default.
-    num_authors = Author.objects.count()
-
-    # Number of visits to this view, as counted in the session variable.
-    num_visits = request.session.get('num_visits', 0)
-    request.session['num_visits'] = num_visits + 1
+    # Number of visits to this view, as counted in a signed cookie.
+    # 以前存在 session 裡，每次請求都會寫一次 session 資料庫；改用 cookie 就不需要碰資料庫
+    try:
+        num_visits = int(request.get_signed_cookie('num_visits', default=0, salt='catalog.index'))
+    except ValueError:
+        num_visits = 0
 
     context = {
-        'num_books': num_books,
-        'num_instances': num_instances,
-        'num_instances_available': num_instances_available,
-        'num_authors': num_authors,
+        'num_books': stats['num_books'],
+        'num_instances': stats['num_instances'],
+        'num_instances_available': stats['num_instances_available'],
+        'num_authors': stats['num_authors'],
         'num_visits': num_visits,
     }
 
     # Render the HTML template index.html with the data in the context variable
-    return render(request, 'index.html', context=context)
-
-class BookListView(generic.ListView):
+    response = render(request, 'index.html', context=context)
+    response.set_signed_cookie('num_visits', num_visits + 1, salt='catalog.index',
+                               max_age=60 * 60 * 24 * 365, httponly=True, samesite='Lax')
+    return response
+
+# 匿名訪客看到的書單與書籍詳情頁都一樣，整頁快取起來 (見 catalog/caching.py)
+# 唯讀頁面的查詢可以交給 read replica (見 catalog/db.py)
+# ?genre=<id>&author=<id>&available=1 篩選書單，旁邊列出各類別 / 作者 / 是否可借的書數 (見 catalog/facets.py)
+@method_decorator(read_replica, name='dispatch')
+@method_decorator(
+    cache_anonymous_page(caching.BOOK, caching.AUTHOR, caching.GENRE, caching.BOOKINSTANCE), name='dispatch')
+class BookListView(CursorPaginationMixin, generic.ListView):
     model = Book
     paginate_by = 3
+
+    def get_queryset(self):
+        self.filters = facets.parse_filters(self.request.GET)
+        # book_list.html 每一列都會印出 {{ book.author }}，用 select_related 一次 JOIN 作者，避免每列多一個查詢 (N+1)
+        # only() 則只取模板用得到的欄位
+        return facets.filter_books(Book.objects.select_related('author').only(
+            'id', 'title', 'copies_available', 'copies_total', 'author__first_name', 'author__last_name'),
+            self.filters)
+
+    def _querystring(self, **changes):
+        """The current filters with `changes` applied (None removes one), without the cursor."""
+        params = QueryDict(mutable=True)
+        for name, value in {**self.filters, **changes}.items():
+            if value is True:
+                params[name] = '1'
+            elif value is not None:
+                params[name] = str(value)
+        return params.urlencode()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        counts = facets.get_facets(self.filters)
+        selected_genre, selected_author = self.filters.get('genre'), self.filters.get('author')
+        context['genre_facet'] = [
+            {'name': name, 'count': count, 'selected': pk == selected_genre,
+             'querystring': self._querystring(genre=None if pk == selected_genre else pk)}
+            for pk, name, count in counts['genre']]
+        context['author_facet'] = [
+            {'name': f'{last_name}, {first_name}', 'count': count, 'selected': pk == selected_author,
+             'querystring': self._querystring(author=None if pk == selected_author else pk)}
+            for pk, first_name, last_name, count in counts['author']]
+        # 選取的類別 / 作者不在前幾名裡的話，仍然列在最前面，才能取消選取
+        if selected_genre and not any(item['selected'] for item in context['genre_facet']):
+            for name in Genre.objects.filter(pk=selected_genre).values_list('name', flat=True):
+                context['genre_facet'].insert(0, {'name': name, 'count': None, 'selected': True,
+                                                  'querystring': self._querystring(genre=None)})
+        if selected_author and not any(item['selected'] for item in context['author_facet']):
+            for first_name, last_name in Author.objects.filter(pk=selected_author).values_list(
+                    'first_name', 'last_name'):
+                context['author_facet'].insert(0, {'name': f'{last_name}, {first_name}', 'count': None,
+                                                   'selected': True, 'querystring': self._querystring(author=None)})
+        context['availability_facet'] = {
+            **counts['available'],
+            'selected': bool(self.filters.get('available')),
+            'querystring': self._querystring(available=None if self.filters.get('available') else True),
+        }
+        context['filtered'] = bool(self.filters)
+        return context
+
     # context_object_name = 'my_book_list'  # your own name for the list as a template variable
     # queryset = Book.objects.filter(title__icontains='war')[:5]  # Get 5 books containing the title war
     # template_name = 'books/my_arbitrary_template_name_list.html'  # Specify your own template name/location
@@ -68,8 +138,36 @@ class BookListView(generic.ListView):
     # 然後返回新的（更新後）內文。
 
 
+@method_decorator(read_replica, name='dispatch')
+@method_decorator(
+    cache_anonymous_page(caching.BOOK, caching.AUTHOR, caching.GENRE, caching.BOOKINSTANCE), name='dispatch')
 class BookDetailView(generic.DetailView):
     model = Book
+    # 熱門書可能有上百本副本，每頁只列出這麼多本，其餘用 ?copies_page= 翻頁
+    copies_paginate_by = 20
+
+    def get_queryset(self):
+        # 作者用 JOIN 一起取回，書籍類別用一個 prefetch 查詢取回，不會隨副本或類別數量增加查詢次數
+        return Book.objects.select_related('author').prefetch_related(
+            Prefetch('genre', queryset=Genre.objects.only('id', 'name')))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        book = self.object
+        copies = book.bookinstance_set.all()
+
+        # Per-status counts come from the book's availability counters, no query needed.
+        context['copy_status_counts'] = [
+            (status, label, getattr(book, STATUS_FIELDS[status]))
+            for status, label in BookInstance.LOAN_STATUS if getattr(book, STATUS_FIELDS[status])]
+        context['copy_count'] = book.copies_total
+
+        # Only one page of copy rows is rendered.
+        paginator = Paginator(
+            copies.only('id', 'book', 'imprint', 'due_back', 'status').order_by('due_back', 'id'),
+            self.copies_paginate_by)
+        context['copies_page'] = paginator.get_page(self.request.GET.get('copies_page'))
+        return context
 
     # Just to give you some idea of how this works, the code fragment below demonstrates how you would implement the class-based view as a function, if you were not using the generic class-based detail view.
     # def book_detail_view(request, primary_key):
@@ -83,6 +181,91 @@ class BookDetailView(generic.DetailView):
     #
     #     return render(request, 'catalog/book_detail.html', context={'book': book})
 
+# 書籍類別清單與各類別的頁面，書數用一個 GROUP BY 查詢算出
+@method_decorator(read_replica, name='dispatch')
+@method_decorator(cache_anonymous_page(caching.BOOK, caching.GENRE), name='dispatch')
+class GenreListView(generic.ListView):
+    model = Genre
+
+    def get_queryset(self):
+        return Genre.objects.annotate(num_books=Count('book')).order_by('name')
+
+
+@method_decorator(read_replica, name='dispatch')
+@method_decorator(cache_anonymous_page(caching.BOOK, caching.AUTHOR, caching.GENRE), name='dispatch')
+class GenreDetailView(generic.DetailView):
+    model = Genre
+    # 只列出前幾本，全部的書用書單的 ?genre= 篩選翻頁
+    books_shown = 20
+
+    def get_queryset(self):
+        return Genre.objects.annotate(num_books=Count('book'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['books'] = self.object.book_set.select_related('author').only(
+            'id', 'title', 'author__first_name', 'author__last_name').order_by('title', 'id')[:self.books_shown]
+        context['books_querystring'] = QueryDict(f'genre={self.object.pk}').urlencode()
+        return context
+
+
+# 用 ISBN-10 或 ISBN-13 (可含連字號) 找書，經由 isbn13 的唯一索引，一個查詢
+@read_replica
+def book_by_isbn(request, isbn):
+    """Redirect to the detail page of the book with this ISBN."""
+    try:
+        isbn13 = normalize_isbn(isbn)
+    except ValueError:
+        raise Http404('Not a valid ISBN.')
+    book_id = Book.objects.filter(isbn13=isbn13).values_list('pk', flat=True).first()
+    if book_id is None:
+        raise Http404('No book has this ISBN.')
+    return redirect('book-detail', pk=book_id)
+
+
+# 全文檢索：書名、摘要、作者與類別 (SQLite FTS5，見 catalog/search.py)
+@read_replica
+def book_search(request):
+    """View function for ranked full-text search over the catalog."""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = 20
+    # 頁數要有上限：太大的 OFFSET 超出 SQLite 的 64 位元整數會拋 OverflowError，
+    # 而且排名到這麼後面的結果也沒有人會看
+    if page > SEARCH_MAX_PAGE:
+        raise Http404('Page out of range.')
+
+    # 多取一筆用來判斷有沒有下一頁
+    ids = search_book_ids(query, limit=per_page + 1, offset=(page - 1) * per_page)
+    if page > 1 and not ids:
+        raise Http404('Page out of range.')
+    has_next = len(ids) > per_page and page < SEARCH_MAX_PAGE
+    ids = ids[:per_page]
+    books = Book.objects.select_related('author').only(
+        'id', 'title', 'author__first_name', 'author__last_name').in_bulk(ids)
+
+    context = {
+        'query': query,
+        'results': [books[pk] for pk in ids if pk in books],  # keep the rank order
+        'page': page,
+        'has_previous': page > 1,
+        'has_next': has_next,
+    }
+    return render(request, 'catalog/book_search.html', context=context)
+
+# 匯出書目、副本與借閱資料 (CSV / JSONL)，用 StreamingHttpResponse 邊查邊送
+@permission_required('catalog.can_mark_returned')
+def export_catalog(request, kind, fmt):
+    """Stream a catalog export to staff without loading it into memory."""
+    if kind not in EXPORTS or fmt not in EXPORT_FORMATS:
+        raise Http404('Unknown export.')
+    response = StreamingHttpResponse(export_lines(kind, fmt), content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
 # Part 8: 可以透過裝飾器 @login_required 確保該 view function 需要登入後才能訪問
 # https://docs.djangoproject.com/en/2.0/topics/auth/default/#limiting-access-to-logged-in-users
 @login_required
@@ -102,20 +285,23 @@ class MyViewLoginRequired(LoginRequiredMixin, generic.ListView):
     redirect_field_name = 'redirect_to'
 
 # Part 8
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+class LoanedBooksByUserListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing books on loan to current user."""
     model = BookInstance
     template_name = 'catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        # is_overdue 由資料庫一起算好 (BookInstanceQuerySet.with_overdue)
+        return (BookInstance.objects.filter(borrower=self.request.user).on_loan().with_overdue()
+                .select_related('book')
+                .only('id', 'due_back', 'book__id', 'book__title'))
 
 # Added as part of challenge!
 from django.contrib.auth.mixins import PermissionRequiredMixin
 
 # Added as part of challenge!
-class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
+class LoanedBooksAllListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
     """Generic class-based view listing all books on loan. Only visible to users with can_mark_returned permission."""
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
@@ -123,7 +309,42 @@ class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        return (BookInstance.objects.on_loan().with_overdue()
+                .select_related('book', 'borrower')
+                .only('id', 'due_back', 'book__id', 'book__title', 'borrower__username'))
+
+
+# 逾期報表：status='o' AND due_back < today 是 catalog_bi_status_due_idx 上的一段範圍掃描
+class OverdueLoansListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
+    """Overdue loans, oldest due date first, with counts of overdue and soon-due loans."""
+    model = BookInstance
+    permission_required = 'catalog.can_mark_returned'
+    template_name = 'catalog/bookinstance_list_overdue.html'
+    paginate_by = 20
+    due_soon_days = 7
+
+    def get_queryset(self):
+        self.today = datetime.date.today()
+        return (BookInstance.objects.overdue(self.today)
+                .select_related('book', 'borrower')
+                .only('id', 'due_back', 'book__id', 'book__title', 'borrower__username', 'borrower__email'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['today'] = self.today
+        context['overdue_count'] = BookInstance.objects.overdue(self.today).count()
+        context['due_soon_days'] = self.due_soon_days
+        context['due_soon_count'] = BookInstance.objects.due_within(self.due_soon_days, self.today).count()
+        return context
+
+
+# 借閱統計：只讀 rollup_circulation 產生的每日彙總表，不掃描借閱紀錄本身
+@permission_required('catalog.can_mark_returned')
+def circulation_report(request):
+    """Checkouts, renewals and returns per day and the most borrowed books, over ?days= (default 30)."""
+    days = request.GET.get('days', '')
+    days = min(int(days), 366) if days.isdigit() and int(days) > 0 else 30
+    return render(request, 'catalog/circulation_report.html', rollups.circulation_report(days))
 
 
 
@@ -153,11 +374,11 @@ def renew_book_librarian(request, pk):
         # Check if the form is valid:
         if form.is_valid():
             # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            book_inst.due_back = form.cleaned_data['renewal_date']
-            book_inst.save()
-
-            # redirect to a new URL:
-            return HttpResponseRedirect(reverse('all-borrowed') )
+            # 經由 circulation.renew 寫入，續借才會記進借閱紀錄
+            if circulation.renew(book_inst.pk, form.cleaned_data['renewal_date']):
+                # redirect to a new URL:
+                return HttpResponseRedirect(reverse('all-borrowed') )
+            form.add_error(None, 'This copy is not on loan.')
 
     # If this is a GET (or any other method) create the default form.
     else:
@@ -193,10 +414,9 @@ def renew_book_librarian_modelform(request, pk):
         if form.is_valid():
             # 用modelform方式實做的話，與之前的差異點：欄位名稱需改成due_back
             # book_inst.due_back = form.cleaned_data['renewal_date']
-            book_inst.due_back = form.cleaned_data['due_back']
-            book_inst.save()
-
-            return HttpResponseRedirect(reverse('all-borrowed'))
+            if circulation.renew(book_inst.pk, form.cleaned_data['due_back']):
+                return HttpResponseRedirect(reverse('all-borrowed'))
+            form.add_error(None, 'This copy is not on loan.')
 
     else:
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
@@ -209,6 +429,33 @@ def renew_book_librarian_modelform(request, pk):
 
 
 
+# 一次續借 / 歸還多本書 (期末處理用)：日期只驗證一次，再用一個 UPDATE ... WHERE id IN (...) 套用
+from collections import Counter
+from .circulation import bulk_renew, bulk_return, copy_titles
+from .forms import BulkRenewForm
+
+
+@permission_required('catalog.can_mark_returned')
+def renew_books_bulk(request):
+    """View function for renewing or returning many BookInstances at once."""
+    if request.method != 'POST':
+        return HttpResponseRedirect(reverse('all-borrowed'))
+
+    form = BulkRenewForm(request.POST)
+    rows = summary = None
+    if form.is_valid():
+        copies = form.cleaned_data['copies']
+        if form.cleaned_data['action'] == BulkRenewForm.RENEW:
+            results = bulk_renew(copies, form.cleaned_data['renewal_date'])
+        else:
+            results = bulk_return(copies)
+        titles = copy_titles(results)
+        rows = [(pk, titles.get(pk), result) for pk, result in results.items()]
+        summary = sorted(Counter(results.values()).items())
+
+    return render(request, 'catalog/bookinstance_bulk_renew.html', {'form': form, 'rows': rows, 'summary': summary})
+
+
 #modelform實做範例
 #利用Django的skeleton快速建立create, update, delete功能
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
@@ -239,14 +486,17 @@ from django.views import generic
 #這是class-based views的限制網頁必須登入的作法
 from django.contrib.auth.mixins import LoginRequiredMixin
 
-class AuthorListView(LoginRequiredMixin, generic.ListView):
+@method_decorator(read_replica, name='dispatch')
+class AuthorListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
 # class AuthorListView(generic.ListView):
     model = Author
     #透過定義get_queryset()就可以自己定義想要的資料
     #沒有要自定義的話就註解掉get_queryset()
     def get_queryset(self):
         # return Author.objects.filter(title__icontains='bike')[:5] #取前五筆資料，title包含關鍵字'bike'的
-        return Author.objects.filter()[:100] #取前100筆資料
+        # return Author.objects.filter()[:100] #取前100筆資料
+        # 改用 cursor 分頁之後不能先切片，排序 (last_name, first_name) 交給 CursorPaginationMixin
+        return Author.objects.all()
     #等等要去哪個路徑找.html檔案
     #不定義這個template_name的話，Django就會去預設的路徑尋找.html
     #預設的路徑是：/locallibrary/catalog/templates/catalog/author_list.html
@@ -265,3 +515,16 @@ class AuthorListView(LoginRequiredMixin, generic.ListView):
     #這是分頁機制, 以下設定每頁最多10筆資料
     paginate_by = 10
 
+
+
+
+#staff 限定的 request 統計 (Prometheus text format)
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse
+from .metrics import registry as metrics_registry
+
+
+@staff_member_required
+def request_metrics(request):
+    """Per-view request timings and query counts of this process, for Prometheus to scrape."""
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -41,7 +41,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'catalog.middleware.RequestMetricsMiddleware',              # 每個 request 的時間 / SQL 統計，見 /catalog/_metrics
     'django.middleware.security.SecurityMiddleware',
+    'catalog.middleware.StaticFilesMiddleware',                 # collectstatic 過的檔案: immutable 快取 + 預先壓縮的 .br / .gz
     'django.contrib.sessions.middleware.SessionMiddleware',     # Part 7, session  # Part 8, Authentication: Manages sessions across requests
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -52,22 +54,35 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'locallibrary.urls'
 
+# 正式環境 (DEBUG 關閉) 用 cached loader，每個 template 只讀檔、編譯一次；
+# `python manage.py check --deploy` 會檢查 (catalog.W001)
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if not DEBUG:
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': ['./templates',],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.context_processors.sidebar',       # base_generic.html 側欄的快取 key 與網址
             ],
+            'loaders': TEMPLATE_LOADERS,
         },
     },
 ]
 
+# Seconds a rendered sidebar fragment stays cached per visitor kind; 0 turns it off (see catalog/context_processors.py)
+CATALOG_SIDEBAR_CACHE_TIMEOUT = 60 * 60
+
 WSGI_APPLICATION = 'locallibrary.wsgi.application'
 
 # Session
@@ -81,13 +96,85 @@ WSGI_APPLICATION = 'locallibrary.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# 由環境變數設定，預設仍是專案目錄下的 db.sqlite3
+#   DJANGO_DB_ENGINE / NAME / USER / PASSWORD / HOST / PORT
+#   DJANGO_DB_CONN_MAX_AGE: 連線保留秒數 (persistent connections)，0 表示每個 request 重新連線
+#   DJANGO_DB_REPLICAS: 逗號分隔的唯讀副本主機，書目等唯讀頁面會從副本讀取 (見 catalog/db.py)
+#   DJANGO_SQLITE_TUNING=1: SQLite 改用 WAL 等 PRAGMA 與 BEGIN IMMEDIATE 的 backend。預設關閉，
+#     因為 journal_mode=wal 會改寫資料庫檔頭並留下 -wal / -shm 檔，版本控制中的 db.sqlite3 會因此變動；
+#     正式環境請指向版本控制之外的資料庫 (DJANGO_DB_NAME) 再打開
+SQLITE_TUNING = os.environ.get('DJANGO_SQLITE_TUNING', '0') == '1'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # catalog.backends.sqlite3 是以 BEGIN IMMEDIATE 開始交易的 SQLite (見該模組說明)
+        'ENGINE': os.environ.get(
+            'DJANGO_DB_ENGINE', 'catalog.backends.sqlite3' if SQLITE_TUNING else 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get('DJANGO_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('DJANGO_DB_USER', ''),
+        'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+        'HOST': os.environ.get('DJANGO_DB_HOST', ''),
+        'PORT': os.environ.get('DJANGO_DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', '60')),
     }
 }
 
+CATALOG_READ_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), start=1):
+    alias = f'replica{number}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+    CATALOG_READ_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['catalog.db.ReadReplicaRouter']
+
+# Close persistent connections that stopped responding at the start of each request.
+# 預設關閉：檢查是每個 request、每條連線一次 SELECT 1，連匿名頁面快取 (不碰資料庫) 的 request 也要多一趟來回；
+# Django 本身在 request 結束時已會關掉出錯或超過 CONN_MAX_AGE 的連線，只有資料庫常在閒置時斷線
+# (例如有 idle timeout 的 proxy) 才值得用 DJANGO_DB_HEALTH_CHECKS=1 打開
+CATALOG_DB_HEALTH_CHECKS = os.environ.get('DJANGO_DB_HEALTH_CHECKS', '0') == '1'
+
+# PRAGMAs run on every new SQLite connection with DJANGO_SQLITE_TUNING=1; otherwise SQLite's defaults.
+# WAL 讓讀取不會被寫入擋住；synchronous=NORMAL 在 WAL 下仍然安全 (斷電最多遺失最後幾筆交易)
+CATALOG_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,           # 毫秒
+    'mmap_size': 128 * 1024 * 1024,
+} if SQLITE_TUNING else {}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# 預設使用 local-memory cache；正式環境請改用 memcached / redis 這類共用的 backend，
+# 這樣 `manage.py warm_catalog_stats` 預熱的快取才會被所有 worker 共用。
+# 頁面快取與 API ETag 用的版本戳記也放在這裡，不共用的話 `check --deploy` 會警告 (catalog.W002)。
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'locallibrary'),
+    }
+}
+
+# Seconds the home page catalog counters stay cached (see catalog/stats.py)
+CATALOG_STATS_TIMEOUT = 60 * 15
+
+# Seconds anonymous catalog pages stay cached; 0 turns the page cache off (see catalog/caching.py)
+CATALOG_PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Seconds the book list facet counts stay cached per filter combination; 0 turns it off (see catalog/facets.py)
+CATALOG_FACET_CACHE_TIMEOUT = 60 * 10
+
+
+# Request metrics (see catalog/middleware.py and catalog/metrics.py)
+# 設定環境變數 CATALOG_REQUEST_METRICS=0 可以關掉
+CATALOG_REQUEST_METRICS = os.environ.get('CATALOG_REQUEST_METRICS', '1') != '0'
+
+# Log a warning when a request repeats this many queries (likely N+1)
+CATALOG_DUPLICATE_QUERY_THRESHOLD = 5
+
+# Latest requests per view used for the p50/p90/p99 gauges
+CATALOG_METRICS_WINDOW = 1000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -128,6 +215,14 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# python manage.py collectstatic 的輸出目錄；有這個目錄時由 catalog.middleware.StaticFilesMiddleware 直接提供
+STATIC_ROOT = os.environ.get('DJANGO_STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+# 正式環境: 檔名加上內容 hash (styles.1a2b3c4d5e6f.css)，並預先寫好 .gz / .br 檔
+# DEBUG 時 {% static %} 不查 staticfiles.json，所以只在非 DEBUG 時使用
+if not DEBUG:
+    STATICFILES_STORAGE = 'catalog.storage.CompressedManifestStaticFilesStorage'
+
 # Part 8
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'